@@ -1,104 +1,148 @@
 # This file goes through all folders in the need_to_be_processed directory, and for each file, it creates a backup in the original_files directory, and parses the file, adding it to the PARSED directory. It also adds a record to the master_score_list table in the database.
 
-import json
 import logging
 import multiprocessing
 import os
 import shutil
-import sqlite3
-import subprocess
-import sys
 import time
 from contextlib import contextmanager
-from datetime import datetime
 from pathlib import Path
 
-import git
-import joblib
-from joblib import Parallel, delayed
-from parsing_musicxml import parse_multitrack_score
-from tqdm import tqdm
+from db_snapshots import snapshot_in_background
+from job_journal import (
+    COMMITTED,
+    DROPPED,
+    FAILED,
+    PARSED,
+    PARSING,
+    QUEUED,
+    SCORE_EXTENSIONS,
+    STAGING_DIR,
+    WRITTEN,
+    enqueue,
+    load_staged,
+    mark_parsing,
+    set_state,
+    setup_journal_table,
+    stage_parsed,
+    staged_path_for,
+    unfinished_jobs,
+    write_json_durably,
+)
+from job_journal import connect as connect_journal
+from parsing_musicxml import merge_units, parse_multitrack_score, parse_score_unit
+from pipeline_metrics import MetricsRegistry, get_registry, increment, span, use_registry
+from profiling import PROFILE_DIR, peak_rss_mb, profile_call, reset_peak_rss, save_profile
+from score_splitter import MEASURES_PER_UNIT, SPLIT_MIN_BYTES, plan_units
+from write_behind import write_behind
+
+# Opt-in: re-run any file that parses slower or bigger than these under a profiler
+PROFILE_SLOW_FILES = False
+PROFILE_TIME_THRESHOLD_SECONDS = 60
+PROFILE_MEMORY_THRESHOLD_MB = 1024
 
 
 # logging
-def setup_logging(log_dir="logs"):
+def process_single_file(
+    file_path,
+    composer_name,
+    record_id=None,
+    profile_config=None,
+    journal_db=None,
+    staging_dir=STAGING_DIR,
+):
     """
-    Set up logging configuration for the entire application.
-    Creates a new log file with timestamp for each run.
+    Process a single MusicXML file in a worker process.
 
     Args:
-        log_dir: Directory where log files will be stored
+        file_path: MusicXML file to parse
+        composer_name: Composer folder the file came from
+        record_id: Its master_score_list id (used to tag profiles)
+        profile_config: None, or a dict with "seconds", "memory_mb" and "dir". If the
+            parse goes over either threshold it's re-run under cProfile/tracemalloc
+            and the profile is saved to "dir".
+        journal_db: Database holding ingest_journal. If given, the job is marked
+            parsing before the parse and the result is staged (and marked parsed)
+            right after, so a crash later in the run doesn't throw the parse away.
+        staging_dir: Where staged results go
 
     Returns:
-        A configured logger instance
+        (parsed data or None, snapshot of the metrics recorded while parsing)
     """
-    log_path = Path(log_dir)
-    log_path.mkdir(exist_ok=True)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_name = f"musicxml_processing_{timestamp}.log"
-    log_file = log_path / log_name
-
-    print(f"Logging to: {log_file}")
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    if root_logger.handlers:
-        root_logger.handlers.clear()
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
-
-    return logging.getLogger(__name__)
-
-
-def process_single_file(file_path, composer_name):
-    """Process a single MusicXML file and return the parsed data"""
     logger = logging.getLogger(__name__)
     logger.info(f"Processing file: {file_path}")
 
-    try:
-        parsed_data = parse_multitrack_score(file_path, composer=composer_name)
-        return parsed_data
-    except Exception as e:
-        logger.exception(f"Error processing file {file_path}: {e}")
-        return None
-
-
-def commit_and_push_to_github(file_path, commit_message):
-    # I did this because I reallllllly didn't want to lose any files ever
-    logger = logging.getLogger(__name__)
-
-    try:
-        # get the repository path (assuming the script is inside the repository)
-        repo_path = "/home/leahm/MusicXML/NeurAllegro"
-
-        repo = git.Repo(repo_path)
-        relative_path = os.path.relpath(file_path, repo_path)
-        logger.info(f"Adding file {relative_path} to git staging")
-        repo.git.add(relative_path)
-        logger.info(f"Creating commit: {commit_message}")
-        repo.git.commit("-m", commit_message)
+    # workers can't write into the parent's registry, so record locally and send it back
+    with use_registry(MetricsRegistry()) as worker_metrics:
+        if journal_db is not None:
+            try:
+                mark_parsing(journal_db, record_id)
+            except Exception as e:
+                logger.error(f"Couldn't mark job {record_id} as parsing: {e}")
+        reset_peak_rss()
+        started = time.perf_counter()
+        try:
+            with span("parse", file_path):
+                parsed_data = parse_multitrack_score(file_path, composer=composer_name)
+        except Exception as e:
+            logger.exception(f"Error processing file {file_path}: {e}")
+            parsed_data = None
+        elapsed = time.perf_counter() - started
+        peak_mb = peak_rss_mb()
+
+        if journal_db is not None and parsed_data is not None:
+            try:
+                with span("stage", file_path):
+                    stage_parsed(journal_db, record_id, parsed_data, staging_dir)
+            except Exception as e:
+                # the parent still gets the data and stages it itself
+                logger.error(f"Couldn't stage parse result for job {record_id}: {e}")
+
+        too_slow = profile_config is not None and elapsed > profile_config["seconds"]
+        too_big = profile_config is not None and peak_mb > profile_config["memory_mb"]
+        if too_slow or too_big:
+            reason = (
+                f"parse took {elapsed:.1f}s (threshold {profile_config['seconds']}s), "
+                f"peak RSS {peak_mb:.0f} MB (threshold {profile_config['memory_mb']} MB)"
+            )
+            logger.warning(f"Profiling {file_path}: {reason}")
+            try:
+                # forceSource, or we'd just be profiling music21 loading its own pickle
+                _, profiler, report = profile_call(
+                    parse_multitrack_score,
+                    file_path,
+                    composer=composer_name,
+                    force_source=True,
+                    trace_memory=too_big,
+                )
+                report_path = save_profile(
+                    file_path, record_id, profiler, report, reason, profile_config["dir"]
+                )
+                logger.warning(f"Saved profile for {file_path} to {report_path}")
+                worker_metrics.increment("files_profiled")
+            except Exception as e:
+                logger.exception(f"Failed to profile {file_path}: {e}")
+    return parsed_data, worker_metrics.snapshot()
 
-        logger.info("Pushing to remote repository")
-        repo.git.push()
 
-        logger.info("Successfully pushed database to GitHub")
-        return True
+def process_score_unit(unit):
+    """
+    Parse one work unit of a split score in a worker process.
 
-    except git.GitCommandError as e:
-        logger.error(f"Git command error: {e}")
-        return False
-    except Exception as e:
-        logger.exception(f"Error committing to GitHub: {e}")
-        return False
+    Returns:
+        (the unit's part dicts or None, snapshot of the metrics recorded while parsing)
+    """
+    with use_registry(MetricsRegistry()) as worker_metrics:
+        with span("parse_unit", unit["path"]):
+            parts = parse_score_unit(unit["path"])
+    return parts, worker_metrics.snapshot()
 
 
 @contextmanager
 def tqdm_joblib(total=None, desc="Processing", **kwargs):
     """Context manager to patch joblib to report into tqdm progress bar"""
+    import joblib
+    from tqdm import tqdm
 
     class TqdmBatchCompletionCallback(joblib.parallel.BatchCompletionCallBack):
         def __call__(self, *args, **kwargs):
@@ -118,21 +162,160 @@ def tqdm_joblib(total=None, desc="Processing", **kwargs):
         tqdm_object.close()
 
 
-def process_musicxml_files():
+def finish_job(conn, job, processed_file, processed_dir, writer=None):
+    """
+    Take a parsed (or written) job the rest of the way: dedup check, assign the new
+    title, write the final JSON, index it and remove the source file. Every step is
+    safe to repeat, so a job interrupted anywhere in here can just be run again.
+
+    With a writer (write_behind.WriteBehind) the final JSON is written in the
+    background while the job is indexed, and the job is left "written" with the
+    write's future in job["write"]; call commit_job once that's done.
+
+    Returns:
+        The state the job ended in (COMMITTED or DROPPED, or WRITTEN with a writer)
+    """
+    # dedup and the indexes need numpy; imported here so the parse workers (which
+    # import this module for process_single_file) don't load it
+    from deduplicator import check_and_register_score
+    from feature_catalog import catalog_score
+    from pattern_index import index_score
+
+    logger = logging.getLogger(__name__)
+    record_id = job["record_id"]
+    file_path = job["source_path"]
+    composer_name = job["composer"]
+
+    if job["state"] == PARSED:
+        with span("dedup", file_path):
+            keep_file = check_and_register_score(conn, record_id, processed_file)
+        if not keep_file:
+            # DEDUP_POLICY is "drop": forget the record and the source file, the backup copy is still in original_files
+            logger.info(
+                f"Dropping near-duplicate file {file_path} and its database record {record_id}"
+            )
+            with conn:
+                conn.execute(
+                    "DELETE FROM master_score_list WHERE rowid = ?", (record_id,)
+                )
+                set_state(conn, record_id, DROPPED)
+            Path(file_path).unlink(missing_ok=True)
+            staged_path_for(record_id).unlink(missing_ok=True)
+            increment("files_duplicate")
+            return DROPPED
+
+        with span("sqlite", file_path):
+            # the title and the journal move to "written" together
+            with conn:
+                result = conn.execute(
+                    "SELECT MAX(index_number) FROM master_score_list WHERE composer = ? AND index_number IS NOT NULL",
+                    (composer_name,),
+                ).fetchone()
+                max_index = result[0] if result and result[0] is not None else -1
+                new_index = max_index + 1
+                new_file_name = f"{composer_name}{new_index}.json"
+                conn.execute(
+                    "UPDATE master_score_list SET new_title = ?, index_number = ? WHERE rowid = ?",
+                    (new_file_name, new_index, record_id),
+                )
+                final_path = processed_dir / composer_name / new_file_name
+                set_state(conn, record_id, WRITTEN, final_path=str(final_path))
+        job["state"] = WRITTEN
+        job["final_path"] = str(final_path)
+
+    final_processed_file_path = Path(job["final_path"])
+    if writer is None:
+        with span("json_dump", file_path):
+            write_json_durably(final_processed_file_path, processed_file, indent=2)
+        logger.info(f"Saved processed file for {file_path} to {final_processed_file_path}")
+    else:
+        job["write"] = writer.write_json(
+            final_processed_file_path, processed_file, indent=2, durable=True
+        )
+
+    # keep the motif search index up to date as files come in
+    with span("pattern_index", file_path):
+        index_score(conn, record_id, processed_file)
+    # and the feature catalog, so datasets can be picked with SQL
+    with span("feature_catalog", file_path):
+        catalog_score(conn, record_id, processed_file)
+
+    if writer is not None:
+        return WRITTEN
+    return commit_job(conn, job)
+
+
+def commit_job(conn, job):
+    """
+    Last step of finish_job, once the final JSON is on disk: remove the source file
+    and mark the job committed.
+
+    Returns:
+        COMMITTED
+    """
+    logger = logging.getLogger(__name__)
+    record_id = job["record_id"]
+    file_path = job["source_path"]
+
+    # Only remove successfully processed files, and keep the failed ones in the original location
+    original_file_path = Path(file_path)
+    if original_file_path.exists():
+        original_file_path.unlink()  # Delete the file
+        logger.info(f"Removed original file: {original_file_path}")
+    else:
+        logger.warning(f"Original file not found for removal: {original_file_path}")
+
+    with conn:
+        set_state(conn, record_id, COMMITTED)
+    if job.get("staged_path"):
+        Path(job["staged_path"]).unlink(missing_ok=True)
+    increment("files_parsed")
+    return COMMITTED
+
+
+def process_musicxml_files(
+    profile_slow_files=PROFILE_SLOW_FILES,
+    split_min_bytes=SPLIT_MIN_BYTES,
+    measures_per_unit=MEASURES_PER_UNIT,
+):
+    """
+    Ingest everything in the inbox (and resume unfinished jobs).
+
+    Args:
+        profile_slow_files: Re-run slow or memory-heavy parses under the profiler
+            (whole files only, not the work units of split scores)
+        split_min_bytes: Files with at least this much MusicXML are split into work
+            units (see score_splitter.py) so their parts parse in parallel
+        measures_per_unit: Also cut the parts of split files into chunks of this
+            many measures
+    """
+    from deduplicator import DEDUP_POLICY, setup_dedup_tables
+    from feature_catalog import setup_catalog_tables
+    from pattern_index import setup_pattern_tables
+
     logger = logging.getLogger(__name__)
     logger.info("Starting MusicXML processing script")
 
     try:
         db_path = "score_database.db"
-        conn = sqlite3.connect(db_path)
+        conn = connect_journal(db_path)
         cursor = conn.cursor()
+        setup_dedup_tables(conn)
+        setup_pattern_tables(conn)
+        setup_catalog_tables(conn)
+        setup_journal_table(conn)
 
         base_dir = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
         need_to_be_processed_dir = base_dir / "need_to_be_processed_test"
         processed_original_files_dir = base_dir / "original_files"
         processed_dir = base_dir / "parsed"
 
-        tasks = []
+        # pick up whatever the last run didn't finish (crash, Ctrl-C, power cut...)
+        jobs = unfinished_jobs(conn)
+        if jobs:
+            logger.info(f"Resuming {len(jobs)} unfinished jobs from a previous run")
+            print(f"Resuming {len(jobs)} unfinished jobs from a previous run")
+        resumed_sources = {job["source_path"] for job in jobs}
 
         # iterate over each composer folder
         for composer_folder in need_to_be_processed_dir.iterdir():
@@ -165,112 +348,189 @@ def process_musicxml_files():
                     )
                 # iterate over each file in the composer folder.
                 for score_file in composer_folder.iterdir():
-                    if score_file.is_file() and score_file.suffix.lower() in [
-                        ".xml",
-                        ".musicxml",
-                    ]:
-                        original_title = score_file.stem
-                        cursor.execute(
-                            "INSERT INTO master_score_list (new_title, original_title, composer) VALUES (?, ?, ?)",
-                            (None, original_title, composer_name),
-                        )
-                        record_id = cursor.lastrowid
-                        conn.commit()
-
+                    if (
+                        score_file.is_file()
+                        and score_file.suffix.lower() in SCORE_EXTENSIONS
+                    ):
+                        if str(score_file) in resumed_sources:
+                            continue
+
+                        # back up first, so a queued job always has its backup copy
                         backup_composer_dir = (
                             processed_original_files_dir / composer_name
                         )
                         backup_composer_dir.mkdir(parents=True, exist_ok=True)
                         backup_file_path = backup_composer_dir / score_file.name
-                        shutil.copy2(score_file, backup_file_path)
+                        with span("backup_copy", score_file):
+                            shutil.copy2(score_file, backup_file_path)
                         logger.info(f"Copied {score_file} to backup {backup_file_path}")
 
-                        tasks.append((str(score_file), composer_name, record_id))
+                        with span("sqlite", score_file):
+                            record_id = enqueue(
+                                conn, score_file, composer_name, score_file.stem
+                            )
+                        jobs.append(
+                            {
+                                "record_id": record_id,
+                                "source_path": str(score_file),
+                                "composer": composer_name,
+                                "state": QUEUED,
+                                "staged_path": None,
+                                "final_path": None,
+                            }
+                        )
 
-        total_files = len(tasks)
+        # jobs that got as far as "parsed" are loaded from staging instead of parsed again
+        to_parse = [job for job in jobs if job["state"] in (QUEUED, PARSING)]
+        total_files = len(to_parse)
         print(f"Found {total_files} MusicXML files to parse")
 
-        n_jobs = min(multiprocessing.cpu_count(), total_files)
-        print(f"Using {n_jobs} cores for parallel processing")
+        journal_db = os.path.abspath(db_path)
+        # big scores become one task per part (or measure range), everything else is
+        # one task per file; both go into the same pool
+        tasks = []
+        split_jobs = {}
+        for job in to_parse:
+            units_dir = STAGING_DIR / "units" / str(job["record_id"])
+            with span("split_score", job["source_path"]):
+                units = plan_units(
+                    job["source_path"], units_dir, measures_per_unit, split_min_bytes
+                )
+            if units:
+                # no single worker owns the file, so it's marked parsing here
+                mark_parsing(journal_db, job["record_id"])
+                split_jobs[job["record_id"]] = (job, units_dir)
+                increment("files_split")
+                increment("work_units", len(units))
+                tasks.extend((job, unit, unit["bytes"]) for unit in units)
+            else:
+                tasks.append((job, None, os.path.getsize(job["source_path"])))
+        # biggest first, so the long parses don't all end up at the tail of the run
+        tasks.sort(key=lambda task: task[2], reverse=True)
 
-        logger.info(f"Starting parallel processing of {total_files} files")
+        n_jobs = max(1, min(multiprocessing.cpu_count(), len(tasks)))
+        print(f"Using {n_jobs} cores for parallel processing")
 
-        file_paths = [t[0] for t in tasks]
-        composer_names = [t[1] for t in tasks]
+        logger.info(
+            f"Starting parallel processing of {total_files} files "
+            f"({len(tasks)} tasks, {len(split_jobs)} files split)"
+        )
 
-        with tqdm_joblib(total=total_files, desc="Parsing files"):
-            processed_results = Parallel(
-                n_jobs=n_jobs, backend="multiprocessing", verbose=0
-            )(
-                delayed(process_single_file)(file_path, composer_name)
-                for file_path, composer_name in zip(file_paths, composer_names)
-            )
+        profile_config = None
+        if profile_slow_files:
+            profile_config = {
+                "seconds": PROFILE_TIME_THRESHOLD_SECONDS,
+                "memory_mb": PROFILE_MEMORY_THRESHOLD_MB,
+                "dir": str(PROFILE_DIR),
+            }
+            logger.info(f"Profiling slow files, thresholds: {profile_config}")
+
+        processed_results = []
+        if to_parse:
+            # imported here so the parse workers (which import this module to find
+            # process_single_file) and a no-op run don't load them for nothing
+            from joblib import Parallel, delayed
+
+            with tqdm_joblib(total=len(tasks), desc="Parsing files"):
+                processed_results = Parallel(
+                    n_jobs=n_jobs, backend="multiprocessing", verbose=0
+                )(
+                    delayed(process_single_file)(
+                        job["source_path"],
+                        job["composer"],
+                        job["record_id"],
+                        profile_config,
+                        journal_db,
+                        str(STAGING_DIR),
+                    )
+                    if unit is None
+                    else delayed(process_score_unit)(unit)
+                    for job, unit, _ in tasks
+                )
 
         logger.info("Parallel processing completed")
         print("Parsing attempted. Updating database and saving results...")
 
         successful_files = 0
+        duplicate_files = 0
         failed_files = set()
-
-        for (file_path, composer_name, record_id), processed_file in zip(
-            tasks, processed_results
-        ):
-            if processed_file is None:
-                logger.error(
-                    f"Processing failed for {file_path}, removing database record"
+        unfinished_files = set()
+
+        metrics = get_registry()
+        parsed_by_record = {}
+        units_by_record = {}
+        for (job, unit, _), (result, worker_metrics) in zip(tasks, processed_results):
+            metrics.merge(worker_metrics)
+            if unit is None:
+                parsed_by_record[job["record_id"]] = result
+            else:
+                units_by_record.setdefault(job["record_id"], []).append((unit, result))
+        for record_id, (job, units_dir) in split_jobs.items():
+            with span("merge_units", job["source_path"]):
+                parsed_by_record[record_id] = merge_units(
+                    job["source_path"], job["composer"], units_by_record.get(record_id, [])
                 )
+            shutil.rmtree(units_dir, ignore_errors=True)
+
+        # final JSON writes go to background I/O threads while the next job is
+        # indexed; a job is only committed once its write is on disk
+        written_jobs = []
+        with write_behind() as writer:
+            for job in jobs:
+                record_id = job["record_id"]
+                file_path = job["source_path"]
                 try:
-                    cursor.execute(
-                        "DELETE FROM master_score_list WHERE rowid = ?", (record_id,)
-                    )
-                    conn.commit()
-                    logger.info(
-                        f"Removed database record with ID {record_id} for failed file {file_path}"
-                    )
+                    if job["state"] in (QUEUED, PARSING):
+                        processed_file = parsed_by_record.get(record_id)
+                        if processed_file is None:
+                            increment("files_failed")
+                            logger.error(
+                                f"Processing failed for {file_path}, removing database record"
+                            )
+                            with conn:
+                                conn.execute(
+                                    "DELETE FROM master_score_list WHERE rowid = ?",
+                                    (record_id,),
+                                )
+                                set_state(conn, record_id, FAILED, error="parse failed")
+                            logger.info(
+                                f"Removed database record with ID {record_id} for failed file {file_path}"
+                            )
+                            failed_files.add(file_path)
+                            continue
+                        staged_path = staged_path_for(record_id)
+                        if not staged_path.exists():
+                            # the worker couldn't stage it, so do it here
+                            stage_parsed(db_path, record_id, processed_file)
+                        job["state"] = PARSED
+                        job["staged_path"] = str(staged_path)
+                    else:
+                        processed_file = load_staged(job)
+
+                    state = finish_job(conn, job, processed_file, processed_dir, writer)
+                    if state == DROPPED:
+                        duplicate_files += 1
+                    elif state == WRITTEN:
+                        written_jobs.append(job)
+                    else:
+                        successful_files += 1
                 except Exception as e:
-                    logger.error(
-                        f"Failed to remove database record with ID {record_id}: {e}"
+                    # leave it in the journal, the next run picks it up again
+                    logger.exception(
+                        f"Couldn't finish {file_path} (job {record_id}, state {job['state']}): {e}"
                     )
-
-                failed_files.add(file_path)
-                continue
-
-            cursor.execute(
-                "SELECT MAX(index_number) FROM master_score_list WHERE composer = ? AND index_number IS NOT NULL",
-                (composer_name,),
-            )
-            result = cursor.fetchone()
-            max_index = result[0] if result and result[0] is not None else -1
-            new_index = max_index + 1
-            new_file_name = f"{composer_name}{new_index}.json"
-            cursor.execute(
-                "UPDATE master_score_list SET new_title = ?, index_number = ? WHERE rowid = ?",
-                (new_file_name, new_index, record_id),
-            )
-            conn.commit()
-
-            processed_composer_dir = processed_dir / composer_name
-            processed_composer_dir.mkdir(parents=True, exist_ok=True)
-            final_processed_file_path = processed_composer_dir / new_file_name
-
-            with open(final_processed_file_path, "w", encoding="utf-8") as f:
-                json.dump(processed_file, f, indent=2)
-
-            logger.info(
-                f"Saved processed file for {file_path} to {final_processed_file_path}"
-            )
-
-            # Only remove successfully processed files, and keep the failed ones in the original location
-            original_file_path = Path(file_path)
-            if original_file_path.exists():
-                original_file_path.unlink()  # Delete the file
-                logger.info(f"Removed original file: {original_file_path}")
-            else:
-                logger.warning(
-                    f"Original file not found for removal: {original_file_path}"
+                    unfinished_files.add(file_path)
+
+        for job in written_jobs:
+            try:
+                job.pop("write").result()
+                commit_job(conn, job)
+                successful_files += 1
+            except Exception as e:
+                logger.exception(
+                    f"Couldn't finish {job['source_path']} (job {job['record_id']}, state {job['state']}): {e}"
                 )
-
-            successful_files += 1
+                unfinished_files.add(job["source_path"])
 
         logger.info(
             f"Failed to parse {len(failed_files)} files. These will remain in their original location."
@@ -278,6 +538,14 @@ def process_musicxml_files():
         print(
             f"Parsed {successful_files} files successfully. Failed to parse {len(failed_files)} files."
         )
+        if duplicate_files > 0:
+            print(
+                f"Dropped {duplicate_files} near-duplicate files (DEDUP_POLICY = {DEDUP_POLICY})."
+            )
+        if unfinished_files:
+            print(
+                f"{len(unfinished_files)} files couldn't be finished and will be resumed on the next run."
+            )
 
         logger.info("Cleaning up the need_to_be_processed directory")
         for root, dirs, files in os.walk(need_to_be_processed_dir, topdown=False):
@@ -291,8 +559,12 @@ def process_musicxml_files():
                 if file_path_str in failed_files:
                     logger.info(f"Keeping file that failed to parse: {file_path}")
                     continue
+                # and files the next run still has to finish
+                if file_path_str in unfinished_files:
+                    logger.info(f"Keeping unfinished file: {file_path}")
+                    continue
 
-                is_musicxml = file.lower().endswith((".xml", ".musicxml"))
+                is_musicxml = file.lower().endswith(SCORE_EXTENSIONS)
 
                 # If it's not a musicxml file or if it's a musicxml file that was processed successfully, we remove it
                 if not is_musicxml or file_path_str not in failed_files:
@@ -316,16 +588,10 @@ def process_musicxml_files():
         conn.close()
 
         if successful_files > 0:
-            db_absolute_path = os.path.abspath(db_path)
-            commit_message = f"Update database after parsing {successful_files} MusicXML files - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-
-            logger.info(f"Committing database to GitHub with message: {commit_message}")
-            if commit_and_push_to_github(db_absolute_path, commit_message):
-                print("Successfully backed up database to GitHub!")
-            else:
-                print(
-                    "WARNING: Failed to back up database to GitHub. Check logs for details."
-                )
+            # snapshot on a background thread so windowing can start right away
+            logger.info(f"Starting background snapshot of {db_path}")
+            snapshot_in_background(db_path, label="ingest")
+            print("Database snapshot started in the background.")
 
         logger.info("Parsing complete.")
         print("Parsing complete!")
@@ -0,0 +1,399 @@
+# Benchmark suite for the processing pipeline.
+#
+# Runs parse_multitrack_score, make_window, normalize_window and (on the way back)
+# write_musicxml over the bundled
+# corpus in data/unprocessed (Bach, Mozart and Leah, .xml/.musicxml/.mxl), optionally
+# copied several times over to simulate a bigger corpus, and measures per-stage
+# throughput, peak RSS and output bytes. Results are saved as JSON keyed by the git
+# commit, and compared against a stored baseline so regressions get flagged.
+#
+# Examples:
+#   python benchmark_pipeline.py --replicate 3
+#   python benchmark_pipeline.py --save-baseline
+#   python benchmark_pipeline.py --composers Bach --tolerance 0.15
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import music21
+import numpy as np
+from musicxml_writer import write_musicxml
+from normalizer import normalize_window
+from parsing_musicxml import parse_multitrack_score
+from profiling import peak_rss_mb, reset_peak_rss
+from windowser import make_window
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+CORPUS_DIR = REPO_DIR / "data" / "unprocessed"
+RESULTS_DIR = Path("benchmark_results")
+BASELINE_FILE = RESULTS_DIR / "baseline.json"
+SCORE_SUFFIXES = (".xml", ".musicxml", ".mxl")
+
+# higher is better for throughput, lower is better for memory and bytes
+HIGHER_IS_BETTER = ("files_per_s", "events_per_s", "windows_per_s")
+LOWER_IS_BETTER = ("peak_rss_mb", "output_bytes")
+
+
+def git_commit():
+    """The current commit hash, with "-dirty" if there are uncommitted changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def collect_corpus(corpus_dir=CORPUS_DIR, composers=None):
+    """Sorted (composer, path) pairs, so every run processes files in the same order."""
+    files = []
+    for composer_dir in sorted(d for d in Path(corpus_dir).iterdir() if d.is_dir()):
+        if composers and composer_dir.name not in composers:
+            continue
+        for score_file in sorted(composer_dir.iterdir()):
+            if score_file.is_file() and score_file.suffix.lower() in SCORE_SUFFIXES:
+                files.append((composer_dir.name, score_file))
+    return files
+
+
+def replicate_corpus(files, replicate, work_dir):
+    """
+    Copy the corpus `replicate` times into work_dir under new names.
+
+    They have to be real copies: music21 keeps a pickle of every file it has parsed,
+    and parsing the same path twice would just measure loading that pickle.
+    """
+    copies = []
+    input_dir = Path(work_dir) / "input"
+    for r in range(replicate):
+        for composer, score_file in files:
+            target_dir = input_dir / composer
+            target_dir.mkdir(parents=True, exist_ok=True)
+            target = target_dir / f"{score_file.stem}_r{r}{score_file.suffix}"
+            shutil.copy2(score_file, target)
+            copies.append((composer, target))
+    return copies
+
+
+def count_events(score_data):
+    measures = 0
+    events = 0
+    for part in score_data["parts"]:
+        measures += len(part["measure_data"])
+        for measure in part["measure_data"]:
+            events += len(measure["events"])
+    return measures, events
+
+
+class StageTimer:
+    """Measures wall time and peak RSS of one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.metrics = {}
+
+    def __enter__(self):
+        gc.collect()
+        reset_peak_rss()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics["seconds"] = time.perf_counter() - self.started
+        self.metrics["peak_rss_mb"] = peak_rss_mb()
+        return False
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else 0.0
+
+
+def bench_parse(copies, out_dir):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    parsed = []
+    failed = 0
+    measures = events = output_bytes = 0
+    with StageTimer("parse") as timer:
+        for composer, score_file in copies:
+            data = parse_multitrack_score(str(score_file), composer=composer)
+            if data is None:
+                failed += 1
+                continue
+            out_path = out_dir / f"{score_file.stem}.json"
+            with open(out_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            output_bytes += out_path.stat().st_size
+            m, e = count_events(data)
+            measures += m
+            events += e
+            parsed.append(data)
+    seconds = timer.metrics["seconds"]
+    stage = {
+        **timer.metrics,
+        "files": len(copies),
+        "failed_files": failed,
+        "measures": measures,
+        "events": events,
+        "files_per_s": rate(len(copies), seconds),
+        "events_per_s": rate(events, seconds),
+        "output_bytes": output_bytes,
+    }
+    return parsed, stage
+
+
+def bench_window(parsed, out_dir):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    windows = []
+    output_bytes = 0
+    with StageTimer("window") as timer:
+        for score_index, score_data in enumerate(parsed):
+            for i, window in enumerate(make_window(score_data, window_size=10, overlap=5)):
+                out_path = out_dir / f"{score_index}_{i}.json"
+                with open(out_path, "w") as f:
+                    json.dump(window, f)
+                output_bytes += out_path.stat().st_size
+                windows.append(window)
+    seconds = timer.metrics["seconds"]
+    events = sum(count_events(w)[1] for w in windows)
+    stage = {
+        **timer.metrics,
+        "files": len(parsed),
+        "windows": len(windows),
+        "events": events,
+        "files_per_s": rate(len(parsed), seconds),
+        "windows_per_s": rate(len(windows), seconds),
+        "events_per_s": rate(events, seconds),
+        "output_bytes": output_bytes,
+    }
+    return windows, stage
+
+
+def bench_normalize(windows, out_dir):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    output_bytes = 0
+    events = 0
+    arrays = []
+    with StageTimer("normalize") as timer:
+        for i, window in enumerate(windows):
+            array = normalize_window(window)
+            out_path = out_dir / f"{i}.npy"
+            np.save(out_path, array)
+            output_bytes += out_path.stat().st_size
+            events += int(np.count_nonzero(np.any(array != 0, axis=1)))
+            arrays.append(array)
+    seconds = timer.metrics["seconds"]
+    return arrays, {
+        **timer.metrics,
+        "windows": len(windows),
+        "events": events,
+        "windows_per_s": rate(len(windows), seconds),
+        "events_per_s": rate(events, seconds),
+        "output_bytes": output_bytes,
+    }
+
+
+def bench_write(arrays, windows, out_dir):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    output_bytes = 0
+    events = 0
+    with StageTimer("write_musicxml") as timer:
+        for i, (array, window) in enumerate(zip(arrays, windows)):
+            out_path = write_musicxml(array, out_dir / f"{i}.musicxml", window["parts"])
+            output_bytes += out_path.stat().st_size
+            events += int(np.count_nonzero(np.any(array != 0, axis=1)))
+    seconds = timer.metrics["seconds"]
+    return {
+        **timer.metrics,
+        "windows": len(arrays),
+        "events": events,
+        "windows_per_s": rate(len(arrays), seconds),
+        "events_per_s": rate(events, seconds),
+        "output_bytes": output_bytes,
+    }
+
+
+def run_benchmark(corpus_dir=CORPUS_DIR, replicate=1, composers=None, keep_outputs=False):
+    """
+    Run every stage over the corpus and return the result record.
+    """
+    music21.environment.set("autoDownload", "deny")
+    files = collect_corpus(corpus_dir, composers)
+    if not files:
+        raise ValueError(f"No scores found in {corpus_dir}")
+
+    work_dir = Path(tempfile.mkdtemp(prefix="neurallegro_bench_"))
+    try:
+        copies = replicate_corpus(files, replicate, work_dir)
+        input_bytes = sum(path.stat().st_size for _, path in copies)
+
+        started = time.perf_counter()
+        parsed, parse_stage = bench_parse(copies, work_dir / "parsed")
+        windows, window_stage = bench_window(parsed, work_dir / "windows")
+        arrays, normalize_stage = bench_normalize(windows, work_dir / "normalized")
+        write_stage = bench_write(arrays, windows, work_dir / "musicxml")
+        total_seconds = time.perf_counter() - started
+    finally:
+        if keep_outputs:
+            print(f"Benchmark outputs kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "music21": music21.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "corpus": {
+            "dir": str(corpus_dir),
+            "composers": sorted({c for c, _ in files}),
+            "unique_files": len(files),
+            "replicate": replicate,
+            "input_bytes": input_bytes,
+        },
+        "total_seconds": total_seconds,
+        "stages": {
+            "parse": parse_stage,
+            "window": window_stage,
+            "normalize": normalize_stage,
+            "write_musicxml": write_stage,
+        },
+    }
+
+
+def compare_to_baseline(result, baseline, tolerance=0.10):
+    """
+    Compare every tracked metric against the baseline.
+
+    Returns:
+        A list of human-readable regression messages (empty if nothing regressed)
+    """
+    regressions = []
+    for stage_name, stage in result["stages"].items():
+        base_stage = baseline.get("stages", {}).get(stage_name)
+        if not base_stage:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            if metric not in stage or not base_stage.get(metric):
+                continue
+            current = stage[metric]
+            previous = base_stage[metric]
+            change = (current - previous) / previous
+            if metric in HIGHER_IS_BETTER and change < -tolerance:
+                regressions.append(
+                    f"{stage_name}.{metric}: {current:.2f} vs baseline {previous:.2f} ({change:+.1%})"
+                )
+            elif metric in LOWER_IS_BETTER and change > tolerance:
+                regressions.append(
+                    f"{stage_name}.{metric}: {current:.2f} vs baseline {previous:.2f} ({change:+.1%})"
+                )
+    return regressions
+
+
+def save_result(result, results_dir=RESULTS_DIR):
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    result_path = results_dir / f"{result['commit']}.json"
+    with open(result_path, "w") as f:
+        json.dump(result, f, indent=2)
+    return result_path
+
+
+def print_summary(result):
+    corpus = result["corpus"]
+    print(
+        f"Commit {result['commit']}: {corpus['unique_files']} files x{corpus['replicate']} "
+        f"in {result['total_seconds']:.1f}s"
+    )
+    for stage_name, stage in result["stages"].items():
+        rates = ", ".join(
+            f"{metric} {stage[metric]:.1f}" for metric in HIGHER_IS_BETTER if metric in stage
+        )
+        print(
+            f"  {stage_name:<14} {stage['seconds']:8.2f}s  {rates}, "
+            f"peak RSS {stage['peak_rss_mb']:.0f} MB, {stage['output_bytes'] / 1e6:.1f} MB out"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MusicXML processing pipeline")
+    parser.add_argument("--corpus-dir", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--composers", nargs="+", default=None)
+    parser.add_argument(
+        "--replicate", type=int, default=1, help="Copy the corpus this many times"
+    )
+    parser.add_argument("--results-dir", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Store this run as the new baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.10, help="Allowed relative change before flagging"
+    )
+    parser.add_argument("--keep-outputs", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run_benchmark(
+        args.corpus_dir, args.replicate, args.composers, args.keep_outputs
+    )
+    print_summary(result)
+    result_path = save_result(result, args.results_dir)
+    print(f"Results saved to {result_path}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved as baseline: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print("No baseline to compare against (run with --save-baseline to create one)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(result, baseline, args.tolerance)
+    if regressions:
+        print(f"REGRESSIONS against baseline {baseline.get('commit')}:")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    print(f"No regressions against baseline {baseline.get('commit')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,7 @@ import os
 import sqlite3
 from datetime import datetime
 
-import git
+from db_snapshots import take_snapshot
 
 
 # Set up logging
@@ -29,31 +29,6 @@ def setup_logging():
     print(f"Logging to: {log_file}")
 
 
-def commit_to_github(db_path):
-    """Commit and push the database to GitHub after clearing the table"""
-    try:
-        # Get the repository path (assuming the script is inside the repository)
-        repo_path = "/home/leahm/MusicXML/NeurAllegro"
-        repo = git.Repo(repo_path)
-        relative_path = os.path.relpath(db_path, repo_path)
-
-        logging.info(f"Adding {relative_path} to git staging")
-        repo.git.add(relative_path)
-
-        commit_message = f"Clear composer_indices table - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        logging.info(f"Creating commit: {commit_message}")
-        repo.git.commit("-m", commit_message)
-
-        logging.info("Pushing to remote repository")
-        repo.git.push()
-
-        logging.info("Successfully pushed database to GitHub")
-        return True
-    except Exception as e:
-        logging.error(f"Failed to commit to GitHub: {e}")
-        return False
-
-
 def clear_composer_indices():
     # clears all rows because I had to test this stuff a lot
     db_path = "score_database.db"
@@ -69,6 +44,10 @@ def clear_composer_indices():
         row_count = cursor.fetchone()[0]
         logging.info(f"Current row count in composer_indices: {row_count}")
 
+        # keep a copy to restore from (python db_snapshots.py restore latest)
+        snapshot_path = take_snapshot(db_path, label="before-clear-composers")
+        logging.info(f"Saved snapshot of the database before clearing: {snapshot_path}")
+
         logging.info("Deleting all rows from composer_indices table...")
         cursor.execute("DELETE FROM composer_indices")
 
@@ -81,14 +60,6 @@ def clear_composer_indices():
         conn.close()
         logging.info("Database connection closed")
 
-        # Backup to GitHub!!!
-        if commit_to_github(db_path):
-            print("Successfully backed up the cleared database to GitHub!")
-        else:
-            print(
-                "WARNING: Failed to back up database to GitHub. Check logs for details."
-            )
-
         print(f"Successfully cleared {row_count} rows from composer_indices table!")
         return True
 
@@ -5,7 +5,7 @@ import os
 import sqlite3
 from datetime import datetime
 
-import git
+from db_snapshots import take_snapshot
 
 
 def setup_logging():
@@ -29,28 +29,6 @@ def setup_logging():
     print(f"Logging to: {log_file}")
 
 
-def commit_to_github(db_path):
-    try:
-        repo_path = "/home/leahm/MusicXML/NeurAllegro"
-        repo = git.Repo(repo_path)
-        relative_path = os.path.relpath(db_path, repo_path)
-        logging.info(f"Adding {relative_path} to git staging")
-        repo.git.add(relative_path)
-
-        commit_message = f"Clear master_score_list table - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        logging.info(f"Creating commit: {commit_message}")
-        repo.git.commit("-m", commit_message)
-
-        logging.info("Pushing to remote repository")
-        repo.git.push()
-
-        logging.info("Successfully pushed database to GitHub")
-        return True
-    except Exception as e:
-        logging.error(f"Failed to commit to GitHub: {e}")
-        return False
-
-
 def clear_master_score_list():
     db_path = "score_database.db"
     if not os.path.exists(db_path):
@@ -66,6 +44,10 @@ def clear_master_score_list():
         row_count = cursor.fetchone()[0]
         logging.info(f"Current row count in master_score_list: {row_count}")
 
+        # keep a copy to restore from (python db_snapshots.py restore latest)
+        snapshot_path = take_snapshot(db_path, label="before-clear-master")
+        logging.info(f"Saved snapshot of the database before clearing: {snapshot_path}")
+
         logging.info("Deleting all rows from master_score_list table...")
         cursor.execute("DELETE FROM master_score_list")
 
@@ -77,14 +59,6 @@ def clear_master_score_list():
         conn.close()
         logging.info("Database connection closed")
 
-        # Backup to GitHub!!
-        if commit_to_github(db_path):
-            print("Successfully backed up the cleared database to GitHub!")
-        else:
-            print(
-                "WARNING: Failed to back up database to GitHub. Check logs for details."
-            )
-
         print(f"Successfully cleared {row_count} rows from master_score_list table!")
         return True
 
@@ -0,0 +1,376 @@
+# Local, compressed snapshots of score_database.db.
+#
+# This replaces committing and pushing the whole binary database to GitHub after
+# every run. Snapshots use SQLite's online backup API, which copies the database a
+# few pages at a time and lets writers keep going in between steps. They run on a
+# background thread, so ingest finishes (and windowing starts) without waiting on
+# them. Each snapshot is gzipped with a small JSON sidecar (checksum, sizes, label),
+# and old ones get pruned: the last KEEP_LAST, plus the newest one per day for
+# KEEP_DAILY days and per week for KEEP_WEEKLY weeks.
+#
+#   python db_snapshots.py take [--label before-cleanup]
+#   python db_snapshots.py list
+#   python db_snapshots.py verify [snapshot]
+#   python db_snapshots.py restore latest [--db score_database.db]
+#   python db_snapshots.py prune
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = Path("db_snapshots")
+PAGES_PER_STEP = 256  # copy this many pages, then let writers in
+STEP_SLEEP_SECONDS = 0.005
+# retention policy
+KEEP_LAST = 10
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+
+SNAPSHOT_SUFFIX = ".db.gz"
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S_%f"
+# <db stem>_<timestamp>[_<label>].db.gz
+SNAPSHOT_NAME_PATTERN = re.compile(r"_(?P<stamp>\d{8}_\d{6}_\d{6})(?:_[^.]*)?\.db\.gz$")
+NO_METADATA = "metadata file missing, checksum not verified"
+
+# one snapshot at a time; the executor's thread is joined when the interpreter exits,
+# so a snapshot started at the end of a run still finishes
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-snapshot")
+_pending = []
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def take_snapshot(
+    db_path="score_database.db",
+    snapshot_dir=SNAPSHOT_DIR,
+    label=None,
+    pages_per_step=PAGES_PER_STEP,
+):
+    """
+    Take a consistent snapshot of the database and store it gzipped.
+
+    Args:
+        db_path: Database to snapshot
+        snapshot_dir: Where snapshots are kept
+        label: Optional short tag (e.g. "ingest") that ends up in the file name
+        pages_per_step: Pages copied per backup step
+
+    Returns:
+        The path of the .db.gz snapshot
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now()
+    name = f"{Path(db_path).stem}_{timestamp.strftime(TIMESTAMP_FORMAT)}"
+    if label:
+        name += f"_{label}"
+    snapshot_path = snapshot_dir / f"{name}{SNAPSHOT_SUFFIX}"
+
+    # back up into a temp file next to the snapshots, then compress that
+    fd, raw_path = tempfile.mkstemp(dir=snapshot_dir, prefix=".raw_", suffix=".db")
+    os.close(fd)
+    tmp_path = snapshot_dir / f".{snapshot_path.name}.tmp"
+    try:
+        source = sqlite3.connect(db_path, timeout=60)
+        target = sqlite3.connect(raw_path)
+        try:
+            source.backup(target, pages=pages_per_step, sleep=STEP_SLEEP_SECONDS)
+        finally:
+            target.close()
+            source.close()
+
+        with open(raw_path, "rb") as raw, gzip.open(tmp_path, "wb", compresslevel=6) as gz:
+            shutil.copyfileobj(raw, gz, 1 << 20)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+
+        meta = {
+            "source": str(Path(db_path).resolve()),
+            "label": label,
+            "created": timestamp.isoformat(timespec="seconds"),
+            "db_bytes": os.path.getsize(raw_path),
+            "compressed_bytes": snapshot_path.stat().st_size,
+            "sha256": _sha256(snapshot_path),
+        }
+        with open(snapshot_path.with_suffix(".json"), "w") as f:
+            json.dump(meta, f, indent=2)
+    finally:
+        Path(raw_path).unlink(missing_ok=True)
+        tmp_path.unlink(missing_ok=True)
+
+    logger.info(
+        f"Snapshot of {db_path} saved to {snapshot_path} "
+        f"({meta['db_bytes'] / 1e6:.1f} MB -> {meta['compressed_bytes'] / 1e6:.1f} MB)"
+    )
+    return snapshot_path
+
+
+def _snapshot_and_prune(db_path, snapshot_dir, label):
+    snapshot_path = take_snapshot(db_path, snapshot_dir, label)
+    apply_retention(snapshot_dir)
+    return snapshot_path
+
+
+def snapshot_in_background(
+    db_path="score_database.db", snapshot_dir=SNAPSHOT_DIR, label=None
+):
+    """
+    Start a snapshot (and a retention pass) on the snapshot thread and return right away.
+
+    Returns:
+        A Future whose result is the snapshot path
+    """
+    future = _executor.submit(
+        _snapshot_and_prune, os.path.abspath(db_path), snapshot_dir, label
+    )
+    future.add_done_callback(_log_failure)
+    _pending.append(future)
+    return future
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(f"Database snapshot failed: {future.exception()}")
+
+
+def wait_for_snapshots(timeout=None):
+    """Block until every snapshot started so far is done. Returns how many succeeded."""
+    succeeded = 0
+    while _pending:
+        future = _pending.pop(0)
+        try:
+            future.result(timeout=timeout)
+            succeeded += 1
+        except Exception:
+            pass  # already logged
+    return succeeded
+
+
+def snapshot_created(snapshot_path):
+    match = SNAPSHOT_NAME_PATTERN.search(Path(snapshot_path).name)
+    if match is None:
+        return datetime.fromtimestamp(Path(snapshot_path).stat().st_mtime)
+    return datetime.strptime(match.group("stamp"), TIMESTAMP_FORMAT)
+
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """Snapshots, newest first."""
+    snapshot_dir = Path(snapshot_dir)
+    if not snapshot_dir.exists():
+        return []
+    snapshots = [
+        p for p in snapshot_dir.glob(f"*{SNAPSHOT_SUFFIX}") if not p.name.startswith(".")
+    ]
+    return sorted(snapshots, key=snapshot_created, reverse=True)
+
+
+def snapshots_to_keep(
+    snapshots, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, now=None
+):
+    """
+    Pick which snapshots the retention policy keeps.
+
+    Args:
+        snapshots: Snapshot paths, newest first
+    """
+    now = now or datetime.now()
+    keep = set(snapshots[:keep_last])
+    days_seen = set()
+    weeks_seen = set()
+    for snapshot in snapshots:
+        created = snapshot_created(snapshot)
+        day = created.date()
+        week = tuple(created.isocalendar()[:2])
+        if day not in days_seen and now - created < timedelta(days=keep_daily):
+            days_seen.add(day)
+            keep.add(snapshot)
+        if week not in weeks_seen and now - created < timedelta(weeks=keep_weekly):
+            weeks_seen.add(week)
+            keep.add(snapshot)
+    return keep
+
+
+def apply_retention(snapshot_dir=SNAPSHOT_DIR, dry_run=False, **policy):
+    """Delete the snapshots the retention policy doesn't keep. Returns the deleted paths."""
+    snapshots = list_snapshots(snapshot_dir)
+    keep = snapshots_to_keep(snapshots, **policy)
+    deleted = [s for s in snapshots if s not in keep]
+    if not dry_run:
+        for snapshot in deleted:
+            snapshot.unlink(missing_ok=True)
+            snapshot.with_suffix(".json").unlink(missing_ok=True)
+            logger.info(f"Pruned snapshot {snapshot}")
+    return deleted
+
+
+def resolve_snapshot(name, snapshot_dir=SNAPSHOT_DIR):
+    """A snapshot path from "latest", a file name or a path."""
+    if name == "latest":
+        snapshots = list_snapshots(snapshot_dir)
+        if not snapshots:
+            raise FileNotFoundError(f"No snapshots in {snapshot_dir}")
+        return snapshots[0]
+    path = Path(name)
+    if not path.exists():
+        path = Path(snapshot_dir) / name
+    if not path.exists():
+        raise FileNotFoundError(f"Snapshot not found: {name}")
+    return path
+
+
+def verify_snapshot(snapshot_path):
+    """
+    Check the checksum and run SQLite's integrity check on a decompressed copy.
+
+    Returns:
+        A list of problems (empty if the snapshot is fine)
+    """
+    snapshot_path = Path(snapshot_path)
+    problems = []
+    meta_path = snapshot_path.with_suffix(".json")
+    if meta_path.exists():
+        with open(meta_path) as f:
+            expected = json.load(f).get("sha256")
+        if expected and _sha256(snapshot_path) != expected:
+            problems.append("checksum mismatch")
+    else:
+        problems.append(NO_METADATA)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_path = Path(tmp_dir) / "check.db"
+        try:
+            with gzip.open(snapshot_path, "rb") as gz, open(raw_path, "wb") as raw:
+                shutil.copyfileobj(gz, raw, 1 << 20)
+            conn = sqlite3.connect(raw_path)
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            conn.close()
+            if result != "ok":
+                problems.append(f"integrity check: {result}")
+        except (OSError, sqlite3.DatabaseError) as e:
+            problems.append(f"can't read snapshot: {e}")
+    return problems
+
+
+def restore_snapshot(snapshot_path, db_path="score_database.db"):
+    """
+    Replace the database with a snapshot. The current database is moved aside to
+    <db>.pre-restore-<timestamp> first, so a restore can itself be undone.
+
+    Returns:
+        The path the old database was moved to (or None if there wasn't one)
+    """
+    snapshot_path = Path(snapshot_path)
+    db_path = Path(db_path)
+    problems = verify_snapshot(snapshot_path)
+    if any(problem != NO_METADATA for problem in problems):
+        raise ValueError(f"Refusing to restore {snapshot_path}: {'; '.join(problems)}")
+
+    tmp_path = db_path.with_name(f".{db_path.name}.restore")
+    with gzip.open(snapshot_path, "rb") as gz, open(tmp_path, "wb") as raw:
+        shutil.copyfileobj(gz, raw, 1 << 20)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    moved_to = None
+    if db_path.exists():
+        # fold the WAL in first so the moved-aside copy is complete on its own
+        try:
+            conn = sqlite3.connect(db_path)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"Couldn't checkpoint {db_path} before moving it aside: {e}")
+        moved_to = db_path.with_name(
+            f"{db_path.name}.pre-restore-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        os.replace(db_path, moved_to)
+    for suffix in ("-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+    os.replace(tmp_path, db_path)
+    logger.info(f"Restored {db_path} from {snapshot_path}")
+    return moved_to
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Local snapshots of score_database.db")
+    parser.add_argument("--db", default="score_database.db")
+    parser.add_argument("--snapshot-dir", type=Path, default=SNAPSHOT_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    take_parser = subparsers.add_parser("take", help="Take a snapshot now")
+    take_parser.add_argument("--label", default="manual")
+    subparsers.add_parser("list", help="List snapshots, newest first")
+    verify_parser = subparsers.add_parser(
+        "verify", help="Check a snapshot's checksum and integrity"
+    )
+    verify_parser.add_argument("snapshot", nargs="?", default="latest")
+    restore_parser = subparsers.add_parser("restore", help="Replace the database with a snapshot")
+    restore_parser.add_argument("snapshot", help='Snapshot file name, path, or "latest"')
+    prune_parser = subparsers.add_parser("prune", help="Apply the retention policy")
+    prune_parser.add_argument("--keep-last", type=int, default=KEEP_LAST)
+    prune_parser.add_argument("--keep-daily", type=int, default=KEEP_DAILY)
+    prune_parser.add_argument("--keep-weekly", type=int, default=KEEP_WEEKLY)
+    prune_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "take":
+        print(take_snapshot(args.db, args.snapshot_dir, args.label))
+    elif args.command == "list":
+        for snapshot in list_snapshots(args.snapshot_dir):
+            meta_path = snapshot.with_suffix(".json")
+            size = snapshot.stat().st_size / 1e6
+            label = ""
+            if meta_path.exists():
+                with open(meta_path) as f:
+                    label = json.load(f).get("label") or ""
+            print(f"{snapshot.name}  {size:.1f} MB  {label}")
+    elif args.command == "verify":
+        snapshot = resolve_snapshot(args.snapshot, args.snapshot_dir)
+        problems = verify_snapshot(snapshot)
+        for problem in problems:
+            print(f"{snapshot.name}: {problem}")
+        if not problems:
+            print(f"{snapshot.name}: ok")
+        sys.exit(1 if problems else 0)
+    elif args.command == "restore":
+        snapshot = resolve_snapshot(args.snapshot, args.snapshot_dir)
+        confirm = input(
+            f"This will replace {args.db} with {snapshot.name}. Type 'YES' to confirm: "
+        )
+        if confirm != "YES":
+            print("Restore cancelled.")
+        else:
+            moved_to = restore_snapshot(snapshot, args.db)
+            if moved_to:
+                print(f"Previous database moved to {moved_to}")
+            print(f"Restored {args.db} from {snapshot.name}")
+    else:
+        deleted = apply_retention(
+            args.snapshot_dir,
+            dry_run=args.dry_run,
+            keep_last=args.keep_last,
+            keep_daily=args.keep_daily,
+            keep_weekly=args.keep_weekly,
+        )
+        action = "Would delete" if args.dry_run else "Deleted"
+        print(f"{action} {len(deleted)} snapshots")
@@ -0,0 +1,325 @@
+# Near-duplicate detection for scores and windows.
+#
+# The same piece shows up from IMSLP, Musescore and Musicalion in different
+# engravings, and duplicates waste parse time, storage, training epochs, and leak
+# between train and test. Each score gets a MinHash signature over (pitch, duration)
+# n-grams of its parts, and the signatures are indexed with LSH banding in the
+# database so a new score only gets compared against the handful of scores that
+# share a band with it.
+#
+# backup_and_rename calls check_and_register_score() for every parsed file. Run this
+# file directly to report the duplicate clusters:
+#   python deduplicator.py scores
+#   python deduplicator.py windows [--drop]
+
+import argparse
+import hashlib
+import logging
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+from normalizer import NORMALIZED_WINDOWS_DIR, pitch_to_midi
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+NUM_BANDS = 16  # 16 bands x 8 rows, so pairs above ~0.7 similarity almost always collide
+NGRAM_SIZE = 4
+SIMILARITY_THRESHOLD = 0.8
+# "flag" keeps the duplicate but marks it, "drop" doesn't save it at all
+DEDUP_POLICY = "flag"
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_HASH_MASK = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+# a*x + b with a, x < 2^32 always fits in 64 bits
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def setup_dedup_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS score_minhash (
+        score_id INTEGER PRIMARY KEY,
+        signature BLOB NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS score_lsh_buckets (
+        band INTEGER NOT NULL,
+        bucket TEXT NOT NULL,
+        score_id INTEGER NOT NULL
+    )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_score_lsh_buckets ON score_lsh_buckets (band, bucket)"
+    )
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS score_duplicates (
+        score_id INTEGER PRIMARY KEY,
+        duplicate_of INTEGER NOT NULL,
+        similarity REAL NOT NULL,
+        date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+
+
+def part_token_sequences(score_data):
+    """
+    One list of (midi, duration) tokens per part. Chords use their top note and rests
+    are -1, so the shingles don't depend on how an engraver spelled a pitch.
+    """
+    sequences = []
+    for part in score_data["parts"]:
+        tokens = []
+        for measure in part["measure_data"]:
+            for ev in measure["events"]:
+                if ev["element_type"] == "chord":
+                    midis = [pitch_to_midi(p) for p in ev["pitch"]]
+                    midis = [m for m in midis if m is not None]
+                    midi = max(midis) if midis else -1
+                elif ev["element_type"] == "note":
+                    midi = pitch_to_midi(ev["pitch"])
+                    midi = -1 if midi is None else midi
+                else:
+                    midi = -1
+                tokens.append((midi, round(float(ev["duration"]), 3)))
+        sequences.append(tokens)
+    return sequences
+
+
+def shingle_hashes(sequences, n=NGRAM_SIZE):
+    """Hash every n-gram of every sequence to a 32-bit int (as a numpy array of unique values)."""
+    hashes = set()
+    for tokens in sequences:
+        for i in range(len(tokens) - n + 1):
+            gram = repr(tokens[i : i + n]).encode("utf-8")
+            hashes.add(int.from_bytes(hashlib.blake2b(gram, digest_size=4).digest(), "little"))
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def minhash_signature(hashes):
+    """MinHash signature of a set of 32-bit shingle hashes, or None if there are none."""
+    if len(hashes) == 0:
+        return None
+    permuted = (
+        (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) % _MERSENNE_PRIME
+    ) & _HASH_MASK
+    return permuted.min(axis=0)
+
+
+def estimated_similarity(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+
+def band_buckets(signature, num_bands=NUM_BANDS):
+    rows = len(signature) // num_bands
+    return [
+        (band, hashlib.sha1(signature[band * rows : (band + 1) * rows].tobytes()).hexdigest())
+        for band in range(num_bands)
+    ]
+
+
+def score_signature(score_data):
+    return minhash_signature(shingle_hashes(part_token_sequences(score_data)))
+
+
+def find_duplicate(conn, signature, threshold=SIMILARITY_THRESHOLD, exclude=None):
+    """
+    Look up the best matching already-registered score (other than `exclude`).
+
+    Returns:
+        (score_id, similarity) of the closest candidate above threshold, or None
+    """
+    candidates = set()
+    for band, bucket in band_buckets(signature):
+        rows = conn.execute(
+            "SELECT score_id FROM score_lsh_buckets WHERE band = ? AND bucket = ?",
+            (band, bucket),
+        ).fetchall()
+        candidates.update(row[0] for row in rows)
+
+    candidates.discard(exclude)
+    best = None
+    for candidate_id in candidates:
+        row = conn.execute(
+            "SELECT signature FROM score_minhash WHERE score_id = ?", (candidate_id,)
+        ).fetchone()
+        if row is None:
+            continue
+        similarity = estimated_similarity(
+            signature, np.frombuffer(row[0], dtype=np.uint64)
+        )
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (candidate_id, similarity)
+    return best
+
+
+def register_signature(conn, score_id, signature):
+    conn.execute(
+        "INSERT OR REPLACE INTO score_minhash (score_id, signature) VALUES (?, ?)",
+        (score_id, signature.tobytes()),
+    )
+    conn.execute("DELETE FROM score_lsh_buckets WHERE score_id = ?", (score_id,))
+    conn.executemany(
+        "INSERT INTO score_lsh_buckets (band, bucket, score_id) VALUES (?, ?, ?)",
+        [(band, bucket, score_id) for band, bucket in band_buckets(signature)],
+    )
+
+
+def check_and_register_score(conn, score_id, score_data, policy=DEDUP_POLICY):
+    """
+    Check a freshly parsed score against everything ingested so far.
+
+    With policy "flag" the score is registered either way and duplicates are recorded
+    in score_duplicates and marked processing_status = 'duplicate'. With "drop" a
+    duplicate isn't registered at all and the caller shouldn't keep it.
+
+    Returns:
+        True if the caller should keep the score, False if it should be dropped
+    """
+    signature = score_signature(score_data)
+    if signature is None:
+        return True
+
+    # exclude the score itself in case it's being re-checked after a resumed run
+    match = find_duplicate(conn, signature, exclude=score_id)
+    if match is not None:
+        duplicate_of, similarity = match
+        logger.info(
+            f"Score {score_id} ({score_data.get('file_name')}) looks like a duplicate of "
+            f"score {duplicate_of} (similarity {similarity:.2f})"
+        )
+        if policy == "drop":
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO score_duplicates (score_id, duplicate_of, similarity) VALUES (?, ?, ?)",
+            (score_id, duplicate_of, similarity),
+        )
+        conn.execute(
+            "UPDATE master_score_list SET processing_status = 'duplicate' WHERE rowid = ?",
+            (score_id,),
+        )
+
+    register_signature(conn, score_id, signature)
+    conn.commit()
+    return True
+
+
+def duplicate_clusters(conn):
+    """
+    Group flagged duplicates into clusters (each duplicate points at an earlier
+    score, so following the pointers gives the root of its cluster).
+
+    Returns:
+        {root score_id: [member score_ids, including the root]}
+    """
+    parent = dict(
+        conn.execute("SELECT score_id, duplicate_of FROM score_duplicates").fetchall()
+    )
+
+    def root(score_id):
+        seen = set()
+        while score_id in parent and score_id not in seen:
+            seen.add(score_id)
+            score_id = parent[score_id]
+        return score_id
+
+    clusters = {}
+    for score_id in parent:
+        clusters.setdefault(root(score_id), set()).add(score_id)
+    return {r: sorted(members | {r}) for r, members in clusters.items()}
+
+
+def report_score_duplicates(db_path="score_database.db"):
+    conn = sqlite3.connect(db_path)
+    setup_dedup_tables(conn)
+    clusters = duplicate_clusters(conn)
+    if not clusters:
+        print("No duplicate scores found.")
+    for root_id, members in sorted(clusters.items()):
+        rows = conn.execute(
+            f"SELECT id, composer, original_title, new_title FROM master_score_list WHERE id IN ({','.join('?' * len(members))})",
+            members,
+        ).fetchall()
+        print(f"Cluster {root_id} ({len(members)} scores):")
+        for score_id, composer, original_title, new_title in rows:
+            print(f"  {score_id}: {composer} - {original_title} ({new_title})")
+    conn.close()
+    return clusters
+
+
+def window_signature(window_array, n=NGRAM_SIZE):
+    """MinHash of a normalized window, over (pitch_idx, duration) n-grams of each part."""
+    real = window_array[np.any(window_array != 0, axis=1)]
+    sequences = []
+    for part_id in np.unique(real[:, 2]):
+        part_events = real[real[:, 2] == part_id]
+        sequences.append(
+            [(int(p), round(float(d), 3)) for p, d in part_events[:, 3:5]]
+        )
+    return minhash_signature(shingle_hashes(sequences, n))
+
+
+def find_duplicate_windows(windows_dir=NORMALIZED_WINDOWS_DIR, threshold=SIMILARITY_THRESHOLD):
+    """
+    Find near-duplicate windows coming from different scores. Overlapping windows of
+    the same score are expected to look alike, so those are ignored.
+
+    Returns:
+        A list of (kept window path, duplicate window path, similarity)
+    """
+    buckets = {}
+    signatures = {}
+    duplicates = []
+    for npy_file in sorted(Path(windows_dir).glob("*.npy")):
+        signature = window_signature(np.load(npy_file))
+        if signature is None:
+            continue
+        score_stem = npy_file.stem.rsplit("_", 1)[0]
+        candidates = set()
+        for key in band_buckets(signature):
+            candidates.update(buckets.get(key, ()))
+
+        match = None
+        for candidate in candidates:
+            if candidate.stem.rsplit("_", 1)[0] == score_stem:
+                continue
+            similarity = estimated_similarity(signature, signatures[candidate])
+            if similarity >= threshold and (match is None or similarity > match[1]):
+                match = (candidate, similarity)
+        if match is not None:
+            duplicates.append((match[0], npy_file, match[1]))
+            continue
+
+        signatures[npy_file] = signature
+        for key in band_buckets(signature):
+            buckets.setdefault(key, []).append(npy_file)
+    return duplicates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report near-duplicate scores and windows")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scores_parser = subparsers.add_parser("scores", help="Report duplicate score clusters")
+    scores_parser.add_argument("--db", default="score_database.db")
+    windows_parser = subparsers.add_parser(
+        "windows", help="Find near-duplicate normalized windows across scores"
+    )
+    windows_parser.add_argument("--windows-dir", type=Path, default=NORMALIZED_WINDOWS_DIR)
+    windows_parser.add_argument(
+        "--drop", action="store_true", help="Delete the duplicate windows"
+    )
+    args = parser.parse_args()
+
+    if args.command == "scores":
+        report_score_duplicates(args.db)
+    else:
+        duplicates = find_duplicate_windows(args.windows_dir)
+        for kept, duplicate, similarity in duplicates:
+            print(f"{duplicate.name} ~ {kept.name} ({similarity:.2f})")
+            if args.drop:
+                duplicate.unlink()
+        print(f"Found {len(duplicates)} near-duplicate windows.")
@@ -0,0 +1,348 @@
+# Queryable summary features of every parsed score.
+#
+# master_score_list only has titles and composers, so picking a training subset
+# ("3/4 pieces with fewer than 3 parts, one of them a piano") used to mean json.load-ing
+# the whole parsed corpus. This keeps three indexed tables next to it instead:
+#
+#   catalog_scores    one row per score: part, measure and event counts, opening time
+#                     signature, tempo, most common detected key, pitch range (MIDI)
+#   catalog_parts     one row per part: instrument name, tempo, counts, pitch range
+#   catalog_measures  one row per measure of every part: time signature in effect,
+#                     detected key, event/note counts, pitch range
+#
+# Everything comes straight from what parse_multitrack_score already extracted.
+# backup_and_rename calls catalog_score for every saved file; `build` backfills the
+# scores that were ingested before the catalog existed.
+#
+# Examples:
+#   python feature_catalog.py build
+#   python feature_catalog.py select --time-signature 3/4 --max-parts 2 --instrument piano
+#   sqlite3 score_database.db "SELECT DISTINCT score_id FROM catalog_measures WHERE time_signature = '5/4'"
+
+import argparse
+import json
+import logging
+import sqlite3
+from collections import Counter
+from pathlib import Path
+
+from job_journal import PARSED_BACKUP_DIR, PARSED_DIR
+from normalizer import pitch_to_midi
+
+logger = logging.getLogger(__name__)
+
+# columns of catalog_scores that select_scores can filter on with min/max bounds
+RANGE_COLUMNS = ("part_count", "measure_count", "event_count", "pitch_min", "pitch_max", "tempo")
+
+
+def setup_catalog_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_scores (
+        score_id INTEGER PRIMARY KEY,
+        composer TEXT,
+        part_count INTEGER NOT NULL,
+        measure_count INTEGER NOT NULL,
+        event_count INTEGER NOT NULL,
+        note_count INTEGER NOT NULL,
+        time_signature TEXT,
+        time_signature_changes INTEGER NOT NULL,
+        key_signature TEXT,
+        tempo REAL,
+        pitch_min INTEGER,
+        pitch_max INTEGER
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_parts (
+        score_id INTEGER NOT NULL,
+        part_index INTEGER NOT NULL,
+        part_name TEXT,
+        tempo REAL,
+        measure_count INTEGER NOT NULL,
+        event_count INTEGER NOT NULL,
+        note_count INTEGER NOT NULL,
+        pitch_min INTEGER,
+        pitch_max INTEGER,
+        PRIMARY KEY (score_id, part_index)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_measures (
+        score_id INTEGER NOT NULL,
+        part_index INTEGER NOT NULL,
+        measure_index INTEGER NOT NULL,
+        measure_num INTEGER,
+        time_signature TEXT,
+        key_signature TEXT,
+        event_count INTEGER NOT NULL,
+        note_count INTEGER NOT NULL,
+        pitch_min INTEGER,
+        pitch_max INTEGER,
+        PRIMARY KEY (score_id, part_index, measure_index)
+    )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_scores_composer ON catalog_scores (composer)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_scores_time ON catalog_scores (time_signature, part_count)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_scores_key ON catalog_scores (key_signature)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_parts_name ON catalog_parts (part_name COLLATE NOCASE)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_measures_time ON catalog_measures (time_signature, score_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_measures_key ON catalog_measures (key_signature, score_id)"
+    )
+    conn.commit()
+
+
+def event_midis(ev):
+    """MIDI numbers of a note or chord event (empty for rests and unknown pitches)."""
+    if ev["element_type"] == "note":
+        pitches = [ev["pitch"]]
+    elif ev["element_type"] == "chord":
+        pitches = ev["pitch"]
+    else:
+        return []
+    return [m for m in (pitch_to_midi(p) for p in pitches) if m is not None]
+
+
+def _pitch_range(midis):
+    return (min(midis), max(midis)) if midis else (None, None)
+
+
+def score_features(score_data):
+    """
+    Summarize a parsed score.
+
+    Returns:
+        (score row dict, list of part row dicts, list of measure row dicts), without
+        score ids
+    """
+    part_rows = []
+    measure_rows = []
+    time_signatures = []
+    keys = Counter()
+    score_midis = []
+
+    for part_index, part in enumerate(score_data["parts"]):
+        part_midis = []
+        part_events = 0
+        part_notes = 0
+        current_time = None
+        for measure_index, measure in enumerate(part["measure_data"]):
+            if measure["time_signatures"]:
+                current_time = measure["time_signatures"][-1]
+                # every part repeats the time signatures, so they're taken from part 0
+                if part_index == 0:
+                    time_signatures.extend(measure["time_signatures"])
+            key = measure["key_signatures"][0] if measure["key_signatures"] else None
+            if key:
+                keys[key] += 1
+            midis = []
+            for ev in measure["events"]:
+                midis.extend(event_midis(ev))
+            pitch_min, pitch_max = _pitch_range(midis)
+            measure_rows.append(
+                {
+                    "part_index": part_index,
+                    "measure_index": measure_index,
+                    "measure_num": measure["measure_num"],
+                    "time_signature": current_time,
+                    "key_signature": key,
+                    "event_count": len(measure["events"]),
+                    "note_count": len(midis),
+                    "pitch_min": pitch_min,
+                    "pitch_max": pitch_max,
+                }
+            )
+            part_events += len(measure["events"])
+            part_notes += len(midis)
+            part_midis.extend(midis)
+
+        pitch_min, pitch_max = _pitch_range(part_midis)
+        part_rows.append(
+            {
+                "part_index": part_index,
+                "part_name": part["part_name"],
+                "tempo": part["tempo"],
+                "measure_count": len(part["measure_data"]),
+                "event_count": part_events,
+                "note_count": part_notes,
+                "pitch_min": pitch_min,
+                "pitch_max": pitch_max,
+            }
+        )
+        score_midis.extend(part_midis)
+
+    pitch_min, pitch_max = _pitch_range(score_midis)
+    tempos = [row["tempo"] for row in part_rows if row["tempo"] is not None]
+    score_row = {
+        "composer": score_data.get("composer"),
+        "part_count": len(part_rows),
+        "measure_count": max((row["measure_count"] for row in part_rows), default=0),
+        "event_count": sum(row["event_count"] for row in part_rows),
+        "note_count": sum(row["note_count"] for row in part_rows),
+        "time_signature": time_signatures[0] if time_signatures else None,
+        "time_signature_changes": max(len(time_signatures) - 1, 0),
+        "key_signature": keys.most_common(1)[0][0] if keys else None,
+        "tempo": tempos[0] if tempos else None,
+        "pitch_min": pitch_min,
+        "pitch_max": pitch_max,
+    }
+    return score_row, part_rows, measure_rows
+
+
+def _insert(conn, table, score_id, rows):
+    if not rows:
+        return
+    columns = ["score_id"] + list(rows[0])
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [(score_id, *row.values()) for row in rows],
+    )
+
+
+def remove_score(conn, score_id, commit=True):
+    for table in ("catalog_scores", "catalog_parts", "catalog_measures"):
+        conn.execute(f"DELETE FROM {table} WHERE score_id = ?", (score_id,))
+    if commit:
+        conn.commit()
+
+
+def catalog_score(conn, score_id, score_data, commit=True):
+    """Add one parsed score to the catalog (replaces it if it was cataloged before)."""
+    score_row, part_rows, measure_rows = score_features(score_data)
+    remove_score(conn, score_id, commit=False)
+    _insert(conn, "catalog_scores", score_id, [score_row])
+    _insert(conn, "catalog_parts", score_id, part_rows)
+    _insert(conn, "catalog_measures", score_id, measure_rows)
+    if commit:
+        conn.commit()
+    return score_row
+
+
+def select_scores(
+    conn, composer=None, time_signature=None, key_signature=None, instrument=None, **bounds
+):
+    """
+    Pick scores by their catalog features.
+
+    Args:
+        composer, time_signature, key_signature: Exact matches (the time signature is
+            the opening one, the key the most common detected one)
+        instrument: Case-insensitive substring of any part's name
+        bounds: min_<column>/max_<column> for the columns in RANGE_COLUMNS, e.g.
+            max_part_count=2 (inclusive)
+
+    Returns:
+        A list of (score_id, composer, new_title)
+    """
+    where = []
+    params = []
+    for column, value in (
+        ("composer", composer),
+        ("time_signature", time_signature),
+        ("key_signature", key_signature),
+    ):
+        if value is not None:
+            where.append(f"s.{column} = ?")
+            params.append(value)
+    if instrument is not None:
+        where.append(
+            "EXISTS (SELECT 1 FROM catalog_parts p WHERE p.score_id = s.score_id AND p.part_name LIKE ?)"
+        )
+        params.append(f"%{instrument}%")
+    for name, value in bounds.items():
+        if value is None:
+            continue
+        bound, _, column = name.partition("_")
+        if bound not in ("min", "max") or column not in RANGE_COLUMNS:
+            raise ValueError(f"Unknown bound {name}")
+        where.append(f"s.{column} {'>=' if bound == 'min' else '<='} ?")
+        params.append(value)
+
+    query = (
+        "SELECT s.score_id, s.composer, m.new_title FROM catalog_scores s "
+        "LEFT JOIN master_score_list m ON m.id = s.score_id"
+    )
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return conn.execute(query + " ORDER BY s.score_id", params).fetchall()
+
+
+def build_catalog(db_path="score_database.db", parsed_dirs=(PARSED_DIR, PARSED_BACKUP_DIR)):
+    """
+    (Re)catalog every parsed score that's in master_score_list. Scores are looked up
+    in parsed/ and parsed_backup/, since windowing moves them from one to the other.
+    """
+    conn = sqlite3.connect(db_path)
+    setup_catalog_tables(conn)
+    cataloged = set()
+    for parsed_dir in parsed_dirs:
+        if not Path(parsed_dir).exists():
+            continue
+        for composer_dir in sorted(d for d in Path(parsed_dir).iterdir() if d.is_dir()):
+            for json_file in sorted(composer_dir.glob("*.json")):
+                row = conn.execute(
+                    "SELECT id FROM master_score_list WHERE new_title = ?", (json_file.name,)
+                ).fetchone()
+                if row is None:
+                    logger.warning(f"{json_file} isn't in master_score_list, skipping")
+                    continue
+                if row[0] in cataloged:
+                    continue
+                with open(json_file, "r") as f:
+                    score_data = json.load(f)
+                catalog_score(conn, row[0], score_data, commit=False)
+                cataloged.add(row[0])
+    conn.commit()
+    conn.close()
+    logger.info(f"Cataloged {len(cataloged)} scores")
+    return len(cataloged)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Score feature catalog")
+    parser.add_argument("--db", default="score_database.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Catalog all parsed scores (backfill)")
+    select_parser = subparsers.add_parser("select", help="List scores matching features")
+    select_parser.add_argument("--composer")
+    select_parser.add_argument("--time-signature")
+    select_parser.add_argument("--key-signature")
+    select_parser.add_argument("--instrument")
+    for column in RANGE_COLUMNS:
+        kind = float if column == "tempo" else int
+        select_parser.add_argument(f"--min-{column.replace('_', '-')}", type=kind)
+        select_parser.add_argument(f"--max-{column.replace('_', '-')}", type=kind)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"Cataloged {build_catalog(args.db)} scores")
+    else:
+        conn = sqlite3.connect(args.db)
+        bounds = {
+            f"{bound}_{column}": getattr(args, f"{bound}_{column}")
+            for column in RANGE_COLUMNS
+            for bound in ("min", "max")
+        }
+        rows = select_scores(
+            conn,
+            composer=args.composer,
+            time_signature=args.time_signature,
+            key_signature=args.key_signature,
+            instrument=args.instrument,
+            **bounds,
+        )
+        for score_id, composer, new_title in rows:
+            print(f"  {score_id:>6} {composer or '?':<12} {new_title}")
+        print(f"{len(rows)} scores")
+        conn.close()
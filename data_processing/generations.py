@@ -0,0 +1,485 @@
+# Versioned dataset generations.
+#
+# Every pipeline run windows and normalizes into a brand new generation under
+# musicxml_files/generations/<id>/ instead of into the shared folders, and
+# musicxml_files/normalized_windows is a symlink to the active generation's
+# normalized/ folder. So training code doesn't change at all, and switching to
+# another generation (or rolling back to the last one) is a single atomic symlink
+# swap no matter how big the dataset is. The catalog (master_score_list,
+# original_files, parsed_backup) is still shared by every generation, it's only the
+# derived windows that are versioned.
+#
+# A run with the same window parameters as the active generation hard-links the
+# active generation's .npy files into the new one and only adds the newly parsed
+# scores, so it doesn't cost extra disk space. A run with different parameters (or
+# --rebuild) windows everything in parsed_backup again, which is how you try out a
+# new window size without tearing anything down.
+#
+# Generations that fall out of the last KEEP_GENERATIONS are deleted in a background
+# thread after each build.
+#
+#   python generations.py list
+#   python generations.py build [--window-size 16 --overlap 8] [--rebuild] [--no-activate]
+#   python generations.py build --event-budget 128 256 --overlap 64 --overlap-unit events --no-pad
+#   python generations.py activate <id>
+#   python generations.py rollback
+#   python generations.py gc
+#   python generations.py adopt   # turn an existing normalized_windows folder into a generation
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from normalizer import (
+    EVENT_COUNTS_FILE,
+    NORMALIZED_WINDOWS_DIR,
+    load_event_counts,
+    normalize_windows,
+)
+from pipeline_metrics import span
+from windowser import (
+    BACKUP_DIR,
+    OVERLAP_UNITS,
+    PARSED_DIR,
+    backup_parsed_files,
+    clean_empty_directories,
+    ensure_directories_exist,
+    process_windows,
+)
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
+GENERATIONS_DIR = BASE_DIR / "generations"
+# the pointer: a symlink to generations/<id>/normalized
+ACTIVE_LINK = NORMALIZED_WINDOWS_DIR
+HISTORY_FILE = GENERATIONS_DIR / "history.jsonl"
+KEEP_GENERATIONS = 3
+
+BUILDING = "building"
+READY = "ready"
+FAILED = "failed"
+
+DEFAULT_PARAMS = {
+    "window_size": 10,
+    "overlap": 5,
+    "event_budget": None,
+    "overlap_unit": "measures",
+    "pad": True,
+}
+
+
+def generation_dir(gen_id):
+    return GENERATIONS_DIR / gen_id
+
+
+def read_manifest(gen_id):
+    with open(generation_dir(gen_id) / "manifest.json") as f:
+        return json.load(f)
+
+
+def write_manifest(gen_id, manifest):
+    path = generation_dir(gen_id) / "manifest.json"
+    tmp_path = path.with_name(".manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_generations():
+    """Manifests of every generation, oldest first."""
+    if not GENERATIONS_DIR.exists():
+        return []
+    manifests = []
+    for gen_dir in sorted(GENERATIONS_DIR.iterdir()):
+        if gen_dir.is_dir() and (gen_dir / "manifest.json").exists():
+            manifests.append(read_manifest(gen_dir.name))
+    return manifests
+
+
+def generation_params(manifest):
+    # generations built before the event budget options only have window_size/overlap
+    return {**DEFAULT_PARAMS, **manifest["params"]}
+
+
+def active_generation():
+    """Id of the active generation, or None if normalized_windows isn't a generation link."""
+    if not ACTIVE_LINK.is_symlink():
+        return None
+    return Path(os.readlink(ACTIVE_LINK)).parent.name
+
+
+def create_generation(params, parent=None):
+    """Make an empty generation in the building state. Returns its id."""
+    GENERATIONS_DIR.mkdir(parents=True, exist_ok=True)
+    gen_id = datetime.now().strftime("g%Y%m%d_%H%M%S")
+    suffix = 1
+    while generation_dir(gen_id).exists():
+        gen_id = f"{datetime.now().strftime('g%Y%m%d_%H%M%S')}_{suffix}"
+        suffix += 1
+    (generation_dir(gen_id) / "windows").mkdir(parents=True)
+    (generation_dir(gen_id) / "normalized").mkdir()
+    write_manifest(
+        gen_id,
+        {
+            "id": gen_id,
+            "status": BUILDING,
+            "params": params,
+            "parent": parent,
+            "created": datetime.now().isoformat(timespec="seconds"),
+        },
+    )
+    return gen_id
+
+
+def seed_from(parent_id, gen_id):
+    """
+    Hard-link the parent's normalized windows into a new generation. The .npy files
+    are never modified in place, so sharing them between generations is safe.
+
+    Returns:
+        How many files were linked
+    """
+    target_dir = generation_dir(gen_id) / "normalized"
+    count = 0
+    counts_file = generation_dir(parent_id) / "normalized" / EVENT_COUNTS_FILE
+    if counts_file.exists():
+        # normalize_windows replaces it rather than writing into it, so linking is fine
+        os.link(counts_file, target_dir / EVENT_COUNTS_FILE)
+    for npy_file in (generation_dir(parent_id) / "normalized").glob("*.npy"):
+        target = target_dir / npy_file.name
+        try:
+            os.link(npy_file, target)
+        except OSError:
+            shutil.copy2(npy_file, target)
+        count += 1
+    return count
+
+
+def activate(gen_id):
+    """Point normalized_windows at a ready generation, atomically."""
+    manifest = read_manifest(gen_id)
+    if manifest["status"] != READY:
+        raise ValueError(f"Generation {gen_id} is {manifest['status']}, not {READY}")
+    if ACTIVE_LINK.exists() and not ACTIVE_LINK.is_symlink():
+        raise RuntimeError(
+            f"{ACTIVE_LINK} is a real folder, run `python generations.py adopt` first"
+        )
+
+    # build the new link next to the old one and rename it over the top
+    tmp_link = ACTIVE_LINK.with_name(f".{ACTIVE_LINK.name}.tmp")
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(
+        os.path.relpath(generation_dir(gen_id) / "normalized", ACTIVE_LINK.parent),
+        tmp_link,
+    )
+    previous = active_generation()
+    os.replace(tmp_link, ACTIVE_LINK)
+
+    with open(HISTORY_FILE, "a") as f:
+        f.write(
+            json.dumps(
+                {
+                    "activated": gen_id,
+                    "previous": previous,
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                }
+            )
+            + "\n"
+        )
+    logger.info(f"Activated generation {gen_id} (was {previous})")
+    return previous
+
+
+def rollback():
+    """
+    Re-activate the generation that was active before the current one.
+
+    Returns:
+        The id that's active now
+    """
+    current = active_generation()
+    if not HISTORY_FILE.exists():
+        raise RuntimeError("No activation history to roll back")
+    with open(HISTORY_FILE) as f:
+        history = [json.loads(line) for line in f if line.strip()]
+    # walk back through the activations for the most recent other generation that still exists
+    for entry in reversed(history):
+        candidate = entry["previous"]
+        if candidate and candidate != current and generation_dir(candidate).exists():
+            if read_manifest(candidate)["status"] == READY:
+                activate(candidate)
+                return candidate
+    raise RuntimeError("No earlier generation left to roll back to")
+
+
+def adopt_legacy(params=None):
+    """
+    Move an existing normalized_windows folder into a generation and replace it with
+    the link. It's a rename on the same filesystem, so nothing is copied.
+    """
+    if ACTIVE_LINK.is_symlink() or not ACTIVE_LINK.exists():
+        raise RuntimeError(f"{ACTIVE_LINK} isn't a folder to adopt")
+    gen_id = create_generation(params or DEFAULT_PARAMS)
+    normalized_dir = generation_dir(gen_id) / "normalized"
+    normalized_dir.rmdir()
+    os.replace(ACTIVE_LINK, normalized_dir)
+    manifest = read_manifest(gen_id)
+    manifest.update(
+        status=READY,
+        adopted=True,
+        windows=sum(1 for _ in normalized_dir.glob("*.npy")),
+    )
+    write_manifest(gen_id, manifest)
+    activate(gen_id)
+    return gen_id
+
+
+def build_generation(
+    window_size=DEFAULT_PARAMS["window_size"],
+    overlap=DEFAULT_PARAMS["overlap"],
+    rebuild=False,
+    activate_when_done=True,
+    event_budget=DEFAULT_PARAMS["event_budget"],
+    overlap_unit=DEFAULT_PARAMS["overlap_unit"],
+    pad=DEFAULT_PARAMS["pad"],
+):
+    """
+    Window and normalize into a new generation, then (by default) switch to it.
+
+    Args:
+        window_size: Measures per window
+        overlap: How much consecutive windows share, in overlap_unit
+        rebuild: Window everything in parsed_backup even if the active generation
+            has the same parameters
+        activate_when_done: Switch normalized_windows over once it's ready
+        event_budget: (min, max) events per window to cut windows on measure lines
+            by event count instead of by window_size
+        overlap_unit: "measures" or "events"
+        pad: Pad every window to normalize_window's max_events
+
+    Returns:
+        The new generation's id
+    """
+    params = {
+        "window_size": window_size,
+        "overlap": overlap,
+        "event_budget": list(event_budget) if event_budget else None,
+        "overlap_unit": overlap_unit,
+        "pad": pad,
+    }
+    if ACTIVE_LINK.exists() and not ACTIVE_LINK.is_symlink():
+        # first run since generations came in
+        adopt_legacy()
+    parent = active_generation()
+    incremental = (
+        not rebuild
+        and parent is not None
+        and generation_params(read_manifest(parent)) == params
+    )
+    gen_id = create_generation(params, parent)
+    gen_dir = generation_dir(gen_id)
+    mode = f"incremental on {parent}" if incremental else "full rebuild"
+    logger.info(f"Building generation {gen_id} ({mode}) with {params}")
+
+    try:
+        ensure_directories_exist(gen_dir / "windows")
+        if not backup_parsed_files():
+            raise RuntimeError("Backing up parsed files failed")
+
+        with span("stage_window"):
+            if incremental:
+                seeded = seed_from(parent, gen_id)
+                logger.info(f"Linked {seeded} windows from generation {parent}")
+                process_windows(
+                    PARSED_DIR,
+                    gen_dir / "windows",
+                    window_size,
+                    overlap,
+                    event_budget=event_budget,
+                    overlap_unit=overlap_unit,
+                )
+            else:
+                # the new files are in parsed_backup now too, so window all of it
+                process_windows(
+                    BACKUP_DIR,
+                    gen_dir / "windows",
+                    window_size,
+                    overlap,
+                    delete_parsed=False,
+                    event_budget=event_budget,
+                    overlap_unit=overlap_unit,
+                )
+                for json_file in PARSED_DIR.glob("*/*.json"):
+                    json_file.unlink()
+                clean_empty_directories(PARSED_DIR)
+        with span("stage_normalize"):
+            normalize_windows(gen_dir / "windows", gen_dir / "normalized", pad=pad)
+    except Exception:
+        manifest = read_manifest(gen_id)
+        manifest["status"] = FAILED
+        write_manifest(gen_id, manifest)
+        raise
+
+    manifest = read_manifest(gen_id)
+    manifest.update(
+        status=READY,
+        finished=datetime.now().isoformat(timespec="seconds"),
+        **generation_counts(gen_id),
+    )
+    write_manifest(gen_id, manifest)
+
+    if activate_when_done:
+        activate(gen_id)
+    collect_garbage_in_background()
+    return gen_id
+
+
+def generation_counts(gen_id):
+    gen_dir = generation_dir(gen_id)
+    return {
+        "windows": sum(1 for _ in (gen_dir / "normalized").glob("*.npy")),
+        # windows that failed to normalize stay in windows/
+        "failed_windows": sum(1 for _ in (gen_dir / "windows").glob("*.json")),
+        "events": sum(load_event_counts(gen_dir / "normalized").values()),
+    }
+
+
+def renormalize(gen_id=None):
+    """
+    Retry the windows a generation failed to normalize (the active one by default)
+    and update its manifest.
+
+    Returns:
+        How many windows still failed
+    """
+    gen_id = gen_id or active_generation()
+    if gen_id is None:
+        raise RuntimeError("There's no active generation to normalize")
+    gen_dir = generation_dir(gen_id)
+    params = generation_params(read_manifest(gen_id))
+    normalize_windows(gen_dir / "windows", gen_dir / "normalized", pad=params["pad"])
+
+    manifest = read_manifest(gen_id)
+    manifest.update(generation_counts(gen_id))
+    write_manifest(gen_id, manifest)
+    return manifest["failed_windows"]
+
+
+def collect_garbage(keep=KEEP_GENERATIONS):
+    """
+    Delete generations that aren't active and aren't among the newest `keep` ready
+    ones (failed builds go too). Each one is renamed out of the way first, so it
+    disappears atomically even if the delete itself takes a while.
+
+    Returns:
+        The ids that were deleted
+    """
+    active = active_generation()
+    manifests = list_generations()
+    ready = [m["id"] for m in manifests if m["status"] == READY]
+    keep_ids = set(ready[-keep:]) if keep > 0 else set()
+    keep_ids.add(active)
+
+    doomed = [
+        m["id"]
+        for m in manifests
+        if m["id"] not in keep_ids and m["status"] in (READY, FAILED)
+    ]
+    for gen_id in doomed:
+        trash = GENERATIONS_DIR / f".trash-{gen_id}"
+        os.replace(generation_dir(gen_id), trash)
+    # anything a crashed gc left in the trash goes too
+    for trash in GENERATIONS_DIR.glob(".trash-*"):
+        shutil.rmtree(trash, ignore_errors=True)
+    for gen_id in doomed:
+        logger.info(f"Garbage-collected generation {gen_id}")
+    return doomed
+
+
+def collect_garbage_in_background(keep=KEEP_GENERATIONS):
+    # not a daemon, so the process waits for the delete to finish before exiting
+    thread = threading.Thread(
+        target=collect_garbage, args=(keep,), name="generation-gc"
+    )
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Versioned dataset generations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List generations (* marks the active one)")
+    build_parser = subparsers.add_parser(
+        "build", help="Window and normalize into a new generation"
+    )
+    build_parser.add_argument(
+        "--window-size", type=int, default=DEFAULT_PARAMS["window_size"]
+    )
+    build_parser.add_argument("--overlap", type=int, default=DEFAULT_PARAMS["overlap"])
+    build_parser.add_argument(
+        "--event-budget",
+        type=int,
+        nargs=2,
+        metavar=("MIN", "MAX"),
+        help="Cut windows on measure lines to MIN-MAX events instead of --window-size measures",
+    )
+    build_parser.add_argument(
+        "--overlap-unit", choices=OVERLAP_UNITS, default=DEFAULT_PARAMS["overlap_unit"]
+    )
+    build_parser.add_argument(
+        "--no-pad", action="store_true", help="Save windows as long as they are"
+    )
+    build_parser.add_argument(
+        "--rebuild", action="store_true", help="Window all of parsed_backup"
+    )
+    build_parser.add_argument("--no-activate", action="store_true")
+    activate_parser = subparsers.add_parser("activate", help="Switch to a generation")
+    activate_parser.add_argument("generation")
+    subparsers.add_parser(
+        "rollback", help="Switch back to the previously active generation"
+    )
+    gc_parser = subparsers.add_parser("gc", help="Delete old generations")
+    gc_parser.add_argument("--keep", type=int, default=KEEP_GENERATIONS)
+    subparsers.add_parser(
+        "adopt", help="Turn the existing normalized_windows folder into a generation"
+    )
+    args = parser.parse_args()
+
+    if args.command == "list":
+        active = active_generation()
+        for manifest in list_generations():
+            marker = "*" if manifest["id"] == active else " "
+            print(
+                f"{marker} {manifest['id']}  {manifest['status']:<8}  {manifest['params']}  "
+                f"{manifest.get('windows', '?')} windows, {manifest.get('events', '?')} events"
+            )
+    elif args.command == "build":
+        gen_id = build_generation(
+            args.window_size,
+            args.overlap,
+            args.rebuild,
+            not args.no_activate,
+            event_budget=args.event_budget,
+            overlap_unit=args.overlap_unit,
+            pad=not args.no_pad,
+        )
+        print(f"Built generation {gen_id}")
+    elif args.command == "activate":
+        activate(args.generation)
+        print(f"Activated generation {args.generation}")
+    elif args.command == "rollback":
+        print(f"Rolled back to generation {rollback()}")
+    elif args.command == "gc":
+        deleted = collect_garbage(args.keep)
+        print(f"Deleted {len(deleted)} generations")
+    else:
+        print(f"Adopted normalized_windows as generation {adopt_legacy()}")
@@ -0,0 +1,295 @@
+# Write-ahead job journal for ingestion.
+#
+# Every file that process_musicxml_files picks up gets a row in ingest_journal, in
+# the same database (and the same transaction) as its master_score_list row, and
+# moves through these states:
+#
+#   queued     backup copied, master_score_list row inserted
+#   parsing    a worker started parsing it
+#   parsed     the parsed JSON is safely in the staging directory
+#   written    new_title/index_number assigned and the final JSON is being written
+#   committed  everything's done and the source file was removed
+#
+# plus the terminal states failed and dropped (near-duplicate). If a run crashes or
+# gets Ctrl-C'd, the next run picks every unfinished job back up from its state, so
+# files that were already parsed don't get parsed again. Run this file directly to
+# see the journal or to repair drift between the catalog and the filesystem:
+#   python job_journal.py status
+#   python job_journal.py reconcile [--dry-run]
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
+STAGING_DIR = BASE_DIR / "parse_staging"
+PARSED_DIR = BASE_DIR / "parsed"
+PARSED_BACKUP_DIR = BASE_DIR / "parsed_backup"
+ORIGINAL_FILES_DIR = BASE_DIR / "original_files"
+# what ingest picks up from the inbox (pipeline_cli status counts the same files)
+SCORE_EXTENSIONS = (".xml", ".musicxml")
+
+QUEUED = "queued"
+PARSING = "parsing"
+PARSED = "parsed"
+WRITTEN = "written"
+COMMITTED = "committed"
+FAILED = "failed"
+DROPPED = "dropped"
+UNFINISHED_STATES = (QUEUED, PARSING, PARSED, WRITTEN)
+
+SQLITE_TIMEOUT = 60  # seconds; the parse workers update the journal too
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT)
+    # WAL lets the workers mark jobs while the parent holds the database open
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+
+def setup_journal_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_journal (
+        record_id INTEGER PRIMARY KEY,
+        source_path TEXT NOT NULL,
+        composer TEXT NOT NULL,
+        state TEXT NOT NULL,
+        staged_path TEXT,
+        final_path TEXT,
+        attempts INTEGER DEFAULT 0,
+        error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ingest_journal_state ON ingest_journal (state)"
+    )
+    conn.commit()
+
+
+def enqueue(conn, source_path, composer, original_title):
+    """
+    Insert the master_score_list row and its queued job in one transaction.
+
+    Returns:
+        The new record id
+    """
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO master_score_list (new_title, original_title, composer) VALUES (?, ?, ?)",
+            (None, original_title, composer),
+        )
+        record_id = cursor.lastrowid
+        conn.execute(
+            "INSERT INTO ingest_journal (record_id, source_path, composer, state) VALUES (?, ?, ?, ?)",
+            (record_id, str(source_path), composer, QUEUED),
+        )
+    return record_id
+
+
+def set_state(conn, record_id, state, **fields):
+    """Move a job to a new state (and update any of staged_path/final_path/error)."""
+    assignments = ["state = ?", "updated_at = CURRENT_TIMESTAMP"]
+    values = [state]
+    for column in ("staged_path", "final_path", "error"):
+        if column in fields:
+            assignments.append(f"{column} = ?")
+            values.append(fields[column])
+    if state == PARSING:
+        assignments.append("attempts = attempts + 1")
+    values.append(record_id)
+    conn.execute(
+        f"UPDATE ingest_journal SET {', '.join(assignments)} WHERE record_id = ?", values
+    )
+
+
+def unfinished_jobs(conn):
+    """All jobs that didn't reach a terminal state, as dicts, oldest first."""
+    rows = conn.execute(
+        f"SELECT record_id, source_path, composer, state, staged_path, final_path FROM ingest_journal WHERE state IN ({','.join('?' * len(UNFINISHED_STATES))}) ORDER BY record_id",
+        UNFINISHED_STATES,
+    ).fetchall()
+    return [
+        {
+            "record_id": record_id,
+            "source_path": source_path,
+            "composer": composer,
+            "state": state,
+            "staged_path": staged_path,
+            "final_path": final_path,
+        }
+        for record_id, source_path, composer, state, staged_path, final_path in rows
+    ]
+
+
+def write_json_durably(path, data, indent=None):
+    """Write JSON to a temp file, fsync it, then rename it into place."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def staged_path_for(record_id, staging_dir=STAGING_DIR):
+    return Path(staging_dir) / f"{record_id}.json"
+
+
+def mark_parsing(db_path, record_id):
+    """Called from a parse worker, with its own connection."""
+    conn = connect(db_path)
+    with conn:
+        set_state(conn, record_id, PARSING)
+    conn.close()
+
+
+def stage_parsed(db_path, record_id, parsed_data, staging_dir=STAGING_DIR):
+    """Called from a parse worker: save the result durably, then mark the job parsed."""
+    staged_path = staged_path_for(record_id, staging_dir)
+    write_json_durably(staged_path, parsed_data)
+    conn = connect(db_path)
+    with conn:
+        set_state(conn, record_id, PARSED, staged_path=str(staged_path))
+    conn.close()
+    return staged_path
+
+
+def load_staged(job):
+    """
+    The parse result of a parsed or written job. A written job whose staged copy is
+    already cleaned up still has its final JSON.
+    """
+    path = job["staged_path"]
+    if job["state"] == WRITTEN and not (path and Path(path).exists()):
+        path = job["final_path"]
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def journal_status(conn):
+    return dict(
+        conn.execute("SELECT state, COUNT(*) FROM ingest_journal GROUP BY state").fetchall()
+    )
+
+
+def reconcile(db_path="score_database.db", dry_run=False, staging_dir=STAGING_DIR):
+    """
+    Repair drift between master_score_list, the journal and the filesystem.
+
+    - master_score_list rows with no new_title and no unfinished job are orphans from
+      a crash before the journal existed (or a failed cleanup): they get deleted
+    - unfinished jobs whose master_score_list row is gone are marked failed
+    - staged files that no unfinished job points to get deleted
+    - catalog rows whose parsed JSON isn't in parsed/ or parsed_backup/, and parsed
+      JSON files that aren't in the catalog, get reported
+
+    Returns:
+        A dict of what was found (and fixed unless dry_run)
+    """
+    conn = connect(db_path)
+    setup_journal_table(conn)
+    findings = {
+        "orphan_records": [],
+        "jobs_missing_record": [],
+        "stale_staged_files": [],
+        "records_missing_file": [],
+        "files_missing_record": [],
+    }
+
+    orphans = conn.execute(f"""
+        SELECT m.id, m.original_title FROM master_score_list m
+        LEFT JOIN ingest_journal j ON j.record_id = m.id
+        WHERE m.new_title IS NULL
+        AND (j.record_id IS NULL OR j.state NOT IN ({','.join('?' * len(UNFINISHED_STATES))}))
+        """, UNFINISHED_STATES).fetchall()
+    findings["orphan_records"] = orphans
+
+    missing_record = conn.execute(f"""
+        SELECT j.record_id, j.source_path FROM ingest_journal j
+        LEFT JOIN master_score_list m ON m.id = j.record_id
+        WHERE m.id IS NULL AND j.state IN ({','.join('?' * len(UNFINISHED_STATES))})
+        """, UNFINISHED_STATES).fetchall()
+    findings["jobs_missing_record"] = missing_record
+
+    live_staged = {
+        job["staged_path"] for job in unfinished_jobs(conn) if job["staged_path"]
+    }
+    if Path(staging_dir).exists():
+        findings["stale_staged_files"] = [
+            str(p) for p in Path(staging_dir).glob("*.json") if str(p) not in live_staged
+        ]
+
+    cataloged = conn.execute(
+        "SELECT id, composer, new_title FROM master_score_list WHERE new_title IS NOT NULL"
+    ).fetchall()
+    cataloged_names = set()
+    for record_id, composer, new_title in cataloged:
+        cataloged_names.add((composer, new_title))
+        if not (
+            (PARSED_DIR / composer / new_title).exists()
+            or (PARSED_BACKUP_DIR / composer / new_title).exists()
+        ):
+            findings["records_missing_file"].append((record_id, composer, new_title))
+    for parsed_root in (PARSED_DIR, PARSED_BACKUP_DIR):
+        if not parsed_root.exists():
+            continue
+        for json_file in parsed_root.glob("*/*.json"):
+            if (json_file.parent.name, json_file.name) not in cataloged_names:
+                findings["files_missing_record"].append(str(json_file))
+
+    if not dry_run:
+        with conn:
+            for record_id, _ in orphans:
+                conn.execute("DELETE FROM master_score_list WHERE id = ?", (record_id,))
+                conn.execute(
+                    "DELETE FROM ingest_journal WHERE record_id = ? AND state NOT IN (?, ?)",
+                    (record_id, FAILED, DROPPED),
+                )
+            for record_id, _ in missing_record:
+                set_state(conn, record_id, FAILED, error="master_score_list row missing")
+        for staged in findings["stale_staged_files"]:
+            Path(staged).unlink(missing_ok=True)
+
+    conn.close()
+    return findings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest job journal")
+    parser.add_argument("--db", default="score_database.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="Count jobs per state and list unfinished ones")
+    reconcile_parser = subparsers.add_parser(
+        "reconcile", help="Repair catalog and filesystem drift"
+    )
+    reconcile_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        conn = connect(args.db)
+        setup_journal_table(conn)
+        for state, count in sorted(journal_status(conn).items()):
+            print(f"{state:<10} {count}")
+        for job in unfinished_jobs(conn):
+            print(f"  {job['record_id']}: {job['state']} {job['source_path']}")
+        conn.close()
+    else:
+        findings = reconcile(args.db, dry_run=args.dry_run)
+        action = "Would fix" if args.dry_run else "Fixed"
+        print(f"{action} {len(findings['orphan_records'])} orphan master_score_list rows")
+        print(f"{action} {len(findings['jobs_missing_record'])} jobs without a record")
+        print(f"{action} {len(findings['stale_staged_files'])} stale staged files")
+        for record_id, composer, new_title in findings["records_missing_file"]:
+            print(f"Record {record_id} has no parsed file: {composer}/{new_title}")
+        for json_file in findings["files_missing_record"]:
+            print(f"Parsed file isn't in master_score_list: {json_file}")
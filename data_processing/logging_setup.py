@@ -0,0 +1,40 @@
+# Run log setup shared by the pipeline entry points. Kept in its own module (only the
+# standard library) so pipeline_cli's window/normalize commands don't have to import
+# the ingest stack just to get a log file.
+
+import logging
+from datetime import datetime
+from pathlib import Path
+
+
+def setup_logging(log_dir="logs"):
+    """
+    Set up logging configuration for the entire application.
+    Creates a new log file with timestamp for each run.
+
+    Args:
+        log_dir: Directory where log files will be stored
+
+    Returns:
+        A configured logger instance
+    """
+    log_path = Path(log_dir)
+    log_path.mkdir(exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_name = f"musicxml_processing_{timestamp}.log"
+    log_file = log_path / log_name
+
+    print(f"Logging to: {log_file}")
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    if root_logger.handlers:
+        root_logger.handlers.clear()
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(formatter)
+    root_logger.addHandler(file_handler)
+
+    return logging.getLogger(__name__)
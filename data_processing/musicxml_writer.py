@@ -0,0 +1,582 @@
+# Turns normalized window arrays back into MusicXML.
+#
+# This is the way back for generation: the model produces (measure, offset, part,
+# pitch_idx, duration) arrays like normalize_window does, and this writes them out as
+# MusicXML without building a music21 stream, since music21's write() is far too slow
+# to do for every suggestion. Rows at the same offset and duration become a chord,
+# overlapping events go into extra voices (with <backup>), gaps are filled with rests,
+# and pitches are spelled with sharps or flats depending on the measure's key.
+#
+# The part metadata (names, tempo, time and key signatures per measure) comes from
+# the parsed score or window the array was made from. Without it parts get generic
+# names and measures are as long as their content.
+#
+# pitch_idx 0 means rest, but normalize_window also uses it for pitches outside
+# pitch_min..pitch_max, so an out-of-range note comes back as a rest (and an
+# out-of-range note inside a chord is dropped).
+#
+#   python musicxml_writer.py write window.npy out.musicxml [--parsed Mozart0.json]
+#   python musicxml_writer.py roundtrip [--composers Bach]   (a few scores are also
+#       round-tripped by test_musicxml_writer.py)
+#   python musicxml_writer.py bench [--compare-music21]
+
+import argparse
+import json
+import logging
+import math
+import sys
+import tempfile
+import time
+from fractions import Fraction
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DIVISIONS = 480  # ticks per quarter; divides evenly by 2, 3, 4, 5, 6, 8, 16 and 32
+# finer divisions are picked per score when its durations need them (nested tuplets)
+MAX_DIVISIONS = 480 * 1024
+PITCH_MIN = 21
+
+SHARP_NAMES = [("C", 0), ("C", 1), ("D", 0), ("D", 1), ("E", 0), ("F", 0),
+               ("F", 1), ("G", 0), ("G", 1), ("A", 0), ("A", 1), ("B", 0)]
+FLAT_NAMES = [("C", 0), ("D", -1), ("D", 0), ("E", -1), ("E", 0), ("F", 0),
+              ("G", -1), ("G", 0), ("A", -1), ("A", 0), ("B", -1), ("B", 0)]
+
+# fifths of each major key; a minor key has the fifths of its tonic's major key minus 3
+MAJOR_FIFTHS = {
+    "C": 0, "G": 1, "D": 2, "A": 3, "E": 4, "B": 5, "F#": 6, "C#": 7,
+    "F": -1, "B-": -2, "E-": -3, "A-": -4, "D-": -5, "G-": -6, "C-": -7,
+    "G#": 8, "D#": 9, "A#": 10,  # only ever used as minor tonics
+}
+
+# quarter lengths of the plain note types, longest first
+NOTE_TYPES = [
+    (8.0, "breve"), (4.0, "whole"), (2.0, "half"), (1.0, "quarter"),
+    (0.5, "eighth"), (0.25, "16th"), (0.125, "32nd"), (0.0625, "64th"),
+]
+
+XML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+    '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+    '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+)
+
+
+def key_to_fifths(key_name):
+    """music21 key names ("E- major", "c# minor") to a <fifths> value, or None."""
+    if not key_name:
+        return None
+    tonic, _, mode = key_name.partition(" ")
+    fifths = MAJOR_FIFTHS.get(tonic[:1].upper() + tonic[1:])
+    if fifths is None:
+        return None
+    if mode == "minor":
+        fifths -= 3
+    return fifths if -7 <= fifths <= 7 else None
+
+
+def spell_midi(midi, fifths=0):
+    """(step, alter, octave) for a MIDI number, sharps in sharp keys and flats in flat keys."""
+    step, alter = (FLAT_NAMES if fifths < 0 else SHARP_NAMES)[midi % 12]
+    return step, alter, midi // 12 - 1
+
+
+def note_type(ticks, divisions=DIVISIONS):
+    """
+    (type, dots, tuplet) for a duration in ticks. tuplet is (actual, normal) or None.
+    type is None if the duration isn't a plain, dotted or triplet value; then the
+    note just gets its <duration> and readers work the rest out.
+    """
+    quarters = ticks / divisions
+    for length, name in NOTE_TYPES:
+        for dots, factor in ((0, 1.0), (1, 1.5), (2, 1.75)):
+            if abs(quarters - length * factor) < 1e-6:
+                return name, dots, None
+    for length, name in NOTE_TYPES:
+        if abs(quarters * 3 / 2 - length) < 1e-6:
+            return name, 0, (3, 2)
+    return None, 0, None
+
+
+def time_signature_ticks(ratio, divisions=DIVISIONS):
+    beats, _, beat_type = ratio.partition("/")
+    try:
+        return round(int(beats) * 4 / int(beat_type) * divisions)
+    except ValueError:
+        return None
+
+
+def choose_divisions(values):
+    """
+    Smallest multiple of DIVISIONS that puts every offset and duration on a whole
+    tick (falls back to DIVISIONS if that would be unreasonably fine).
+    """
+    divisions = DIVISIONS
+    for value in np.unique(np.asarray(values, dtype=np.float64)):
+        denominator = Fraction(float(value)).limit_denominator(1024).denominator
+        divisions = divisions * denominator // math.gcd(divisions, denominator)
+        if divisions > MAX_DIVISIONS:
+            return DIVISIONS
+    return divisions
+
+
+def measure_metadata(parts):
+    """
+    Time signature and key per (part index, measure number), carried forward from the
+    last measure that had one, the way they are in the score.
+    """
+    metadata = {}
+    for part_idx, part in enumerate(parts or []):
+        current_time = None
+        current_key = None
+        for measure in part["measure_data"]:
+            if measure.get("time_signatures"):
+                current_time = measure["time_signatures"][0]
+            if measure.get("key_signatures"):
+                current_key = measure["key_signatures"][0]
+            metadata[(part_idx, measure["measure_num"])] = (current_time, current_key)
+    return metadata
+
+
+def _note_xml(step_alter_octave, ticks, voice, divisions, chord=False):
+    parts = ["<note>"]
+    if chord:
+        parts.append("<chord/>")
+    if ticks == 0:
+        parts.append("<grace/>")
+    if step_alter_octave is None:
+        parts.append("<rest/>")
+    else:
+        step, alter, octave = step_alter_octave
+        parts.append(f"<pitch><step>{step}</step>")
+        if alter:
+            parts.append(f"<alter>{alter}</alter>")
+        parts.append(f"<octave>{octave}</octave></pitch>")
+    if ticks:
+        parts.append(f"<duration>{ticks}</duration>")
+    parts.append(f"<voice>{voice}</voice>")
+    name, dots, tuplet = note_type(ticks if ticks else divisions // 2, divisions)
+    if name:
+        parts.append(f"<type>{name}</type>")
+        parts.append("<dot/>" * dots)
+    if tuplet and ticks:
+        parts.append(
+            f"<time-modification><actual-notes>{tuplet[0]}</actual-notes>"
+            f"<normal-notes>{tuplet[1]}</normal-notes></time-modification>"
+        )
+    parts.append("</note>")
+    return "".join(parts)
+
+
+def _rest_fill(ticks, voice, divisions):
+    """Rests covering `ticks`, split into plain values where possible so they render nicely."""
+    chunks = []
+    remaining = ticks
+    for length, _ in NOTE_TYPES:
+        length_ticks = round(length * divisions)
+        while remaining >= length_ticks:
+            chunks.append(_note_xml(None, length_ticks, voice, divisions))
+            remaining -= length_ticks
+    if remaining > 0:
+        chunks.append(_note_xml(None, remaining, voice, divisions))
+    return chunks
+
+
+def group_measure(rows):
+    """
+    Group one part's rows in one measure into chords/notes/rests and assign voices.
+
+    Args:
+        rows: (offset_ticks, duration_ticks, midi or None) tuples
+
+    Returns:
+        A list of voices, each a list of (offset_ticks, duration_ticks, sorted midis
+        or None for a rest)
+    """
+    by_slot = {}
+    for offset, duration, midi in rows:
+        by_slot.setdefault((offset, duration), []).append(midi)
+
+    items = []
+    for (offset, duration), midis in by_slot.items():
+        pitched = sorted(m for m in midis if m is not None)
+        # unknown pitches sharing a slot with real ones were out-of-range chord notes
+        items.append((offset, duration, pitched or None))
+    # grace notes first (they belong in front of the note at their offset), then
+    # longest first, so the main line tends to stay in voice 1
+    items.sort(key=lambda item: (item[0], item[1] != 0, -item[1]))
+
+    voices = []
+    cursors = []
+    for item in items:
+        offset, duration, _ = item
+        for v, cursor in enumerate(cursors):
+            if cursor <= offset:
+                voices[v].append(item)
+                cursors[v] = offset + duration
+                break
+        else:
+            voices.append([item])
+            cursors.append(offset + duration)
+    return voices
+
+
+def iter_musicxml(
+    array,
+    parts=None,
+    pitch_min=PITCH_MIN,
+    pad_measures=False,
+    title=None,
+):
+    """
+    Stream a normalized window back out as MusicXML, one chunk at a time.
+
+    Args:
+        array: [events, 5] array of (measure, offset, part, pitch_idx, duration) rows;
+            all-zero rows are padding
+        parts: The parsed parts the array was made from (window["parts"] or
+            score["parts"]), for part names, tempo and time/key signatures
+        pitch_min: The pitch_min the array was normalized with
+        pad_measures: Fill every measure up to its time signature (for generated
+            material); otherwise measures are as long as their longest part, which
+            keeps pickups and short last measures intact
+        title: Optional work title
+
+    Yields:
+        Strings that concatenate to the MusicXML document
+    """
+    array = np.asarray(array)
+    rows = array[np.any(array != 0, axis=1)]
+    measures = rows[:, 0].astype(np.int64)
+    divisions = choose_divisions(np.concatenate([rows[:, 1], rows[:, 4]]))
+    offsets = np.rint(rows[:, 1].astype(np.float64) * divisions).astype(np.int64)
+    part_ids = rows[:, 2].astype(np.int64)
+    pitch_idx = rows[:, 3].astype(np.int64)
+    durations = np.rint(rows[:, 4].astype(np.float64) * divisions).astype(np.int64)
+
+    parts = parts or []
+    part_count = max(len(parts), int(part_ids.max()) + 1 if len(rows) else 0, 1)
+    metadata = measure_metadata(parts)
+
+    # (part, measure) -> rows
+    cells = {}
+    for m, o, p, pi, d in zip(measures, offsets, part_ids, pitch_idx, durations):
+        midi = int(pi) + pitch_min - 1 if pi > 0 else None
+        cells.setdefault((int(p), int(m)), []).append((int(o), int(d), midi))
+
+    if len(rows):
+        measure_numbers = list(range(int(measures.min()), int(measures.max()) + 1))
+    else:
+        measure_numbers = sorted({m["measure_num"] for p in parts for m in p["measure_data"]}) or [1]
+
+    # every part's measure has to be the same length, so work those out first
+    measure_ticks = {}
+    for m in measure_numbers:
+        content = max(
+            (o + d for p in range(part_count) for o, d, _ in cells.get((p, m), ())),
+            default=0,
+        )
+        time_sig = metadata.get((0, m), (None, None))[0]
+        signature_ticks = time_signature_ticks(time_sig, divisions) if time_sig else None
+        if content == 0 or pad_measures:
+            content = max(content, signature_ticks or 4 * divisions)
+        measure_ticks[m] = content
+
+    yield XML_HEADER
+    yield '<score-partwise version="4.0">\n'
+    if title:
+        yield f"<work><work-title>{escape(title)}</work-title></work>\n"
+    yield "<part-list>\n"
+    for p in range(part_count):
+        name = parts[p]["part_name"] if p < len(parts) and parts[p]["part_name"] else f"Part_{p + 1}"
+        yield (
+            f'<score-part id="P{p + 1}"><part-name>{escape(name)}</part-name>'
+            f'<score-instrument id="P{p + 1}-I1"><instrument-name>{escape(name)}'
+            f"</instrument-name></score-instrument></score-part>\n"
+        )
+    yield "</part-list>\n"
+
+    for p in range(part_count):
+        yield f'<part id="P{p + 1}">\n'
+        part_midis = [midi for (cp, _), r in cells.items() if cp == p for _, _, midi in r if midi]
+        treble = not part_midis or float(np.median(part_midis)) >= 60
+        tempo = parts[p].get("tempo") if p < len(parts) else None
+        last_time = None
+
+        for i, m in enumerate(measure_numbers):
+            chunks = [f'<measure number="{m}">']
+            time_sig, key_name = metadata.get((p, m)) or metadata.get((0, m)) or (None, None)
+            # a measure the parsed score has but with nothing in the array stays empty
+            in_source = (p, m) in metadata
+            # the keys in the parsed data are analyzed per measure, so they're only
+            # good for spelling; the key signature comes from the first measure
+            fifths = key_to_fifths(key_name)
+            attributes = []
+            if i == 0:
+                attributes.append(f"<divisions>{divisions}</divisions>")
+                if fifths is not None:
+                    attributes.append(f"<key><fifths>{fifths}</fifths></key>")
+            if time_sig and time_sig != last_time and time_signature_ticks(time_sig):
+                beats, _, beat_type = time_sig.partition("/")
+                attributes.append(
+                    f"<time><beats>{beats}</beats><beat-type>{beat_type}</beat-type></time>"
+                )
+                last_time = time_sig
+            if i == 0:
+                attributes.append(
+                    "<clef><sign>G</sign><line>2</line></clef>"
+                    if treble
+                    else "<clef><sign>F</sign><line>4</line></clef>"
+                )
+            if attributes:
+                chunks.append(f"<attributes>{''.join(attributes)}</attributes>")
+            if i == 0 and tempo:
+                chunks.append(
+                    '<direction placement="above"><direction-type><metronome>'
+                    f"<beat-unit>quarter</beat-unit><per-minute>{tempo:g}</per-minute>"
+                    f'</metronome></direction-type><sound tempo="{tempo:g}"/></direction>'
+                )
+
+            length = measure_ticks[m]
+            voices = group_measure(cells.get((p, m), ())) or [[]]
+            spelling_fifths = fifths or 0
+            for v, items in enumerate(voices, start=1):
+                if v > 1:
+                    chunks.append(f"<backup><duration>{length}</duration></backup>")
+                cursor = 0
+                for offset, duration, midis in items:
+                    if offset > cursor:
+                        chunks.extend(_rest_fill(offset - cursor, v, divisions))
+                    if midis is None:
+                        chunks.append(_note_xml(None, duration, v, divisions))
+                    else:
+                        for c, midi in enumerate(midis):
+                            chunks.append(
+                                _note_xml(
+                                    spell_midi(midi, spelling_fifths),
+                                    duration,
+                                    v,
+                                    divisions,
+                                    chord=c > 0,
+                                )
+                            )
+                    cursor = max(cursor, offset + duration)
+                if cursor < length:
+                    if not items and in_source:
+                        pass
+                    elif not items:
+                        chunks.append(
+                            f'<note><rest measure="yes"/><duration>{length}</duration>'
+                            f"<voice>{v}</voice></note>"
+                        )
+                    else:
+                        chunks.extend(_rest_fill(length - cursor, v, divisions))
+            chunks.append("</measure>\n")
+            yield "".join(chunks)
+        yield "</part>\n"
+    yield "</score-partwise>\n"
+
+
+def musicxml_string(array, parts=None, **kwargs):
+    return "".join(iter_musicxml(array, parts, **kwargs))
+
+
+def write_musicxml(array, out_path, parts=None, **kwargs):
+    """Write a normalized window to a MusicXML file. Returns the path."""
+    out_path = Path(out_path)
+    with open(out_path, "w", encoding="utf-8") as f:
+        for chunk in iter_musicxml(array, parts, **kwargs):
+            f.write(chunk)
+    return out_path
+
+
+def event_rows(array, decimals=3):
+    """The non-padding rows as sorted tuples, for comparing two arrays."""
+    array = np.asarray(array)
+    rows = array[np.any(array != 0, axis=1)]
+    return sorted(
+        tuple(float(v) for v in np.round(row.astype(np.float64), decimals)) for row in rows
+    )
+
+
+def has_repeated_measure_numbers(window):
+    """
+    True if a part uses a measure number twice (multi-movement files restart their
+    numbering). normalize_window keys rows by measure number, so those measures get
+    merged in the array and can't be written back apart.
+    """
+    for part in window["parts"]:
+        numbers = [m["measure_num"] for m in part["measure_data"]]
+        if len(numbers) != len(set(numbers)):
+            return True
+    return False
+
+
+def roundtrip_window(window):
+    """
+    Normalize a window, write it, parse the MusicXML back and normalize again.
+
+    The parser drops notes inside <voice>s, so some parsed measures are shorter in one
+    part than another, and the writer has to fill those with rests to keep the parts
+    lined up (music21 also fills completely empty measures itself). Those rests are
+    reported separately from real differences.
+
+    Returns:
+        (rows that went missing, pitched rows that appeared, rests that appeared),
+        all empty if the round trip was exact
+    """
+    from normalizer import normalize_window
+    from parsing_musicxml import parse_multitrack_score
+
+    array = normalize_window(window)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_path = write_musicxml(array, Path(tmp_dir) / "window.musicxml", window["parts"])
+        reparsed = parse_multitrack_score(str(xml_path), force_source=True)
+    if reparsed is None:
+        raise ValueError("music21 couldn't parse the written MusicXML")
+    before = event_rows(array)
+    after = event_rows(normalize_window(reparsed))
+    missing = [row for row in before if row not in after]
+    extra = [row for row in after if row not in before]
+    extra_notes = [row for row in extra if row[3] != 0]
+    extra_rests = [row for row in extra if row[3] == 0]
+    return missing, extra_notes, extra_rests
+
+
+def _corpus_windows(composers=None, window_size=10, overlap=5, max_files=None):
+    from benchmark_pipeline import collect_corpus
+    from parsing_musicxml import parse_multitrack_score
+    from windowser import make_window
+
+    files = collect_corpus(composers=composers)[:max_files]
+    for composer, score_file in files:
+        score = parse_multitrack_score(str(score_file), composer=composer)
+        if score is None:
+            continue
+        for window in make_window(score, window_size=window_size, overlap=overlap):
+            yield score_file, window
+
+
+def music21_write(array, parts=None, pitch_min=PITCH_MIN):
+    """The slow way (music21 streams + write), only used as the benchmark reference."""
+    from music21 import chord, note, stream
+
+    score = stream.Score()
+    rows = np.asarray(array)
+    rows = rows[np.any(rows != 0, axis=1)]
+    for p in sorted({int(x) for x in rows[:, 2]}):
+        part = stream.Part()
+        part_rows = rows[rows[:, 2] == p]
+        for m in sorted({int(x) for x in part_rows[:, 0]}):
+            measure = stream.Measure(number=m)
+            measure_rows = part_rows[part_rows[:, 0] == m]
+            for offset in sorted({float(x) for x in measure_rows[:, 1]}):
+                at_offset = measure_rows[measure_rows[:, 1] == offset]
+                duration = float(at_offset[0, 4])
+                midis = [int(x) + pitch_min - 1 for x in at_offset[:, 3] if x > 0]
+                if not midis:
+                    element = note.Rest(quarterLength=duration)
+                elif len(midis) == 1:
+                    element = note.Note(midis[0], quarterLength=duration)
+                else:
+                    element = chord.Chord(midis, quarterLength=duration)
+                measure.insert(offset, element)
+            part.append(measure)
+        score.insert(0, part)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        score.write("musicxml", fp=Path(tmp_dir) / "window.musicxml")
+
+
+def bench(composers=None, max_files=None, compare_music21=False):
+    """
+    Throughput of write_musicxml over the corpus windows (and of music21's writer on
+    the same arrays if compare_music21).
+
+    Returns:
+        A dict of windows, events, seconds and windows_per_s per writer
+    """
+    from normalizer import normalize_window
+
+    prepared = [
+        (normalize_window(window), window["parts"])
+        for _, window in _corpus_windows(composers, max_files=max_files)
+    ]
+    events = sum(len(event_rows(array)) for array, _ in prepared)
+    results = {}
+    writers = {"musicxml_writer": lambda a, p: musicxml_string(a, p)}
+    if compare_music21:
+        writers["music21"] = music21_write
+    for name, writer in writers.items():
+        started = time.perf_counter()
+        for array, parts in prepared:
+            writer(array, parts)
+        seconds = time.perf_counter() - started
+        results[name] = {
+            "windows": len(prepared),
+            "events": events,
+            "seconds": seconds,
+            "windows_per_s": len(prepared) / seconds if seconds else 0.0,
+            "events_per_s": events / seconds if seconds else 0.0,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write normalized windows back to MusicXML")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    write_parser = subparsers.add_parser("write", help="Write one .npy window as MusicXML")
+    write_parser.add_argument("npy_file", type=Path)
+    write_parser.add_argument("out_file", type=Path)
+    write_parser.add_argument(
+        "--parsed", type=Path, help="Parsed score/window JSON to take part metadata from"
+    )
+    write_parser.add_argument("--pad-measures", action="store_true")
+    for name, help_text in (
+        ("roundtrip", "Check corpus windows survive write -> parse -> normalize"),
+        ("bench", "Measure writer throughput over the corpus windows"),
+    ):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--composers", nargs="+", default=None)
+        sub.add_argument("--max-files", type=int, default=None)
+    subparsers.choices["bench"].add_argument("--compare-music21", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "write":
+        parts = None
+        if args.parsed:
+            with open(args.parsed) as f:
+                parts = json.load(f)["parts"]
+        write_musicxml(np.load(args.npy_file), args.out_file, parts, pad_measures=args.pad_measures)
+        print(f"Wrote {args.out_file}")
+    elif args.command == "roundtrip":
+        checked = failed = padded = skipped = 0
+        for score_file, window in _corpus_windows(args.composers, max_files=args.max_files):
+            if has_repeated_measure_numbers(window):
+                skipped += 1
+                continue
+            missing, extra_notes, extra_rests = roundtrip_window(window)
+            checked += 1
+            if missing or extra_notes:
+                failed += 1
+                print(
+                    f"{score_file.name} m{window['start_measure']}-{window['end_measure']}: "
+                    f"{len(missing)} missing, {len(extra_notes)} extra "
+                    f"(e.g. {(missing or extra_notes)[0]})"
+                )
+            elif extra_rests:
+                padded += 1
+        print(
+            f"{checked - failed}/{checked} windows round-tripped "
+            f"({padded} of them with filler rests added, {skipped} skipped for "
+            f"repeated measure numbers)"
+        )
+        sys.exit(1 if failed else 0)
+    else:
+        for name, result in bench(args.composers, args.max_files, args.compare_music21).items():
+            print(
+                f"{name:<16} {result['windows']} windows in {result['seconds']:.2f}s: "
+                f"{result['windows_per_s']:.1f} windows/s, {result['events_per_s']:.0f} events/s"
+            )
@@ -1,10 +1,11 @@
+import functools
 import json
 import logging
 import os
 from pathlib import Path
 
-import music21
-import numpy as np
+from pipeline_metrics import increment, span
+from write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +13,15 @@ logger = logging.getLogger(__name__)
 BASE_DIR = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
 TEMP_WINDOWS_DIR = BASE_DIR / "temporary_windows"
 NORMALIZED_WINDOWS_DIR = BASE_DIR / "normalized_windows"
+# real (unpadded, untruncated) event count of every .npy in a normalized folder
+EVENT_COUNTS_FILE = "event_counts.json"
 
 
+@functools.lru_cache(maxsize=None)
 def pitch_to_midi(pitch_str):
     # Convert 'C4' etc. to a MIDI number.
+    import music21
+
     try:
         n = music21.note.Note(pitch_str)
         return n.pitch.midi
@@ -24,16 +30,20 @@ def pitch_to_midi(pitch_str):
 
 
 def normalize_window(
-    window, pitch_min=21, pitch_max=108, max_events=3000, unknown_id=0
+    window, pitch_min=21, pitch_max=108, max_events=3000, unknown_id=0, pad=True
 ):
     """
     Convert a single window dict into a fixed-size numeric representation.
     1. Flatten all parts' measure_data -> (measure_num, offset, part_name, pitch, duration)
     2. Sort by measure_num, then offset
     3. Map pitch to integer or zero if unknown
-    4. Truncate or pad to max_events
-    5. Return a numpy array with shape [max_events, feature_dim]
+    4. Truncate or pad to max_events (with pad=False it's only truncated, for windows
+       cut by event budget that are already about the right size)
+    5. Return a numpy array with shape [max_events, feature_dim] ([events, feature_dim]
+       if not padded)
     """
+    import numpy as np
+
     flattened_events = []
     for part_idx, part in enumerate(window["parts"]):
         part_name = part["part_name"]
@@ -69,8 +79,12 @@ def normalize_window(
             (m_num, offset, float(part_id), float(pitch_idx), duration_val)
         )
     feature_dim = 5
-    output_array = np.zeros((max_events, feature_dim), dtype=np.float32)
+    rows = max_events if pad else min(len(numeric_events), max_events)
+    output_array = np.zeros((rows, feature_dim), dtype=np.float32)
     # Truncate if too long but I hope that doesn't happen
+    if len(numeric_events) > max_events:
+        increment("truncated_windows")
+        increment("truncated_events", len(numeric_events) - max_events)
     truncated_events = numeric_events[:max_events]
 
     for i, evt in enumerate(truncated_events):
@@ -78,81 +92,137 @@ def normalize_window(
     return output_array
 
 
-def ensure_directories_exist():
-    NORMALIZED_WINDOWS_DIR.mkdir(exist_ok=True)
-    logger.info(
-        f"Ensured normalized_windows directory exists: {NORMALIZED_WINDOWS_DIR}"
-    )
+def ensure_directories_exist(output_dir=NORMALIZED_WINDOWS_DIR):
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    logger.info(f"Ensured normalized_windows directory exists: {output_dir}")
+
 
+def load_event_counts(output_dir=NORMALIZED_WINDOWS_DIR):
+    """{window name: real event count} for a normalized folder ({} if there's no index)."""
+    counts_path = Path(output_dir) / EVENT_COUNTS_FILE
+    if not counts_path.exists():
+        return {}
+    with open(counts_path, "r") as f:
+        return json.load(f)
 
-def process_window_file(window_file):
+
+def save_event_counts(counts, output_dir=NORMALIZED_WINDOWS_DIR):
+    # written to a new file and renamed, since generations hard-link their parent's files
+    counts_path = Path(output_dir) / EVENT_COUNTS_FILE
+    tmp_path = counts_path.with_name(f".{EVENT_COUNTS_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(counts, f)
+    os.replace(tmp_path, counts_path)
+
+
+def process_window_file(
+    window_file, output_dir=NORMALIZED_WINDOWS_DIR, pad=True, writer=None
+):
     """
     Process a single window file:
     1. Load the JSON
     2. Normalize it
     3. Save as numpy array
-    4. Delete the original JSON file
+    4. Delete the original JSON file (once the .npy is written)
 
-    Returns True if successful, False otherwise
+    With a writer (write_behind.WriteBehind) steps 3 and 4 happen in the background,
+    so a failed save only shows up as the JSON file still being there after the
+    writer is flushed.
+
+    Returns the window's real event count if successful, None otherwise
     """
+    import numpy as np
+
     window_filename = window_file.name
     base_filename = window_file.stem
 
     try:
-        with open(window_file, "r") as f:
-            window_data = json.load(f)
-
-        normalized_data = normalize_window(window_data)
-        numpy_file = NORMALIZED_WINDOWS_DIR / f"{base_filename}.npy"
-        np.save(numpy_file, normalized_data)
-        window_file.unlink()
+        with span("normalize_load", window_file):
+            with open(window_file, "r") as f:
+                window_data = json.load(f)
+
+        with span("normalize", window_file):
+            normalized_data = normalize_window(window_data, pad=pad)
+        numpy_file = Path(output_dir) / f"{base_filename}.npy"
+        with write_behind(writer) as writer:
+            saved = writer.save_npy(numpy_file, normalized_data)
+            writer.after([saved], window_file.unlink, f"deleting {window_file}")
+        increment("windows_normalized")
 
         logger.info(f"Successfully normalized {window_filename}")
-        return True
+        if "event_count" in window_data:
+            return window_data["event_count"]
+        # windows cut before event counts were recorded
+        return int(np.count_nonzero(np.any(normalized_data != 0, axis=1)))
 
     except Exception as e:
         logger.error(f"Error normalizing {window_filename}: {str(e)}")
-        return False
+        increment("windows_normalize_failed")
+        return None
 
 
-def normalize_windows():
+def normalize_windows(
+    windows_dir=TEMP_WINDOWS_DIR, output_dir=NORMALIZED_WINDOWS_DIR, pad=True
+):
     """
     Main function to normalize all windows in the temporary_windows folder:
     1. Ensure the normalized_windows directory exists
     2. Process each window file
     3. Handle failures by keeping those files
+
+    Args:
+        windows_dir: Where the window JSON files are (a generation's windows/ dir
+            when called from generations.build_generation)
+        output_dir: Where the .npy files go
+        pad: Pad every window to max_events (pad=False keeps each window as long as
+            it really is, so the .npy files follow the event budget)
     """
     logger.info("Starting window normalization")
+    windows_dir = Path(windows_dir)
 
-    ensure_directories_exist()
+    ensure_directories_exist(output_dir)
 
-    if not TEMP_WINDOWS_DIR.exists():
-        logger.error(f"Temporary windows directory does not exist: {TEMP_WINDOWS_DIR}")
+    if not windows_dir.exists():
+        logger.error(f"Temporary windows directory does not exist: {windows_dir}")
         return
 
-    window_files = list(TEMP_WINDOWS_DIR.glob("*.json"))
+    window_files = list(windows_dir.glob("*.json"))
 
     if not window_files:
-        logger.warning(f"No window files found in {TEMP_WINDOWS_DIR}")
+        logger.warning(f"No window files found in {windows_dir}")
         return
 
     logger.info(f"Found {len(window_files)} window files to normalize")
 
     success_count = 0
     failure_count = 0
-
-    for window_file in window_files:
-        if process_window_file(window_file):
-            success_count += 1
-        else:
+    event_counts = load_event_counts(output_dir)
+    normalized = set()  # stems counted as successes in this run
+
+    with write_behind() as writer:
+        for window_file in window_files:
+            event_count = process_window_file(window_file, output_dir, pad, writer)
+            if event_count is not None:
+                event_counts[window_file.stem] = event_count
+                normalized.add(window_file.stem)
+                success_count += 1
+            else:
+                failure_count += 1
+    # a window whose .npy couldn't be written still has its JSON file (the counts of
+    # earlier runs and of windows that already failed above are left alone)
+    for window_file in windows_dir.glob("*.json"):
+        if window_file.stem in normalized:
+            event_counts.pop(window_file.stem, None)
+            success_count -= 1
             failure_count += 1
+    save_event_counts(event_counts, output_dir)
 
     logger.info(
         f"Normalization complete. Successes: {success_count}, Failures: {failure_count}"
     )
 
     if failure_count > 0:
-        failed_files = list(TEMP_WINDOWS_DIR.glob("*.json"))
+        failed_files = list(windows_dir.glob("*.json"))
         logger.info(
-            f"Failed files remain in {TEMP_WINDOWS_DIR}: {[f.name for f in failed_files]}"
+            f"Failed files remain in {windows_dir}: {[f.name for f in failed_files]}"
         )
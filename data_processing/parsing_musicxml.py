@@ -1,102 +1,165 @@
 # This file is part of a MusicXML processing system that parses MusicXML files, extracts relevant data, and stores it in a structured format. The script also includes logging functionality to track the processing status of each file.
 
 # This file contains one function which parses one musicxml file at a time, and returns a JSON object with the parsed data.
+# Big scores can also be split into work units (see score_splitter.py) that are parsed
+# with parse_score_unit in separate workers and put back together with merge_units.
 
-import json
 import logging
 import os
-from datetime import datetime
-
-import music21
-import numpy as np
-import pandas as pd
-from music21 import chord, converter, key, meter, note, stream, tempo
-
-
-def parse_multitrack_score(xml_path, composer=None):
-    logger = logging.getLogger(__name__)
-
-    try:
-        music21.environment.set("autoDownload", "deny")
-
-        logger.info(f"Starting to parse {xml_path}")
-        score = converter.parse(xml_path)
-        parts = score.parts if len(score.parts) > 0 else [score]
-        parts_data = []
-
-        for part_index, part in enumerate(parts):
-            part_name = None
-            instrument_objs = part.getInstruments(returnDefault=False, recurse=True)
-            if len(instrument_objs) > 0:
-                part_name = instrument_objs[0].instrumentName
-            if not part_name:
-                part_name = f"Part_{part_index + 1}"
-
-            measure_data_list = []
-            measures = part.getElementsByClass(stream.Measure)
-
-            for measure in measures:
-                measure_num = measure.measureNumber
-                tsigs = measure.getElementsByClass(meter.TimeSignature)
-                time_signatures = [t.ratioString for t in tsigs] if tsigs else []
-
-                key_signatures = []
-                try:
-                    local_key = measure.analyze("key")
-                    if local_key:
-                        key_signatures.append(local_key.name)
-                except Exception:
-                    pass
-
-                events = []
-                for elem in measure.notesAndRests:
-                    if isinstance(elem, note.Note):
-                        events.append(
-                            {
-                                "element_type": "note",
-                                "pitch": elem.nameWithOctave,
-                                "duration": float(elem.quarterLength),
-                                "offset_in_measure": float(elem.offset),
-                            }
-                        )
-                    elif isinstance(elem, chord.Chord):
-                        chord_notes = [n.nameWithOctave for n in elem.pitches]
-                        events.append(
-                            {
-                                "element_type": "chord",
-                                "pitch": chord_notes,
-                                "duration": float(elem.quarterLength),
-                                "offset_in_measure": float(elem.offset),
-                            }
-                        )
-                    else:
-                        events.append(
-                            {
-                                "element_type": "rest",
-                                "pitch": None,
-                                "duration": float(elem.quarterLength),
-                                "offset_in_measure": float(elem.offset),
-                            }
-                        )
-
-                measure_data_list.append(
+import time
+
+from pipeline_metrics import increment, observe, span
+
+
+def _parse_part(part):
+    """
+    Extract one music21 part (or PartStaff) into the parsed part dict.
+
+    The part name is None if the part has no instrument name; the caller numbers
+    those by their position in the whole score.
+
+    Returns:
+        (part dict, number of measures, number of events, seconds spent on key analysis)
+    """
+    from music21 import chord, meter, note, stream, tempo
+
+    part_name = None
+    instrument_objs = part.getInstruments(returnDefault=False, recurse=True)
+    if len(instrument_objs) > 0:
+        part_name = instrument_objs[0].instrumentName
+
+    measure_data_list = []
+    measures = part.getElementsByClass(stream.Measure)
+    key_analysis_seconds = 0.0
+    measure_count = 0
+    event_count = 0
+
+    for measure in measures:
+        measure_num = measure.measureNumber
+        tsigs = measure.getElementsByClass(meter.TimeSignature)
+        time_signatures = [t.ratioString for t in tsigs] if tsigs else []
+
+        key_signatures = []
+        key_started = time.perf_counter()
+        try:
+            local_key = measure.analyze("key")
+            if local_key:
+                key_signatures.append(local_key.name)
+        except Exception:
+            pass
+        key_analysis_seconds += time.perf_counter() - key_started
+
+        events = []
+        for elem in measure.notesAndRests:
+            if isinstance(elem, note.Note):
+                events.append(
                     {
-                        "measure_num": measure_num,
-                        "time_signatures": time_signatures,
-                        "key_signatures": key_signatures,
-                        "events": events,
+                        "element_type": "note",
+                        "pitch": elem.nameWithOctave,
+                        "duration": float(elem.quarterLength),
+                        "offset_in_measure": float(elem.offset),
+                    }
+                )
+            elif isinstance(elem, chord.Chord):
+                chord_notes = [n.nameWithOctave for n in elem.pitches]
+                events.append(
+                    {
+                        "element_type": "chord",
+                        "pitch": chord_notes,
+                        "duration": float(elem.quarterLength),
+                        "offset_in_measure": float(elem.offset),
+                    }
+                )
+            else:
+                events.append(
+                    {
+                        "element_type": "rest",
+                        "pitch": None,
+                        "duration": float(elem.quarterLength),
+                        "offset_in_measure": float(elem.offset),
                     }
                 )
 
-            tempos = part.getElementsByClass(tempo.MetronomeMark)
-            tempo_value = tempos[0].number if tempos else None
-
-            part_dict = {
-                "part_name": part_name,
-                "tempo": tempo_value,
-                "measure_data": measure_data_list,
+        measure_data_list.append(
+            {
+                "measure_num": measure_num,
+                "time_signatures": time_signatures,
+                "key_signatures": key_signatures,
+                "events": events,
             }
-            parts_data.append(part_dict)
+        )
+        measure_count += 1
+        event_count += len(events)
+
+    tempos = part.getElementsByClass(tempo.MetronomeMark)
+    tempo_value = tempos[0].number if tempos else None
+
+    part_dict = {
+        "part_name": part_name,
+        "tempo": tempo_value,
+        "measure_data": measure_data_list,
+    }
+    return part_dict, measure_count, event_count, key_analysis_seconds
+
+
+def _name_unnamed_parts(parts_data):
+    for part_index, part_dict in enumerate(parts_data):
+        if not part_dict["part_name"]:
+            part_dict["part_name"] = f"Part_{part_index + 1}"
+
+
+def _parse_parts(xml_path, force_source=False, store_pickle=True):
+    """
+    Parse a file with music21 and extract all of its parts, recording the metrics.
+
+    Returns:
+        A list of part dicts (unnamed parts still have part_name None)
+    """
+    # music21 takes a few hundred ms to import, so it's only imported once something
+    # actually gets parsed (not by the parent process or a status query)
+    import music21
+    from music21 import converter
+
+    music21.environment.set("autoDownload", "deny")
+
+    with span("music21_parse", xml_path):
+        score = converter.parse(
+            xml_path, forceSource=force_source, storePickle=store_pickle
+        )
+    parts = score.parts if len(score.parts) > 0 else [score]
+    parts_data = []
+    extract_started = time.perf_counter()
+    key_analysis_seconds = 0.0
+    measure_count = 0
+    event_count = 0
+
+    for part in parts:
+        part_dict, measures, events, key_seconds = _parse_part(part)
+        parts_data.append(part_dict)
+        measure_count += measures
+        event_count += events
+        key_analysis_seconds += key_seconds
+
+    # key analysis is timed on its own, so take it out of the extraction time
+    observe("key_analysis", key_analysis_seconds, xml_path)
+    observe(
+        "extract_events",
+        time.perf_counter() - extract_started - key_analysis_seconds,
+        xml_path,
+    )
+    increment("measures", measure_count)
+    increment("events", event_count)
+    return parts_data
+
+
+def parse_multitrack_score(xml_path, composer=None, force_source=False):
+    # force_source=True skips music21's pickle cache of previously parsed files
+    logger = logging.getLogger(__name__)
+
+    try:
+        logger.info(f"Starting to parse {xml_path}")
+        parts_data = _parse_parts(xml_path, force_source=force_source)
+        _name_unnamed_parts(parts_data)
 
         file_data = {
             "file_name": os.path.basename(xml_path),
@@ -110,3 +173,73 @@ def parse_multitrack_score(xml_path, composer=None):
     except Exception as e:
         logger.exception(f"Error parsing {xml_path}: {e}")
         return None
+
+
+def parse_score_unit(unit_path):
+    """
+    Parse one work unit written by score_splitter.split_score. Units are temporary,
+    so they're never read from or written to music21's pickle cache.
+
+    Returns:
+        The unit's part dicts (part names may be None), or None if it didn't parse
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        return _parse_parts(unit_path, force_source=True, store_pickle=False)
+    except Exception as e:
+        logger.exception(f"Error parsing work unit {unit_path}: {e}")
+        return None
+
+
+def merge_units(xml_path, composer, units):
+    """
+    Put the parts of a split score back together into what parse_multitrack_score
+    would have returned for the whole file.
+
+    Args:
+        xml_path: The original file
+        composer: Composer name
+        units: (unit info, parsed part dicts) pairs, where unit info is the dict from
+            score_splitter.split_score ("part_index" and "chunk_index")
+
+    Returns:
+        The parsed score dict, or None if any unit failed
+    """
+    if any(parts is None for _, parts in units):
+        return None
+
+    # music21 can turn one <part> into several PartStaffs, which is why chunks of the
+    # same part are merged staff by staff
+    by_part = {}
+    for unit, parts in sorted(
+        units, key=lambda u: (u[0]["part_index"], u[0]["chunk_index"])
+    ):
+        staves = by_part.setdefault(unit["part_index"], [])
+        if unit.get("carried_time"):
+            # the measure only has a time signature because the splitter carried it in
+            for part_dict in parts:
+                if part_dict["measure_data"]:
+                    part_dict["measure_data"][0]["time_signatures"] = []
+        for staff_index, part_dict in enumerate(parts):
+            if staff_index == len(staves):
+                staves.append(
+                    {
+                        "part_name": part_dict["part_name"],
+                        "tempo": part_dict["tempo"],
+                        "measure_data": [],
+                    }
+                )
+            staff = staves[staff_index]
+            if staff["tempo"] is None:
+                staff["tempo"] = part_dict["tempo"]
+            if not staff["part_name"]:
+                staff["part_name"] = part_dict["part_name"]
+            staff["measure_data"].extend(part_dict["measure_data"])
+
+    parts_data = [staff for part_index in sorted(by_part) for staff in by_part[part_index]]
+    _name_unnamed_parts(parts_data)
+    return {
+        "file_name": os.path.basename(xml_path),
+        "composer": composer,
+        "parts": parts_data,
+    }
@@ -0,0 +1,408 @@
+# Motif search index over the parsed corpus.
+#
+# Answers "where else does this motif appear, and what usually comes next?" without
+# scanning every window. Each part of each score is reduced to its melodic line
+# (notes, and the top note of chords) and cut into n-grams of
+# (interval from the previous note, duration) tokens, so the same motif matches in
+# any key. Every n-gram points to a postings list of (score id, part, note position)
+# stored in the database.
+#
+# Postings are stored as one segment per score: the score id, the number of entries,
+# then the (part, position) pairs delta-encoded as varints. New scores append a
+# segment, so the index grows as files are ingested (backup_and_rename calls
+# index_score for every saved file).
+#
+# Examples:
+#   python pattern_index.py build
+#   python pattern_index.py query C5 D5 E5 C5 G5 --durations 1 1 1 1 2
+
+import argparse
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from normalizer import pitch_to_midi
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
+# windowser deletes files from parsed/ after windowing them, but keeps a copy here
+PARSED_BACKUP_DIR = BASE_DIR / "parsed_backup"
+
+NGRAM_SIZE = 4  # intervals per n-gram, so 5 notes
+DURATION_QUANTUM = 1 / 48  # durations are snapped to a 48th of a quarter (covers triplets)
+
+
+def setup_pattern_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS pattern_sequences (
+        score_id INTEGER NOT NULL,
+        part_index INTEGER NOT NULL,
+        midis BLOB NOT NULL,
+        durations BLOB NOT NULL,
+        measures BLOB NOT NULL,
+        PRIMARY KEY (score_id, part_index)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS pattern_postings (
+        gram INTEGER PRIMARY KEY,
+        postings BLOB NOT NULL,
+        entry_count INTEGER NOT NULL
+    )
+    """)
+    conn.commit()
+
+
+def encode_varints(values):
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data):
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+
+def encode_segment(score_id, entries):
+    """Encode the sorted (part, position) entries of one score."""
+    values = [score_id, len(entries)]
+    prev_part, prev_pos = 0, 0
+    for part, pos in entries:
+        if part != prev_part:
+            prev_pos = 0
+        values.append(part - prev_part)
+        values.append(pos - prev_pos)
+        prev_part, prev_pos = part, pos
+    return encode_varints(values)
+
+
+def decode_postings(data):
+    """Decode a postings blob into a list of (score_id, part, position)."""
+    values = decode_varints(data)
+    postings = []
+    i = 0
+    while i < len(values):
+        score_id, count = values[i], values[i + 1]
+        i += 2
+        part, pos = 0, 0
+        for _ in range(count):
+            part_delta, pos_delta = values[i], values[i + 1]
+            i += 2
+            if part_delta:
+                pos = 0
+            part += part_delta
+            pos += pos_delta
+            postings.append((score_id, part, pos))
+    return postings
+
+
+def quantize_duration(duration):
+    return int(round(float(duration) / DURATION_QUANTUM))
+
+
+def melodic_line(part):
+    """(midi, duration, measure_num) for every pitched event of a part, top note for chords."""
+    line = []
+    for measure in part["measure_data"]:
+        for ev in measure["events"]:
+            if ev["element_type"] == "note":
+                midi = pitch_to_midi(ev["pitch"])
+            elif ev["element_type"] == "chord":
+                midis = [m for m in (pitch_to_midi(p) for p in ev["pitch"]) if m is not None]
+                midi = max(midis) if midis else None
+            else:
+                continue
+            if midi is None:
+                continue
+            line.append((midi, float(ev["duration"]), measure["measure_num"] or 0))
+    return line
+
+
+def token_sequence(midis, durations):
+    """Token i (for i >= 1) is (interval from note i-1 to note i, quantized duration of note i)."""
+    return [
+        (int(midis[i]) - int(midis[i - 1]), quantize_duration(durations[i]))
+        for i in range(1, len(midis))
+    ]
+
+
+def gram_key(tokens):
+    digest = hashlib.blake2b(repr(tuple(tokens)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def sequence_grams(tokens, n=NGRAM_SIZE):
+    """Yield (gram key, position of the first note of the n-gram) for a token sequence."""
+    for i in range(len(tokens) - n + 1):
+        # tokens[i] is the interval into note i + 1, so the n-gram starts at note i
+        yield gram_key(tokens[i : i + n]), i
+
+
+def index_score(conn, score_id, score_data, commit=True):
+    """Add one parsed score to the index (replaces it if it was indexed before)."""
+    if conn.execute(
+        "SELECT 1 FROM pattern_sequences WHERE score_id = ? LIMIT 1", (score_id,)
+    ).fetchone():
+        remove_score(conn, score_id, commit=False)
+
+    grams = {}
+    for part_index, part in enumerate(score_data["parts"]):
+        line = melodic_line(part)
+        if not line:
+            continue
+        midis = np.array([m for m, _, _ in line], dtype=np.int16)
+        durations = np.array([d for _, d, _ in line], dtype=np.float32)
+        measures = np.array([m for _, _, m in line], dtype=np.int32)
+        conn.execute(
+            "INSERT INTO pattern_sequences (score_id, part_index, midis, durations, measures) VALUES (?, ?, ?, ?, ?)",
+            (score_id, part_index, midis.tobytes(), durations.tobytes(), measures.tobytes()),
+        )
+        for key, pos in sequence_grams(token_sequence(midis, durations)):
+            grams.setdefault(key, []).append((part_index, pos))
+
+    conn.executemany(
+        """
+        INSERT INTO pattern_postings (gram, postings, entry_count) VALUES (?, ?, ?)
+        ON CONFLICT(gram) DO UPDATE SET
+            postings = CAST(postings || excluded.postings AS BLOB),
+            entry_count = entry_count + excluded.entry_count
+        """,
+        [
+            (key, encode_segment(score_id, entries), len(entries))
+            for key, entries in grams.items()
+        ],
+    )
+    if commit:
+        conn.commit()
+    return len(grams)
+
+
+def load_sequence(conn, score_id, part_index):
+    row = conn.execute(
+        "SELECT midis, durations, measures FROM pattern_sequences WHERE score_id = ? AND part_index = ?",
+        (score_id, part_index),
+    ).fetchone()
+    if row is None:
+        return None
+    return (
+        np.frombuffer(row[0], dtype=np.int16),
+        np.frombuffer(row[1], dtype=np.float32),
+        np.frombuffer(row[2], dtype=np.int32),
+    )
+
+
+def remove_score(conn, score_id, commit=True):
+    """Drop a score from the index, rewriting only the postings lists it appears in."""
+    rows = conn.execute(
+        "SELECT midis, durations FROM pattern_sequences WHERE score_id = ?", (score_id,)
+    ).fetchall()
+    keys = set()
+    for midis, durations in rows:
+        tokens = token_sequence(
+            np.frombuffer(midis, dtype=np.int16), np.frombuffer(durations, dtype=np.float32)
+        )
+        keys.update(key for key, _ in sequence_grams(tokens))
+
+    for key in keys:
+        row = conn.execute(
+            "SELECT postings FROM pattern_postings WHERE gram = ?", (key,)
+        ).fetchone()
+        if row is None:
+            continue
+        by_score = {}
+        for sid, part, pos in decode_postings(row[0]):
+            if sid != score_id:
+                by_score.setdefault(sid, []).append((part, pos))
+        if not by_score:
+            conn.execute("DELETE FROM pattern_postings WHERE gram = ?", (key,))
+            continue
+        blob = b"".join(encode_segment(sid, entries) for sid, entries in by_score.items())
+        conn.execute(
+            "UPDATE pattern_postings SET postings = ?, entry_count = ? WHERE gram = ?",
+            (blob, sum(len(e) for e in by_score.values()), key),
+        )
+    conn.execute("DELETE FROM pattern_sequences WHERE score_id = ?", (score_id,))
+    if commit:
+        conn.commit()
+
+
+def find_occurrences(conn, midis, durations, n=NGRAM_SIZE):
+    """
+    Find every place the motif occurs, in any transposition.
+
+    Args:
+        midis: MIDI numbers of the motif (at least n + 1 notes)
+        durations: quarter-length durations of the motif notes
+
+    Returns:
+        A list of (score_id, part_index, note position, measure_num)
+    """
+    if len(midis) != len(durations):
+        raise ValueError("midis and durations must be the same length")
+    tokens = token_sequence(midis, durations)
+    if len(tokens) < n:
+        raise ValueError(f"A motif needs at least {n + 1} notes")
+
+    # start from the rarest n-gram of the motif, then check the full motif
+    best = None
+    for offset, (key, _) in enumerate(sequence_grams(tokens, n)):
+        row = conn.execute(
+            "SELECT postings, entry_count FROM pattern_postings WHERE gram = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return []
+        if best is None or row[1] < best[1]:
+            best = (row[0], row[1], offset)
+
+    postings, _, gram_offset = best
+    occurrences = []
+    sequences = {}
+    for score_id, part_index, pos in decode_postings(postings):
+        start = pos - gram_offset
+        if start < 0:
+            continue
+        if (score_id, part_index) not in sequences:
+            sequences[(score_id, part_index)] = load_sequence(conn, score_id, part_index)
+        seq_midis, seq_durations, seq_measures = sequences[(score_id, part_index)]
+        end = start + len(midis)
+        if end > len(seq_midis):
+            continue
+        if token_sequence(seq_midis[start:end], seq_durations[start:end]) != tokens:
+            continue
+        occurrences.append((score_id, part_index, start, int(seq_measures[start])))
+    return occurrences
+
+
+def suggest_continuations(conn, midis, durations, length=4, top_k=10, occurrences=None):
+    """
+    Rank what comes after the motif elsewhere in the corpus.
+
+    Pass occurrences if find_occurrences was already called for this motif.
+
+    Returns:
+        A list of dicts with the continuation as intervals and durations (relative to
+        the last motif note), how often it occurs, and up to five
+        (score_id, part_index, measure_num) examples
+    """
+    if occurrences is None:
+        occurrences = find_occurrences(conn, midis, durations)
+    counts = Counter()
+    examples = {}
+    sequences = {}
+    for score_id, part_index, start, measure_num in occurrences:
+        if (score_id, part_index) not in sequences:
+            sequences[(score_id, part_index)] = load_sequence(conn, score_id, part_index)
+        seq_midis, seq_durations, _ = sequences[(score_id, part_index)]
+        last = start + len(midis) - 1
+        following = token_sequence(
+            seq_midis[last : last + length + 1], seq_durations[last : last + length + 1]
+        )
+        if len(following) < length:
+            continue
+        key = tuple(following)
+        counts[key] += 1
+        examples.setdefault(key, [])
+        if len(examples[key]) < 5:
+            examples[key].append((score_id, part_index, measure_num))
+
+    return [
+        {
+            "intervals": [interval for interval, _ in key],
+            "durations": [q * DURATION_QUANTUM for _, q in key],
+            "count": count,
+            "examples": examples[key],
+        }
+        for key, count in counts.most_common(top_k)
+    ]
+
+
+def build_index(db_path="score_database.db", parsed_dir=PARSED_BACKUP_DIR):
+    """(Re)index every parsed score that's in master_score_list."""
+    conn = sqlite3.connect(db_path)
+    setup_pattern_tables(conn)
+    indexed = 0
+    for composer_dir in sorted(d for d in Path(parsed_dir).iterdir() if d.is_dir()):
+        for json_file in sorted(composer_dir.glob("*.json")):
+            row = conn.execute(
+                "SELECT id FROM master_score_list WHERE new_title = ?", (json_file.name,)
+            ).fetchone()
+            if row is None:
+                logger.warning(f"{json_file} isn't in master_score_list, skipping")
+                continue
+            with open(json_file, "r") as f:
+                score_data = json.load(f)
+            index_score(conn, row[0], score_data, commit=False)
+            indexed += 1
+    conn.commit()
+    conn.close()
+    logger.info(f"Indexed {indexed} scores")
+    return indexed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Motif search index")
+    parser.add_argument("--db", default="score_database.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Index all parsed scores")
+    build_parser.add_argument("--parsed-dir", type=Path, default=PARSED_BACKUP_DIR)
+    query_parser = subparsers.add_parser("query", help="Find a motif and its continuations")
+    query_parser.add_argument("pitches", nargs="+", help="Pitches like C5 D5 E5")
+    query_parser.add_argument("--durations", type=float, nargs="+")
+    query_parser.add_argument("--length", type=int, default=4)
+    query_parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"Indexed {build_index(args.db, args.parsed_dir)} scores")
+    else:
+        midis = [pitch_to_midi(p) for p in args.pitches]
+        bad = [p for p, midi in zip(args.pitches, midis) if midi is None]
+        if bad:
+            parser.error(f"can't parse pitch(es): {' '.join(bad)} (use e.g. C4 F#5 B-3)")
+        if len(midis) < NGRAM_SIZE + 1:
+            parser.error(f"a motif needs at least {NGRAM_SIZE + 1} pitches, got {len(midis)}")
+        if args.durations and len(args.durations) != len(midis):
+            parser.error(f"got {len(args.durations)} durations for {len(midis)} pitches")
+        conn = sqlite3.connect(args.db)
+        durations = args.durations or [1.0] * len(midis)
+        started = time.perf_counter()
+        occurrences = find_occurrences(conn, midis, durations)
+        continuations = suggest_continuations(
+            conn,
+            midis,
+            durations,
+            length=args.length,
+            top_k=args.top_k,
+            occurrences=occurrences,
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"{len(occurrences)} occurrences ({elapsed_ms:.1f} ms)")
+        for score_id, part_index, _, measure_num in occurrences[:20]:
+            print(f"  score {score_id}, part {part_index}, measure {measure_num}")
+        for suggestion in continuations:
+            print(
+                f"  {suggestion['count']}x intervals {suggestion['intervals']} "
+                f"durations {suggestion['durations']}"
+            )
+        conn.close()
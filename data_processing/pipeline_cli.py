@@ -0,0 +1,318 @@
+# One entry point for the pipeline stages.
+#
+# Every subcommand imports what it needs inside its handler, so `--help` or a
+# status query doesn't load music21, numpy, joblib or torch at all, and each stage
+# only pays for its own imports. The import-time budget of the light commands is
+# checked by the `imports` subcommand (exits 1 if something heavy sneaks back into
+# a module-level import); test_pipeline_cli.py runs the same check.
+#
+#   python pipeline_cli.py ingest [--profile-slow-files --split-min-bytes 500000 --measures-per-unit 100]
+#   python pipeline_cli.py window [--event-budget 128 256 --overlap 64 --overlap-unit events --no-pad]
+#   python pipeline_cli.py normalize [--generation g20250101_120000]
+#   python pipeline_cli.py status [--db score_database.db]
+#   python pipeline_cli.py bench -- --composers Bach --replicate 3
+#   python pipeline_cli.py imports
+
+import argparse
+import logging
+import re
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
+# the folder process_musicxml_files picks new scores up from
+INBOX_DIR = BASE_DIR / "need_to_be_processed_test"
+
+# cumulative import time allowed for the modules the light commands (status, help)
+# load, measured in a fresh interpreter; a few times what they take now, so only an
+# accidental heavy import trips it
+IMPORT_BUDGET_SECONDS = {
+    "pipeline_cli": 0.05,
+    "job_journal": 0.05,
+    "generations": 0.08,
+    "db_snapshots": 0.05,
+    "logging_setup": 0.05,
+    # imported by every parse worker, so numpy & co. have to stay out of it too
+    "backup_and_rename": 0.1,
+}
+# none of these should be imported by the modules above
+HEAVY_MODULES = ("music21", "numpy", "pandas", "joblib", "tqdm", "torch")
+IMPORT_TIME_RUNS = 3
+
+
+def cmd_ingest(args):
+    from backup_and_rename import process_musicxml_files
+    from db_snapshots import wait_for_snapshots
+    from logging_setup import setup_logging
+
+    setup_logging()
+    process_musicxml_files(
+        profile_slow_files=args.profile_slow_files,
+        split_min_bytes=args.split_min_bytes,
+        measures_per_unit=args.measures_per_unit,
+    )
+    if wait_for_snapshots():
+        print("Database snapshot saved.")
+    return 0
+
+
+def cmd_window(args):
+    from generations import build_generation
+    from logging_setup import setup_logging
+
+    setup_logging()
+    gen_id = build_generation(
+        args.window_size,
+        args.overlap,
+        args.rebuild,
+        not args.no_activate,
+        event_budget=args.event_budget,
+        overlap_unit=args.overlap_unit,
+        pad=not args.no_pad,
+    )
+    print(f"Built generation {gen_id}")
+    return 0
+
+
+def cmd_normalize(args):
+    from generations import renormalize
+    from logging_setup import setup_logging
+
+    setup_logging()
+    failed = renormalize(args.generation)
+    print(f"{failed} windows still failed to normalize")
+    return 1 if failed else 0
+
+
+def inbox_counts(inbox_dir=INBOX_DIR):
+    """Scores waiting to be ingested, per composer folder."""
+    from job_journal import SCORE_EXTENSIONS
+
+    inbox_dir = Path(inbox_dir)
+    if not inbox_dir.exists():
+        return {}
+    counts = {}
+    for composer_dir in sorted(d for d in inbox_dir.iterdir() if d.is_dir()):
+        count = sum(
+            1 for f in composer_dir.iterdir() if f.suffix.lower() in SCORE_EXTENSIONS
+        )
+        if count:
+            counts[composer_dir.name] = count
+    return counts
+
+
+def cmd_status(args):
+    import sqlite3
+
+    from db_snapshots import list_snapshots, snapshot_created
+    from generations import active_generation, read_manifest
+    from job_journal import UNFINISHED_STATES, journal_status
+
+    if Path(args.db).exists():
+        # read-only, so a status query never changes the database (or its journal mode)
+        conn = sqlite3.connect(f"file:{Path(args.db).resolve()}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT processing_status, COUNT(*) FROM master_score_list GROUP BY processing_status"
+            ).fetchall()
+            print(f"Scores: {sum(count for _, count in rows)}")
+            for status, count in sorted(rows, key=lambda row: str(row[0])):
+                print(f"  {status:<12} {count}")
+            try:
+                states = journal_status(conn)
+            except sqlite3.OperationalError:
+                states = {}
+            unfinished = sum(states.get(state, 0) for state in UNFINISHED_STATES)
+            print(f"Ingest journal: {unfinished} unfinished")
+            for state, count in sorted(states.items()):
+                print(f"  {state:<12} {count}")
+        finally:
+            conn.close()
+    else:
+        print(f"No database at {args.db}")
+
+    waiting = inbox_counts()
+    print(f"Waiting in {INBOX_DIR.name}: {sum(waiting.values())}")
+    for composer, count in waiting.items():
+        print(f"  {composer:<12} {count}")
+
+    gen_id = active_generation()
+    if gen_id is None:
+        print("No active generation")
+    else:
+        manifest = read_manifest(gen_id)
+        print(
+            f"Active generation: {gen_id} ({manifest.get('windows', '?')} windows, "
+            f"{manifest.get('events', '?')} events, {manifest.get('failed_windows', 0)} "
+            f"failed) {manifest['params']}"
+        )
+
+    snapshots = list_snapshots()
+    if snapshots:
+        age = datetime.now() - snapshot_created(snapshots[0])
+        print(f"Latest snapshot: {snapshots[0].name} ({age.total_seconds() / 3600:.1f} h ago)")
+    else:
+        print("No database snapshots")
+    return 0
+
+
+def cmd_bench(args):
+    from benchmark_pipeline import main as bench_main
+
+    return bench_main(args.bench_args)
+
+
+def measure_import(module, runs=IMPORT_TIME_RUNS):
+    """
+    Import a module in a fresh interpreter (from this folder) and time it with
+    -X importtime. The best of `runs` is used, since a busy machine only adds time,
+    and a heavy module pulled in by any of the runs counts.
+
+    Returns:
+        (cumulative import seconds, heavy modules it pulled in)
+    """
+    code = (
+        f"import sys; import {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    best = None
+    heavy = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+            check=True,
+        )
+        # "import time: self [us] | cumulative | imported package", nesting indented
+        match = re.search(
+            rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$",
+            result.stderr,
+            re.MULTILINE,
+        )
+        if match is None:
+            # a missing line would otherwise look like an import that took no time
+            raise RuntimeError(f"No -X importtime line for {module}")
+        seconds = int(match.group(1)) / 1e6
+        best = seconds if best is None else min(best, seconds)
+        heavy.update(m for m in result.stdout.strip().split(",") if m)
+    return best, [m for m in HEAVY_MODULES if m in heavy]
+
+
+def check_import_budget(budgets=IMPORT_BUDGET_SECONDS):
+    """
+    Returns:
+        A list of (module, seconds, budget, heavy modules) for modules over budget or
+        importing something heavy, empty if everything's fine
+    """
+    problems = []
+    for module, budget in budgets.items():
+        seconds, heavy = measure_import(module)
+        flag = "OK" if seconds <= budget and not heavy else "OVER"
+        print(
+            f"{module:<16} {seconds * 1000:6.1f} ms (budget {budget * 1000:.0f} ms) {flag}"
+            + (f", imports {', '.join(heavy)}" if heavy else "")
+        )
+        if flag != "OK":
+            problems.append((module, seconds, budget, heavy))
+    return problems
+
+
+def cmd_imports(args):
+    return 1 if check_import_budget() else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="NeurAllegro data pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Parse new scores from the inbox into the catalog"
+    )
+    ingest_parser.add_argument(
+        "--profile-slow-files",
+        action="store_true",
+        help="Re-run slow or memory-heavy parses under the profiler",
+    )
+    # same defaults as score_splitter, written out so --help doesn't import it
+    ingest_parser.add_argument(
+        "--split-min-bytes",
+        type=int,
+        default=1_000_000,
+        help="Parse the parts of files at least this big in parallel",
+    )
+    ingest_parser.add_argument(
+        "--measures-per-unit",
+        type=int,
+        help="Also cut the parts of split files into chunks of this many measures",
+    )
+    ingest_parser.set_defaults(handler=cmd_ingest)
+
+    # defaults written out here so this module doesn't import generations for them
+    window_parser = subparsers.add_parser(
+        "window", help="Window and normalize parsed scores into a new generation"
+    )
+    window_parser.add_argument("--window-size", type=int, default=10)
+    window_parser.add_argument("--overlap", type=int, default=5)
+    window_parser.add_argument(
+        "--event-budget",
+        type=int,
+        nargs=2,
+        metavar=("MIN", "MAX"),
+        help="Cut windows on measure lines to MIN-MAX events instead of --window-size measures",
+    )
+    window_parser.add_argument(
+        "--overlap-unit", choices=("measures", "events"), default="measures"
+    )
+    window_parser.add_argument(
+        "--no-pad", action="store_true", help="Save windows as long as they are"
+    )
+    window_parser.add_argument(
+        "--rebuild", action="store_true", help="Window all of parsed_backup"
+    )
+    window_parser.add_argument("--no-activate", action="store_true")
+    window_parser.set_defaults(handler=cmd_window)
+
+    normalize_parser = subparsers.add_parser(
+        "normalize", help="Retry windows a generation failed to normalize"
+    )
+    normalize_parser.add_argument(
+        "--generation", help="Generation id (the active one by default)"
+    )
+    normalize_parser.set_defaults(handler=cmd_normalize)
+
+    status_parser = subparsers.add_parser(
+        "status", help="Catalog, journal, inbox, generation and snapshot summary"
+    )
+    # ingest always writes score_database.db in the working directory; this only
+    # points status at another copy (e.g. an unpacked snapshot)
+    status_parser.add_argument("--db", default="score_database.db")
+    status_parser.set_defaults(handler=cmd_status)
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="Run benchmark_pipeline (pass its options after --)"
+    )
+    bench_parser.add_argument("bench_args", nargs=argparse.REMAINDER)
+    bench_parser.set_defaults(handler=cmd_bench)
+
+    imports_parser = subparsers.add_parser(
+        "imports", help="Check the import-time budget of the light commands"
+    )
+    imports_parser.set_defaults(handler=cmd_imports)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "bench_args", None) and args.bench_args[0] == "--":
+        args.bench_args = args.bench_args[1:]
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
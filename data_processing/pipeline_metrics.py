@@ -0,0 +1,239 @@
+# Timing spans, counters and latency histograms for the processing pipeline.
+#
+# The pipeline modules record into the current registry with span()/increment()/observe(),
+# and at the end of a run write_run_report() saves a JSON report next to the run log
+# plus a Prometheus text file that node exporter's textfile collector can pick up.
+#
+# The parse workers are separate processes, so process_single_file records into its
+# own registry (use_registry) and sends the snapshot back with the result, and the
+# parent merges it in.
+
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# seconds; covers a tiny window dump up to a huge orchestral parse
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+METRIC_PREFIX = "neurallegro"
+# Point this at node exporter's --collector.textfile.directory
+PROMETHEUS_TEXTFILE = Path("logs/neurallegro_pipeline.prom")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["buckets"])
+        histogram.counts = list(data["counts"])
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.max = data["max"]
+        return histogram
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Can't merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        # one latency histogram per stage
+        self.stage_histograms = {}
+        # file -> stage -> seconds, so the report can show where a slow file spent its time
+        self.file_stages = defaultdict(lambda: defaultdict(float))
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def observe(self, stage, seconds, file=None):
+        if stage not in self.stage_histograms:
+            self.stage_histograms[stage] = Histogram()
+        self.stage_histograms[stage].observe(seconds)
+        if file is not None:
+            self.file_stages[str(file)][stage] += seconds
+
+    @contextmanager
+    def span(self, stage, file=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, file)
+
+    def snapshot(self):
+        """A plain dict (picklable, JSON-able) of everything recorded so far."""
+        return {
+            "counters": dict(self.counters),
+            "stages": {
+                stage: histogram.to_dict()
+                for stage, histogram in self.stage_histograms.items()
+            },
+            "files": {file: dict(stages) for file, stages in self.file_stages.items()},
+        }
+
+    def merge(self, snapshot):
+        """Fold in a snapshot from another registry (e.g. one from a worker process)."""
+        if not snapshot:
+            return
+        for name, value in snapshot["counters"].items():
+            self.counters[name] += value
+        for stage, data in snapshot["stages"].items():
+            histogram = Histogram.from_dict(data)
+            if stage in self.stage_histograms:
+                self.stage_histograms[stage].merge(histogram)
+            else:
+                self.stage_histograms[stage] = histogram
+        for file, stages in snapshot["files"].items():
+            for stage, seconds in stages.items():
+                self.file_stages[file][stage] += seconds
+
+    def report(self):
+        snapshot = self.snapshot()
+        stages = {}
+        for stage, data in snapshot["stages"].items():
+            stages[stage] = {
+                "count": data["count"],
+                "total_seconds": data["sum"],
+                "mean_seconds": data["sum"] / data["count"] if data["count"] else 0.0,
+                "max_seconds": data["max"],
+                "histogram": {
+                    "buckets": data["buckets"],
+                    "counts": data["counts"],
+                },
+            }
+        return {
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "wall_seconds": time.time() - self.started,
+            "counters": snapshot["counters"],
+            "stages": stages,
+            "files": snapshot["files"],
+        }
+
+    def prometheus_text(self):
+        lines = []
+        stage_metric = f"{METRIC_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {stage_metric} Time spent per pipeline stage in the last run.")
+        lines.append(f"# TYPE {stage_metric} histogram")
+        for stage, histogram in sorted(self.stage_histograms.items()):
+            for upper, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                lines.append(f'{stage_metric}_bucket{{stage="{stage}",le="{upper}"}} {count}')
+            lines.append(f'{stage_metric}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{stage_metric}_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{stage_metric}_count{{stage="{stage}"}} {histogram.count}')
+
+        # the file is rewritten every run, so counters are exported as last-run gauges
+        for name, value in sorted(self.counters.items()):
+            metric = f"{METRIC_PREFIX}_last_run_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:g}")
+
+        run_metric = f"{METRIC_PREFIX}_last_run_timestamp_seconds"
+        lines.append(f"# TYPE {run_metric} gauge")
+        lines.append(f"{run_metric} {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+@contextmanager
+def use_registry(registry):
+    """Record into `registry` instead of the global one inside the with block."""
+    global _registry
+    previous = _registry
+    _registry = registry
+    try:
+        yield registry
+    finally:
+        _registry = previous
+
+
+def reset_registry():
+    global _registry
+    _registry = MetricsRegistry()
+    return _registry
+
+
+def span(stage, file=None):
+    return _registry.span(stage, file)
+
+
+def increment(name, value=1):
+    _registry.increment(name, value)
+
+
+def observe(stage, seconds, file=None):
+    _registry.observe(stage, seconds, file)
+
+
+def write_atomic(path, text):
+    # node exporter may read the file at any moment, so never let it see half of one
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_run_report(log_dir="logs", textfile=PROMETHEUS_TEXTFILE, registry=None):
+    """
+    Write the JSON run report into log_dir and the Prometheus text file.
+
+    Returns:
+        The path of the JSON report
+    """
+    registry = registry or _registry
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_path = Path(log_dir) / f"metrics_{timestamp}.json"
+    write_atomic(report_path, json.dumps(registry.report(), indent=2))
+    if textfile is not None:
+        write_atomic(textfile, registry.prometheus_text())
+    return report_path
@@ -4,19 +4,33 @@
 # 1. Parse MusicXML files and backup originals
 # 2. Apply windowing to the JSON files
 # 3. Normalize the windowed data
+#
+# Steps 2 and 3 build a new dataset generation and switch normalized_windows over to
+# it (see generations.py), so a bad run can be rolled back with
+# `python generations.py rollback`.
+#
+# pipeline_cli.py runs the stages one at a time (and answers status queries without
+# importing any of the heavy stuff).
 
 
-from backup_and_rename import process_musicxml_files, setup_logging
-from normalizer import normalize_windows
-from windowser import make_windows
+from backup_and_rename import process_musicxml_files
+from db_snapshots import wait_for_snapshots
+from generations import build_generation
+from logging_setup import setup_logging
+from pipeline_metrics import span, write_run_report
 
 if __name__ == "__main__":
     setup_logging()
     print("=== Starting MusicXML Parsing ===")
-    process_musicxml_files()
+    with span("stage_ingest"):
+        process_musicxml_files()
     print("=== MusicXML Parsing Completed ===")
-    make_windows()
-    print("=== Windowing Completed ===")
-    normalize_windows()
-    print("=== Normalization Completed ===")
+    gen_id = build_generation()
+    print(f"=== Windowing and Normalization Completed (generation {gen_id}) ===")
+    # the database snapshot has been running alongside windowing/normalizing
+    with span("snapshot_wait"):
+        if wait_for_snapshots():
+            print("Database snapshot saved.")
+    report_path = write_run_report()
+    print(f"Run metrics written to {report_path}")
     print("=== MusicXML Processing Pipeline Completed ===")
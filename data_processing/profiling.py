@@ -0,0 +1,103 @@
+# Helpers for catching slow or memory-hungry files.
+#
+# process_single_file can watch every parse, and when a file goes over the time or
+# memory threshold it parses it again under cProfile (plus tracemalloc for memory
+# problems) and saves the results next to the run log, so nobody has to reproduce it
+# by hand.
+
+import cProfile
+import io
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+PROFILE_DIR = Path("logs") / "profiles"
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter for this process (Linux only, silently skipped elsewhere)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset_peak_rss (or since start if that isn't supported)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def profile_call(func, *args, trace_memory=False, **kwargs):
+    """
+    Call func under cProfile, and under tracemalloc too if trace_memory is set
+    (it makes music21 parsing many times slower, so only use it for memory problems).
+
+    Returns:
+        (func's return value, cProfile.Profile, report text)
+    """
+    profiler = cProfile.Profile()
+    if trace_memory:
+        tracemalloc.start(10)
+    started = time.perf_counter()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    out = io.StringIO()
+    out.write(f"Profiled run: {elapsed:.2f}s\n")
+    if trace_memory:
+        out.write(f"Traced peak allocation: {traced_peak / 1e6:.1f} MB\n")
+    out.write(f"\n=== Top {TOP_FUNCTIONS} functions by cumulative time ===\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    if not trace_memory:
+        return result, profiler, out.getvalue()
+
+    out.write(f"\n=== Top {TOP_ALLOCATIONS} allocation sites still held at the end ===\n")
+    for stat in snapshot.statistics("traceback")[:TOP_ALLOCATIONS]:
+        out.write(f"{stat.size / 1e6:.2f} MB in {stat.count} blocks\n")
+        for line in stat.traceback.format(limit=5):
+            out.write(f"    {line}\n")
+    return result, profiler, out.getvalue()
+
+
+def save_profile(file_path, record_id, profiler, report, reason, profile_dir=PROFILE_DIR):
+    """
+    Save a .prof (open it with snakeviz or pstats) and a readable .txt report,
+    tagged with the file name and its master_score_list id.
+
+    Returns:
+        The path of the .txt report
+    """
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    stem = f"{record_id}_{Path(file_path).stem}_{timestamp}"
+    profiler.dump_stats(profile_dir / f"{stem}.prof")
+    report_path = profile_dir / f"{stem}.txt"
+    with open(report_path, "w") as f:
+        f.write(f"File: {file_path}\n")
+        f.write(f"master_score_list id: {record_id}\n")
+        f.write(f"Reason: {reason}\n\n")
+        f.write(report)
+    return report_path
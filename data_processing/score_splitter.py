@@ -0,0 +1,204 @@
+# Splits big MusicXML scores into work units that can be parsed in parallel.
+#
+# File-level parallelism doesn't help with one huge orchestral or choral score: it's
+# parsed part by part on one core while the rest of the pool sits idle at the end of
+# the run. So process_musicxml_files splits files over SPLIT_MIN_BYTES into one small
+# MusicXML document per part (and, if MEASURES_PER_UNIT is set, per range of measures
+# of each part), parses the units in the same pool as everything else, and puts the
+# parts back together with parsing_musicxml.merge_units.
+#
+# The splitting is plain ElementTree work, no music21. Every unit keeps the score
+# header and its own <score-part>, and a chunk that doesn't start at the first
+# measure gets the <divisions>, <time> and <staves> in effect at that point, since
+# durations, whole-measure rests and staff splitting depend on them. The unit
+# records whether it got a carried time signature, so merge_units can take it back
+# out of the parsed measure.
+#
+# Only score-partwise files are split. .mxl files are read straight from the zip.
+#
+#   python score_splitter.py Requiem.xml [--measures-per-unit 100]
+
+import argparse
+import logging
+import posixpath
+import shutil
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SPLIT_MIN_BYTES = 1_000_000  # smaller files parse quickly enough on one core
+# None splits by part only; a number also cuts each part into chunks of that many measures
+MEASURES_PER_UNIT = None
+# in the order MusicXML wants them inside <attributes>
+CARRIED_ATTRIBUTES = ("divisions", "time", "staves")
+
+
+def read_score_xml(path):
+    """The MusicXML bytes of a .xml/.musicxml file, or of the root file of an .mxl."""
+    path = Path(path)
+    if path.suffix.lower() != ".mxl":
+        return path.read_bytes()
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        if "META-INF/container.xml" in names:
+            container = ET.fromstring(archive.read("META-INF/container.xml"))
+            for rootfile in container.iter():
+                if rootfile.tag.endswith("rootfile") and rootfile.get("full-path"):
+                    return archive.read(posixpath.normpath(rootfile.get("full-path")))
+        for name in names:
+            if not name.startswith("META-INF/") and name.lower().endswith(
+                (".xml", ".musicxml")
+            ):
+                return archive.read(name)
+    raise ValueError(f"No MusicXML file inside {path}")
+
+
+def _attribute_elements(measure):
+    """{name: element} of the carried attributes a measure sets itself."""
+    found = {}
+    for attributes in measure.findall("attributes"):
+        for name in CARRIED_ATTRIBUTES:
+            element = attributes.find(name)
+            if element is not None:
+                found[name] = element
+    return found
+
+
+def _carried_attributes(measures, upto):
+    """
+    An <attributes> with the values in effect before measures[upto] that the measure
+    doesn't set itself, or None if there's nothing to carry.
+    """
+    current = {}
+    for measure in measures[:upto]:
+        current.update(_attribute_elements(measure))
+    for name in _attribute_elements(measures[upto]):
+        current.pop(name, None)
+    if not current:
+        return None
+    carried = ET.Element("attributes")
+    for name in CARRIED_ATTRIBUTES:
+        if name in current:
+            carried.append(current[name])
+    return carried
+
+
+def _unit_document(root, score_part, part):
+    """A copy of the score header with only one score-part and one part."""
+    unit_root = ET.Element(root.tag, root.attrib)
+    for child in root:
+        if child.tag == "part":
+            continue
+        if child.tag == "part-list":
+            part_list = ET.SubElement(unit_root, "part-list", child.attrib)
+            part_list.append(score_part)
+        else:
+            unit_root.append(child)
+    unit_root.append(part)
+    return ET.ElementTree(unit_root)
+
+
+def split_score(
+    path, out_dir, measures_per_unit=MEASURES_PER_UNIT, min_bytes=SPLIT_MIN_BYTES
+):
+    """
+    Write the work units of a score to out_dir.
+
+    Args:
+        path: MusicXML or .mxl file
+        out_dir: Where the unit files go (created if needed)
+        measures_per_unit: Also cut every part into chunks of this many measures
+        min_bytes: Don't split files with less MusicXML than this
+
+    Returns:
+        A list of {"path", "part_index", "chunk_index", "bytes", "carried_time"}
+        dicts, empty if the file isn't worth splitting (too small, one unit, or not
+        score-partwise)
+    """
+    data = read_score_xml(path)
+    if len(data) < min_bytes:
+        return []
+    root = ET.fromstring(data)
+    if root.tag != "score-partwise":
+        return []
+
+    part_list = root.find("part-list")
+    score_parts = {
+        score_part.get("id"): score_part
+        for score_part in (part_list.findall("score-part") if part_list is not None else [])
+    }
+    parts = root.findall("part")
+
+    chunks = []
+    for part_index, part in enumerate(parts):
+        measures = part.findall("measure")
+        step = measures_per_unit or len(measures) or 1
+        for chunk_index, start in enumerate(range(0, max(len(measures), 1), step)):
+            chunks.append((part_index, chunk_index, part, measures, start, step))
+    if len(chunks) < 2:
+        return []
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    units = []
+    for part_index, chunk_index, part, measures, start, step in chunks:
+        chunk = ET.Element("part", part.attrib)
+        carried_time = False
+        for i, measure in enumerate(measures[start : start + step]):
+            if i == 0 and start > 0:
+                carried = _carried_attributes(measures, start)
+                if carried is not None:
+                    carried_time = carried.find("time") is not None
+                    # a shallow copy, so the original measure isn't changed
+                    measure = ET.Element(measure.tag, measure.attrib)
+                    measure.extend([carried] + list(measures[start]))
+            chunk.append(measure)
+        score_part = score_parts.get(part.get("id"), ET.Element("score-part", {"id": part.get("id", "")}))
+        unit_path = out_dir / f"{Path(path).stem}_p{part_index}_c{chunk_index}.musicxml"
+        _unit_document(root, score_part, chunk).write(
+            unit_path, encoding="UTF-8", xml_declaration=True
+        )
+        units.append(
+            {
+                "path": str(unit_path),
+                "part_index": part_index,
+                "chunk_index": chunk_index,
+                "bytes": unit_path.stat().st_size,
+                "carried_time": carried_time,
+            }
+        )
+    logger.info(f"Split {path} into {len(units)} work units")
+    return units
+
+
+def plan_units(path, out_dir, measures_per_unit=MEASURES_PER_UNIT, min_bytes=SPLIT_MIN_BYTES):
+    """
+    split_score, but a file that can't be split (bad XML, broken .mxl) is just left
+    whole, so it fails (or not) in music21 the same way it always did.
+    """
+    try:
+        return split_score(path, out_dir, measures_per_unit, min_bytes)
+    except (ET.ParseError, ValueError, zipfile.BadZipFile, OSError) as e:
+        logger.warning(f"Couldn't split {path}, parsing it whole: {e}")
+        shutil.rmtree(out_dir, ignore_errors=True)
+        return []
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Split a score into parallel work units")
+    parser.add_argument("score", type=Path)
+    parser.add_argument("--out-dir", type=Path, default=Path("score_units"))
+    parser.add_argument("--measures-per-unit", type=int, default=MEASURES_PER_UNIT)
+    parser.add_argument("--min-bytes", type=int, default=0)
+    args = parser.parse_args()
+
+    units = split_score(args.score, args.out_dir, args.measures_per_unit, args.min_bytes)
+    for unit in units:
+        print(
+            f"part {unit['part_index']} chunk {unit['chunk_index']}: "
+            f"{unit['path']} ({unit['bytes']} bytes)"
+        )
+    print(f"{len(units)} work units")
@@ -3,6 +3,11 @@ import os
 import sqlite3
 from pathlib import Path
 
+from deduplicator import setup_dedup_tables
+from feature_catalog import setup_catalog_tables
+from job_journal import setup_journal_table
+from pattern_index import setup_pattern_tables
+
 
 def setup_database():
     # Set up the SQLite database and create the necessary tables for the MusicXML processing system.
@@ -34,6 +39,15 @@ def setup_database():
     )
     """)
 
+    # Tables for near-duplicate detection (MinHash signatures and LSH buckets)
+    setup_dedup_tables(conn)
+    # Motif search index (n-gram postings and melodic lines)
+    setup_pattern_tables(conn)
+    # Per-score, per-part and per-measure features for picking datasets with SQL
+    setup_catalog_tables(conn)
+    # Write-ahead journal so interrupted ingest runs can resume
+    setup_journal_table(conn)
+
     # Create directory structure
     base_dir = Path("/home/leahm/MusicXML/NeurAllegro/musicxml_files")
     dirs_to_create = [
@@ -0,0 +1,90 @@
+# Round-trip tests for musicxml_writer: windows of a few bundled scores are written
+# back to MusicXML, parsed again with parse_multitrack_score and normalized, and have
+# to come back with the same notes.
+#
+#   python -m pytest data_processing/test_musicxml_writer.py
+
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+import pytest
+from musicxml_writer import (
+    PITCH_MIN,
+    event_rows,
+    has_repeated_measure_numbers,
+    musicxml_string,
+    roundtrip_window,
+)
+
+UNPROCESSED_DIR = Path(__file__).resolve().parent.parent / "data" / "unprocessed"
+
+# none of these restart their measure numbers, so every window is checked
+ROUNDTRIP_SCORES = [
+    ("Mozart", "K279-1.xml"),
+    ("Leah", "Duet_for_clarinet_and_piano.musicxml"),
+    ("Bach", "Sinfonia_BWV792.xml"),
+]
+MAX_SKIPPED_WINDOWS = 0
+
+
+def pitch_idx(midi):
+    return midi - PITCH_MIN + 1
+
+
+def note_kind(note):
+    if note.find("chord") is not None:
+        return "chord"
+    return "rest" if note.find("rest") is not None else "note"
+
+
+@pytest.mark.parametrize("composer,file_name", ROUNDTRIP_SCORES)
+def test_corpus_windows_roundtrip(composer, file_name):
+    from parsing_musicxml import parse_multitrack_score
+    from windowser import make_window
+
+    score = parse_multitrack_score(str(UNPROCESSED_DIR / composer / file_name), composer)
+    assert score is not None
+    windows = list(make_window(score, window_size=10, overlap=5))
+    assert windows
+
+    skipped = 0
+    for window in windows:
+        if has_repeated_measure_numbers(window):
+            skipped += 1
+            continue
+        missing, extra_notes, _ = roundtrip_window(window)
+        where = f"{file_name} m{window['start_measure']}-{window['end_measure']}"
+        assert missing == [], f"{where}: {len(missing)} rows missing"
+        assert extra_notes == [], f"{where}: {len(extra_notes)} notes appeared"
+    assert skipped <= MAX_SKIPPED_WINDOWS, f"{skipped} windows skipped"
+
+
+def test_chords_and_rests():
+    from normalizer import normalize_window
+    from parsing_musicxml import parse_multitrack_score
+
+    # measure 1: C major triad, quarter rest, half-note G; measure 2: half rest, half-note C5
+    array = np.array(
+        [
+            (1, 0.0, 0, pitch_idx(60), 1.0),
+            (1, 0.0, 0, pitch_idx(64), 1.0),
+            (1, 0.0, 0, pitch_idx(67), 1.0),
+            (1, 1.0, 0, 0, 1.0),
+            (1, 2.0, 0, pitch_idx(67), 2.0),
+            (2, 0.0, 0, 0, 2.0),
+            (2, 2.0, 0, pitch_idx(72), 2.0),
+        ],
+        dtype=np.float32,
+    )
+    xml = musicxml_string(array)
+
+    kinds = [note_kind(note) for note in ET.fromstring(xml).iter("note")]
+    assert kinds == ["note", "chord", "chord", "rest", "note", "rest", "note"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_path = Path(tmp_dir) / "chords.musicxml"
+        xml_path.write_text(xml, encoding="utf-8")
+        reparsed = parse_multitrack_score(str(xml_path), force_source=True)
+    assert event_rows(normalize_window(reparsed)) == event_rows(array)
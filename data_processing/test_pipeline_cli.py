@@ -0,0 +1,25 @@
+# The import-time budget of the light pipeline_cli commands (see IMPORT_BUDGET_SECONDS):
+# fails if one of those modules gets slow to import or pulls numpy & co. back in at
+# module level.
+#
+#   python -m pytest data_processing/test_pipeline_cli.py
+
+import pytest
+from pipeline_cli import check_import_budget, measure_import
+
+
+def test_import_budget():
+    assert check_import_budget() == []
+
+
+def test_measure_import_reports_heavy_modules():
+    _, heavy = measure_import("normalizer", runs=1)
+    assert heavy == []
+    _, heavy = measure_import("deduplicator", runs=1)
+    assert "numpy" in heavy
+
+
+def test_measure_import_needs_importtime_line():
+    # sys is already loaded when the interpreter starts, so -X importtime never lists it
+    with pytest.raises(RuntimeError):
+        measure_import("sys", runs=1)
@@ -4,6 +4,9 @@ import os
 import shutil
 from pathlib import Path
 
+from pipeline_metrics import increment, span
+from write_behind import write_behind
+
 # get logger from root logger configured in main
 logger = logging.getLogger(__name__)
 
@@ -14,6 +17,53 @@ PARSED_DIR = BASE_DIR / "parsed"
 BACKUP_DIR = BASE_DIR / "parsed_backup"
 TEMP_WINDOWS_DIR = BASE_DIR / "temporary_windows"
 
+# (min, max) events per window for make_budget_windows. Fixed 10-measure windows of
+# the bundled corpus have ~100-160 events at the median and a few hundred at most,
+# so padding them to 3000 is almost all zeros
+DEFAULT_EVENT_BUDGET = (128, 256)
+OVERLAP_UNITS = ("measures", "events")
+
+
+def event_rows(ev):
+    """How many rows normalize_window makes out of one event (one per chord pitch)."""
+    if ev["element_type"] == "chord":
+        return len(ev["pitch"])
+    return 1
+
+
+def window_event_count(parts):
+    return sum(
+        event_rows(ev)
+        for part in parts
+        for measure in part["measure_data"]
+        for ev in measure["events"]
+    )
+
+
+def _window_record(score_data, start_measure, end_measure):
+    window_parts = []
+    for part in score_data["parts"]:
+        window_measure_data = []
+        for measure_dict in part["measure_data"]:
+            m_num = measure_dict["measure_num"]
+            if start_measure <= m_num <= end_measure:
+                window_measure_data.append(measure_dict)
+        part_dict = {
+            "part_name": part["part_name"],
+            "tempo": part["tempo"],
+            "measure_data": window_measure_data,
+        }
+        window_parts.append(part_dict)
+
+    return {
+        "original_file_name": score_data["file_name"],
+        "composer": score_data["composer"],
+        "start_measure": start_measure,
+        "end_measure": end_measure,
+        "event_count": window_event_count(window_parts),
+        "parts": window_parts,
+    }
+
 
 def make_window(score_data, window_size=10, overlap=5):
     logger.info("Creating windows with size %d and overlap %d", window_size, overlap)
@@ -38,39 +88,135 @@ def make_window(score_data, window_size=10, overlap=5):
         if end_measure > max_measure:
             break
 
-        window_parts = []
-        for part in score_data["parts"]:
-            window_measure_data = []
-            for measure_dict in part["measure_data"]:
-                m_num = measure_dict["measure_num"]
-                if start_measure <= m_num <= end_measure:
-                    window_measure_data.append(measure_dict)
-            part_dict = {
-                "part_name": part["part_name"],
-                "tempo": part["tempo"],
-                "measure_data": window_measure_data,
-            }
-            window_parts.append(part_dict)
-
-        window_record = {
-            "original_file_name": score_data["file_name"],
-            "composer": score_data["composer"],
-            "start_measure": start_measure,
-            "end_measure": end_measure,
-            "parts": window_parts,
-        }
-        windows.append(window_record)
+        windows.append(_window_record(score_data, start_measure, end_measure))
 
         start_measure += step
 
     return windows
 
 
-def ensure_directories_exist():
+def measure_event_counts(score_data):
+    """
+    Events per measure number, summed over every part.
+
+    Returns:
+        A sorted list of (measure_num, event count)
+    """
+    counts = {}
+    for part in score_data["parts"]:
+        for measure_dict in part["measure_data"]:
+            m_num = measure_dict["measure_num"]
+            counts[m_num] = counts.get(m_num, 0) + sum(
+                event_rows(ev) for ev in measure_dict["events"]
+            )
+    return sorted(counts.items())
+
+
+def budget_boundaries(counts, min_events, max_events, overlap=0, overlap_unit="measures"):
+    """
+    Pick window boundaries on measure lines so every window has at most max_events.
+
+    Each window takes measures until the next one would go over max_events. The last
+    window is pulled back over earlier measures until it has min_events (so a score
+    doesn't end in a sliver), and a single measure with more than max_events gets a
+    window to itself rather than being split.
+
+    Args:
+        counts: Events per measure, in order
+        min_events: Smallest window worth having
+        max_events: The budget
+        overlap: How much consecutive windows share, in overlap_unit
+        overlap_unit: "measures" or "events" (whole measures are shared either way,
+            as many as fit in that many events)
+
+    Returns:
+        A list of (first index, last index) into counts, both inclusive
+    """
+    if overlap_unit not in OVERLAP_UNITS:
+        raise ValueError(f"overlap_unit must be one of {OVERLAP_UNITS}, not {overlap_unit}")
+
+    bounds = []
+    start = 0
+    while start < len(counts):
+        end = start
+        total = counts[start]
+        while end + 1 < len(counts) and total + counts[end + 1] <= max_events:
+            end += 1
+            total += counts[end]
+
+        if end == len(counts) - 1:
+            while start > 0 and total < min_events and total + counts[start - 1] <= max_events:
+                start -= 1
+                total += counts[start]
+            # pulling back can swallow the windows before it
+            while bounds and bounds[-1][0] >= start:
+                bounds.pop()
+            bounds.append((start, end))
+            break
+        bounds.append((start, end))
+
+        if overlap_unit == "measures":
+            next_start = end + 1 - overlap
+        else:
+            next_start = end + 1
+            shared = 0
+            while next_start - 1 > start and shared + counts[next_start - 1] <= overlap:
+                next_start -= 1
+                shared += counts[next_start]
+        start = max(next_start, start + 1)
+    return bounds
+
+
+def make_budget_windows(
+    score_data,
+    min_events=DEFAULT_EVENT_BUDGET[0],
+    max_events=DEFAULT_EVENT_BUDGET[1],
+    overlap=DEFAULT_EVENT_BUDGET[1] // 4,
+    overlap_unit="events",
+):
+    """
+    Cut a score into windows by event count instead of a fixed number of measures,
+    so dense passages get short windows and sparse ones get long windows. Windows
+    still start and end on measure lines and have the same format as make_window's.
+
+    Returns:
+        A list of window dicts, each with its event_count
+    """
+    logger.info(
+        "Creating windows with %d-%d events and overlap %d %s",
+        min_events,
+        max_events,
+        overlap,
+        overlap_unit,
+    )
+    measures = measure_event_counts(score_data)
+    counts = [count for _, count in measures]
+    windows = []
+    for first, last in budget_boundaries(counts, min_events, max_events, overlap, overlap_unit):
+        window = _window_record(score_data, measures[first][0], measures[last][0])
+        if window["event_count"] == 0:
+            continue
+        if window["event_count"] > max_events:
+            increment("over_budget_windows")
+        windows.append(window)
+    return windows
+
+
+def cut_windows(score_data, window_size=10, overlap=5, event_budget=None, overlap_unit="measures"):
+    """make_budget_windows if there's an event_budget (min, max), otherwise make_window."""
+    if event_budget is None:
+        if overlap_unit != "measures":
+            raise ValueError("Fixed-size windows only overlap by measures")
+        return make_window(score_data, window_size=window_size, overlap=overlap)
+    min_events, max_events = event_budget
+    return make_budget_windows(score_data, min_events, max_events, overlap, overlap_unit)
+
+
+def ensure_directories_exist(windows_dir=TEMP_WINDOWS_DIR):
     BACKUP_DIR.mkdir(exist_ok=True)
-    TEMP_WINDOWS_DIR.mkdir(exist_ok=True)
+    Path(windows_dir).mkdir(parents=True, exist_ok=True)
 
-    logger.info(f"Ensured directories exist: {BACKUP_DIR}, {TEMP_WINDOWS_DIR}")
+    logger.info(f"Ensured directories exist: {BACKUP_DIR}, {windows_dir}")
 
 
 def backup_parsed_files():
@@ -95,72 +241,116 @@ def backup_parsed_files():
         json_files = list(composer_dir.glob("*.json"))
         for json_file in json_files:
             backup_path = backup_composer_dir / json_file.name
-            shutil.copy2(json_file, backup_path)
+            with span("parsed_backup_copy", json_file):
+                shutil.copy2(json_file, backup_path)
             logger.info(f"Backed up {json_file} to {backup_path}")
 
     logger.info("Backup completed successfully")
     return True
 
 
-def process_windows():
+def process_windows(
+    parsed_dir=PARSED_DIR,
+    windows_dir=TEMP_WINDOWS_DIR,
+    window_size=10,
+    overlap=5,
+    delete_parsed=True,
+    event_budget=None,
+    overlap_unit="measures",
+    writer=None,
+):
+    """
+    Cut every parsed JSON file in parsed_dir into windows and save them to windows_dir.
+    The window files are written by a write-behind queue while the next score is cut,
+    and a parsed file is only deleted once all of its windows are written.
+
+    Args:
+        parsed_dir: Composer folders of parsed JSON (parsed/ for new files, or
+            parsed_backup/ when rebuilding a whole generation)
+        windows_dir: Where the window JSON files go
+        window_size: Measures per window (ignored with an event_budget)
+        overlap: How much consecutive windows share, in overlap_unit
+        delete_parsed: Delete each parsed file once it's windowed (what the normal
+            incremental run does with parsed/)
+        event_budget: (min, max) events per window to cut windows by event count
+            (make_budget_windows) instead of by window_size measures
+        overlap_unit: "measures", or "events" with an event_budget
+        writer: A write_behind.WriteBehind to use (a new one is flushed and closed
+            before this returns)
+    """
     logger.info("Starting window processing")
+    parsed_dir = Path(parsed_dir)
+    windows_dir = Path(windows_dir)
 
-    if not PARSED_DIR.exists():
-        logger.error(f"PARSED directory does not exist: {PARSED_DIR}")
+    if not parsed_dir.exists():
+        logger.error(f"PARSED directory does not exist: {parsed_dir}")
         return False
 
-    composer_dirs = [d for d in PARSED_DIR.iterdir() if d.is_dir()]
+    composer_dirs = [d for d in parsed_dir.iterdir() if d.is_dir()]
 
     if not composer_dirs:
-        logger.warning(f"No composer directories found in {PARSED_DIR}")
+        logger.warning(f"No composer directories found in {parsed_dir}")
         return True
 
-    for composer_dir in composer_dirs:
-        composer_name = composer_dir.name
-        logger.info(f"Processing composer: {composer_name}")
-
-        json_files = list(composer_dir.glob("*.json"))
-        for json_file in json_files:
-            file_stem = json_file.stem  # such as "Mozart0"
-
-            logger.info(f"Processing file: {json_file}")
-
-            try:
-                with open(json_file, "r") as f:
-                    score_data = json.load(f)
-
-                if "file_name" not in score_data:
-                    score_data["file_name"] = json_file.stem
-
-                windows = make_window(score_data, window_size=10, overlap=5)
-
-                # save each window to a separate file (that's why this doesn't work with the old classifier)
-                for i, window in enumerate(windows):
-                    # create window filename (such as "Mozart0_0.json")
-                    window_filename = f"{file_stem}_{i}.json"
-                    window_path = TEMP_WINDOWS_DIR / window_filename
-
-                    with open(window_path, "w") as f:
-                        json.dump(window, f)
-
-                    logger.info(f"Saved window {i} to {window_path}")
-
-                json_file.unlink()
-                logger.info(f"Deleted original file: {json_file}")
-
-            except Exception as e:
-                logger.error(f"Error processing {json_file}: {str(e)}")
-
-    clean_empty_directories()
+    with write_behind(writer) as writer:
+        for composer_dir in composer_dirs:
+            composer_name = composer_dir.name
+            logger.info(f"Processing composer: {composer_name}")
+
+            json_files = list(composer_dir.glob("*.json"))
+            for json_file in json_files:
+                file_stem = json_file.stem  # such as "Mozart0"
+
+                logger.info(f"Processing file: {json_file}")
+
+                try:
+                    with span("window_load", json_file):
+                        with open(json_file, "r") as f:
+                            score_data = json.load(f)
+
+                    if "file_name" not in score_data:
+                        score_data["file_name"] = json_file.stem
+
+                    with span("make_window", json_file):
+                        windows = cut_windows(
+                            score_data, window_size, overlap, event_budget, overlap_unit
+                        )
+                    increment("windows", len(windows))
+
+                    # save each window to a separate file (that's why this doesn't work with the old classifier)
+                    window_writes = []
+                    for i, window in enumerate(windows):
+                        # create window filename (such as "Mozart0_0.json")
+                        window_filename = f"{file_stem}_{i}.json"
+                        window_path = windows_dir / window_filename
+                        window_writes.append(
+                            writer.write_json(window_path, window, stage="window_dump")
+                        )
+                    logger.info(f"Queued {len(windows)} windows of {json_file}")
+
+                    if delete_parsed:
+                        writer.after(
+                            window_writes, json_file.unlink, f"deleting {json_file}"
+                        )
+                    increment("files_windowed")
+
+                except Exception as e:
+                    logger.error(f"Error processing {json_file}: {str(e)}")
+                    increment("files_window_failed")
+
+        # the writer deletes the parsed files, so it has to catch up before cleaning up
+        writer.flush()
+        if delete_parsed:
+            clean_empty_directories(parsed_dir)
 
     logger.info("Window processing completed")
     return True
 
 
-def clean_empty_directories():
+def clean_empty_directories(parsed_dir=PARSED_DIR):
     logger.info("Cleaning up empty directories")
 
-    composer_dirs = [d for d in PARSED_DIR.iterdir() if d.is_dir()]
+    composer_dirs = [d for d in Path(parsed_dir).iterdir() if d.is_dir()]
 
     for composer_dir in composer_dirs:
         if not any(composer_dir.iterdir()):
@@ -168,15 +358,28 @@ def clean_empty_directories():
             logger.info(f"Removed empty directory: {composer_dir}")
 
 
-def make_windows():
+def make_windows(
+    windows_dir=TEMP_WINDOWS_DIR,
+    window_size=10,
+    overlap=5,
+    event_budget=None,
+    overlap_unit="measures",
+):
     """Main function to orchestrate the entire windowing process."""
     logger.info("Starting window processing pipeline")
-    ensure_directories_exist()
+    ensure_directories_exist(windows_dir)
 
     if not backup_parsed_files():
         logger.error("Backup failed, aborting window processing")
         return
 
-    process_windows()
+    process_windows(
+        PARSED_DIR,
+        windows_dir,
+        window_size,
+        overlap,
+        event_budget=event_budget,
+        overlap_unit=overlap_unit,
+    )
 
     logger.info("Window processing pipeline completed")
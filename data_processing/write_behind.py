@@ -0,0 +1,263 @@
+# Write-behind queue for the pipeline's output files.
+#
+# Ingest, windowing and normalizing all used to compute something, then block on
+# open/json.dump/np.save/unlink before computing the next thing, so on a network
+# share or a spinning disk the CPU mostly waited for writes. Now they hand their
+# writes to a WriteBehind and carry on:
+#
+#   - a few I/O threads serialize and write each file to a temp name next to it
+#   - at most MAX_PENDING_WRITES writes are queued; past that, the submitting stage
+#     blocks until the threads catch up (backpressure, so memory stays bounded)
+#   - durable writes are fsynced FSYNC_BATCH at a time, renamed into place, and then
+#     each directory they went into is fsynced once per batch instead of once per file
+#   - after(futures, fn) runs fn (e.g. deleting the input file) only once those writes
+#     are in place, and skips it if any of them failed, so an input is never deleted
+#     before its outputs exist
+#
+# Everything is flushed when the `with write_behind()` block ends (even on an
+# exception), and writers that are still open at interpreter exit are flushed by an
+# atexit hook. IO_THREADS = 0 does every write inline, like before.
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from pipeline_metrics import MetricsRegistry, get_registry
+
+logger = logging.getLogger(__name__)
+
+IO_THREADS = 2
+MAX_PENDING_WRITES = 64
+FSYNC_BATCH = 32
+
+_open_writers = weakref.WeakSet()
+
+
+def _fsync_dir(directory):
+    # makes the renames in it durable; directories can't be opened like this on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehind:
+    def __init__(
+        self, threads=IO_THREADS, max_pending=MAX_PENDING_WRITES, fsync_batch=FSYNC_BATCH
+    ):
+        self._pool = (
+            ThreadPoolExecutor(max_workers=threads, thread_name_prefix="write-behind")
+            if threads > 0
+            else None
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._fsync_batch = fsync_batch
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._commit_lock = threading.Lock()
+        self._in_flight = 0
+        self._unsynced = []  # (temp path, final path, future) of durable writes
+        self._waiting = []  # (futures, fn, description) for after()
+        self._made_dirs = set()
+        # the I/O threads record here (under the lock), it's merged into the
+        # pipeline's registry on close
+        self._metrics = MetricsRegistry()
+        self.closed = False
+        _open_writers.add(self)
+
+    def _observe(self, stage, seconds, file=None):
+        with self._lock:
+            self._metrics.observe(stage, seconds, file)
+
+    def _increment(self, name, value=1):
+        with self._lock:
+            self._metrics.increment(name, value)
+
+    def submit(self, path, write, durable=False, stage="write"):
+        """
+        Queue a file write. Blocks while MAX_PENDING_WRITES writes are already queued.
+
+        Args:
+            path: Where the file ends up
+            write: Function that writes the contents to the binary file object it's given
+            durable: fsync the file (and its directory) before it counts as done
+            stage: Metrics stage the write time is recorded under
+
+        Returns:
+            A Future that resolves to the path once the file is in place
+        """
+        if self.closed:
+            raise RuntimeError("WriteBehind is closed")
+        path = Path(path)
+        if not self._slots.acquire(blocking=False):
+            waited = time.perf_counter()
+            self._slots.acquire()
+            self._observe("write_backpressure", time.perf_counter() - waited)
+        future = Future()
+        with self._lock:
+            self._in_flight += 1
+        if self._pool is None:
+            self._run(path, write, durable, stage, future)
+        else:
+            self._pool.submit(self._run, path, write, durable, stage, future)
+        return future
+
+    def write_json(self, path, data, indent=None, durable=False, stage="json_dump"):
+        """Queue a JSON file. Don't change `data` afterwards, it's serialized later."""
+        return self.submit(
+            path,
+            lambda f: f.write(json.dumps(data, indent=indent).encode("utf-8")),
+            durable,
+            stage,
+        )
+
+    def save_npy(self, path, array, durable=False, stage="npy_save"):
+        """Queue a .npy file (like np.save, but never writes into an existing file)."""
+        import numpy as np
+
+        return self.submit(path, lambda f: np.save(f, array), durable, stage)
+
+    def _run(self, path, write, durable, stage, future):
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        commit = False
+        try:
+            if path.parent not in self._made_dirs:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._made_dirs.add(path.parent)
+            started = time.perf_counter()
+            with open(tmp_path, "wb") as f:
+                write(f)
+            self._observe(stage, time.perf_counter() - started, path)
+            if durable:
+                with self._lock:
+                    self._unsynced.append((tmp_path, path, future))
+                    commit = len(self._unsynced) >= self._fsync_batch
+            else:
+                os.replace(tmp_path, path)
+                future.set_result(path)
+        except Exception as e:
+            logger.error(f"Write-behind failed for {path}: {e}")
+            self._increment("writes_failed")
+            tmp_path.unlink(missing_ok=True)
+            future.set_exception(e)
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                self._idle.notify_all()
+        if commit:
+            self._commit()
+        self._run_waiting()
+
+    def _commit(self):
+        """fsync the waiting durable writes, rename them into place, fsync their dirs."""
+        with self._commit_lock:
+            with self._lock:
+                batch, self._unsynced = self._unsynced, []
+            if not batch:
+                return
+            started = time.perf_counter()
+            placed = []
+            for tmp_path, path, future in batch:
+                try:
+                    fd = os.open(tmp_path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    os.replace(tmp_path, path)
+                    placed.append((path, future))
+                except Exception as e:
+                    logger.error(f"Write-behind failed for {path}: {e}")
+                    self._increment("writes_failed")
+                    tmp_path.unlink(missing_ok=True)
+                    future.set_exception(e)
+            for directory in {path.parent for path, _ in placed}:
+                _fsync_dir(directory)
+            self._observe("fsync_batch", time.perf_counter() - started)
+            self._increment("fsynced_files", len(placed))
+            for path, future in placed:
+                future.set_result(path)
+
+    def after(self, futures, fn, description=None):
+        """
+        Call fn() once all the futures' writes are in place. If any of them failed it's
+        skipped (and logged), so e.g. an input file isn't deleted without its outputs.
+        fn may run on an I/O thread.
+        """
+        with self._lock:
+            self._waiting.append((list(futures), fn, description or repr(fn)))
+        self._run_waiting()
+
+    def _run_waiting(self):
+        ready = []
+        still_waiting = []
+        with self._lock:
+            for waiting in self._waiting:
+                done = all(f.done() for f in waiting[0])
+                (ready if done else still_waiting).append(waiting)
+            self._waiting = still_waiting
+        for futures, fn, description in ready:
+            if any(f.exception() is not None for f in futures):
+                logger.error(f"Skipped {description}, some of its writes failed")
+                self._increment("after_skipped")
+                continue
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Failed {description} after write-behind: {e}")
+                self._increment("after_failed")
+
+    def flush(self):
+        """Block until everything queued so far is written, in place, and followed up."""
+        with self._idle:
+            while self._in_flight:
+                self._idle.wait()
+        self._commit()
+        self._run_waiting()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        get_registry().merge(self._metrics.snapshot())
+        _open_writers.discard(self)
+
+
+@contextmanager
+def write_behind(writer=None, **kwargs):
+    """
+    A WriteBehind for the with block, flushed and closed at the end of it. If `writer`
+    is given it's used instead and left open (whoever made it closes it).
+    """
+    if writer is not None:
+        yield writer
+        return
+    writer = WriteBehind(**kwargs)
+    try:
+        yield writer
+    finally:
+        writer.close()
+
+
+@atexit.register
+def _flush_open_writers():
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception as e:
+            logger.error(f"Couldn't flush write-behind queue at exit: {e}")
@@ -0,0 +1,150 @@
+# Batch-level data augmentation for normalized windows.
+#
+# Instead of writing transposed copies of every score through the pipeline (twelve
+# times the disk), these run on whole batches right before they go into the model.
+# Every transform is a handful of tensor ops over the batch, so it costs
+# microseconds and needs no extra storage.
+#
+# Window columns (see normalize_window): measure, offset, part, pitch_idx, duration.
+# pitch_idx is midi - pitch_min + 1, and 0 (unknown_id) means rest/unknown pitch.
+# Padding rows are all zeros.
+
+import torch
+
+MEASURE_COL = 0
+OFFSET_COL = 1
+PART_COL = 2
+PITCH_COL = 3
+DURATION_COL = 4
+
+
+def event_mask(batch):
+    """True for real events, False for the all-zero padding rows at the end of a window."""
+    return (batch != 0).any(dim=-1)
+
+
+def transpose_batch(
+    batch, max_shift=6, pitch_min=21, pitch_max=108, unknown_id=0, generator=None
+):
+    """
+    Transpose every window in the batch by its own random number of semitones.
+
+    The shift of each window is clipped so its lowest and highest pitch stay inside
+    pitch_min..pitch_max, so nothing gets pushed into the unknown bucket. Rests and
+    unknown pitches (unknown_id) are left alone.
+    """
+    batch_size = batch.shape[0]
+    pitch = batch[:, :, PITCH_COL]
+    pitched = pitch != unknown_id
+    top_idx = pitch_max - pitch_min + 1
+
+    big = float(top_idx + 1)
+    lowest = torch.where(pitched, pitch, torch.full_like(pitch, big)).amin(dim=1)
+    highest = torch.where(pitched, pitch, torch.zeros_like(pitch)).amax(dim=1)
+    # windows with no pitches at all still draw a shift, it just has nothing to move
+    down_room = torch.clamp(lowest - 1, 0, max_shift)
+    up_room = torch.clamp(top_idx - highest, 0, max_shift)
+
+    u = torch.rand(batch_size, generator=generator, device=batch.device)
+    shift = torch.floor(u * (down_room + up_room + 1)) - down_room
+
+    out = batch.clone()
+    out[:, :, PITCH_COL] = torch.where(pitched, pitch + shift[:, None], pitch)
+    return out
+
+
+def scale_durations_batch(batch, factors=(0.5, 1.0, 2.0), generator=None):
+    """
+    Augment/diminish rhythm: multiply each window's durations and offsets by a
+    random factor. It's the same music written with different note values (like
+    3/4 rewritten in 3/2), there's no tempo involved. Padding rows stay zero.
+    """
+    factor_table = torch.tensor(factors, dtype=batch.dtype, device=batch.device)
+    choice = torch.randint(
+        len(factors), (batch.shape[0],), generator=generator, device=batch.device
+    )
+    scale = factor_table[choice][:, None]
+
+    out = batch.clone()
+    out[:, :, OFFSET_COL] = batch[:, :, OFFSET_COL] * scale
+    out[:, :, DURATION_COL] = batch[:, :, DURATION_COL] * scale
+    return out
+
+
+def permute_parts_batch(batch, generator=None):
+    """
+    Shuffle the part ids of each window among the parts it actually has, e.g. a
+    3-part window gets a random permutation of {0, 1, 2}.
+    """
+    batch_size = batch.shape[0]
+    mask = event_mask(batch)
+    part = batch[:, :, PART_COL].long()
+    n_parts = (torch.where(mask, part, torch.zeros_like(part)).amax(dim=1) + 1)
+    max_parts = int(n_parts.max().item()) if batch_size else 0
+    if max_parts <= 1:
+        return batch
+
+    ids = torch.arange(max_parts, device=batch.device).expand(batch_size, max_parts)
+    # random keys in [0, 1) for the parts a window has, keys >= 1 (in order) for the
+    # ones it doesn't, so argsort only shuffles the real parts
+    keys = torch.rand(batch_size, max_parts, generator=generator, device=batch.device)
+    keys = torch.where(ids < n_parts[:, None], keys, ids.to(keys.dtype) + 1.0)
+    new_id_of_old = torch.argsort(torch.argsort(keys, dim=1), dim=1)
+
+    remapped = torch.gather(new_id_of_old, 1, part.clamp(max=max_parts - 1))
+    out = batch.clone()
+    out[:, :, PART_COL] = torch.where(mask, remapped.to(batch.dtype), batch[:, :, PART_COL])
+    return out
+
+
+class BatchAugmenter:
+    """
+    Applies the enabled augmentations to a batch with probability p each.
+
+    Pass a seeded torch.Generator for reproducible runs.
+    """
+
+    def __init__(
+        self,
+        transpose=True,
+        scale_durations=True,
+        permute_parts=True,
+        max_shift=6,
+        duration_factors=(0.5, 1.0, 2.0),
+        pitch_min=21,
+        pitch_max=108,
+        unknown_id=0,
+        p=0.5,
+        generator=None,
+    ):
+        self.transpose = transpose
+        self.scale_durations = scale_durations
+        self.permute_parts = permute_parts
+        self.max_shift = max_shift
+        self.duration_factors = duration_factors
+        self.pitch_min = pitch_min
+        self.pitch_max = pitch_max
+        self.unknown_id = unknown_id
+        self.p = p
+        self.generator = generator
+
+    def _coin(self):
+        return torch.rand(1, generator=self.generator).item() < self.p
+
+    def __call__(self, batch):
+        if self.transpose and self._coin():
+            batch = transpose_batch(
+                batch,
+                max_shift=self.max_shift,
+                pitch_min=self.pitch_min,
+                pitch_max=self.pitch_max,
+                unknown_id=self.unknown_id,
+                generator=self.generator,
+            )
+        if self.scale_durations and self._coin():
+            batch = scale_durations_batch(
+                batch, factors=self.duration_factors, generator=self.generator
+            )
+        if self.permute_parts and self._coin():
+            batch = permute_parts_batch(batch, generator=self.generator)
+        return batch
@@ -0,0 +1,190 @@
+# Side-by-side comparison of the sequence encoders in model.ENCODERS.
+#
+# Trains every encoder with the same train_one_epoch/evaluate loop on the same
+# split_by_score split (same seed, same batches), then reports training and
+# inference throughput in windows/s, single-window latency and test accuracy. The
+# GRU has to walk the window one event after another; the dilated conv encoder
+# computes every event at once, which is where the difference in throughput comes
+# from.
+#
+# Example:
+#   python compare_encoders.py --epochs 10 --threads 4
+#   python compare_encoders.py --encoders gru conv --conv-layers 8
+
+import argparse
+import logging
+import statistics
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from model import (
+    ENCODERS,
+    NORMALIZED_WINDOWS_DIR,
+    WindowDataset,
+    build_classifier,
+    evaluate,
+    list_window_files,
+    load_duplicate_groups,
+    pad_collate,
+    split_by_score,
+    train_one_epoch,
+)
+from torch.utils.data import DataLoader
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIM = 5
+
+
+def inference_throughput(model, windows, batch_size):
+    """Windows per second of a no-grad forward pass over preloaded windows."""
+    model.eval()
+    started = time.perf_counter()
+    with torch.no_grad():
+        for start in range(0, len(windows), batch_size):
+            batch_x, _, lengths = pad_collate(windows[start : start + batch_size])
+            model(batch_x, lengths)
+    return len(windows) / max(time.perf_counter() - started, 1e-9)
+
+
+def single_window_latency(model, windows, runs):
+    """Median and worst milliseconds to classify one window (after one warm-up call)."""
+    model.eval()
+    timings = []
+    with torch.no_grad():
+        model(windows[0][0].unsqueeze(0))
+        for i in range(runs):
+            window = windows[i % len(windows)][0].unsqueeze(0)
+            started = time.perf_counter()
+            model(window)
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def compare_encoder(encoder, num_layers, splits, args):
+    train_samples, val_samples, test_samples = splits
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    model = build_classifier(encoder, FEATURE_DIM, args.hidden_size, num_layers)
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.BCEWithLogitsLoss()
+    device = torch.device("cpu")
+
+    train_loader = DataLoader(
+        WindowDataset(train_samples),
+        batch_size=args.batch_size,
+        shuffle=True,
+        collate_fn=pad_collate,
+        generator=torch.Generator().manual_seed(args.seed),
+    )
+    val_loader = DataLoader(
+        WindowDataset(val_samples),
+        batch_size=args.batch_size,
+        shuffle=False,
+        collate_fn=pad_collate,
+    )
+    train_seconds = 0.0
+    trained = 0
+    for epoch in range(1, args.epochs + 1):
+        started = time.perf_counter()
+        train_loss, seen = train_one_epoch(
+            model, train_loader, criterion, optimizer, device
+        )
+        train_seconds += time.perf_counter() - started
+        trained += seen
+        val_loss, correct, total = evaluate(model, val_loader, criterion, device)
+        print(
+            f"  {encoder} epoch {epoch}/{args.epochs}: "
+            f"train loss {train_loss / max(seen, 1):.4f}, "
+            f"val loss {val_loss / max(total, 1):.4f}, "
+            f"val acc {correct / max(total, 1):.4f}"
+        )
+
+    test_loader = DataLoader(
+        WindowDataset(test_samples),
+        batch_size=args.batch_size,
+        shuffle=False,
+        collate_fn=pad_collate,
+    )
+    _, correct, total = evaluate(model, test_loader, criterion, device)
+
+    # throughput and latency on windows already in memory, so only the model is timed
+    # (on the test windows, or whatever split isn't empty on a tiny corpus)
+    eval_dataset = WindowDataset(test_samples or val_samples or train_samples)
+    eval_windows = [eval_dataset[i] for i in range(len(eval_dataset))]
+    latency_p50, latency_max = single_window_latency(model, eval_windows, args.latency_runs)
+    return {
+        "encoder": encoder,
+        "parameters": sum(p.numel() for p in model.parameters()),
+        "train_windows_per_s": trained / max(train_seconds, 1e-9),
+        "infer_windows_per_s": inference_throughput(model, eval_windows, args.batch_size),
+        "latency_ms": latency_p50,
+        "latency_max_ms": latency_max,
+        "test_acc": correct / total if total else None,
+        "test_windows": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the GRU and parallel encoders")
+    parser.add_argument("--windows-dir", type=Path, default=NORMALIZED_WINDOWS_DIR)
+    parser.add_argument("--composers", nargs=2, default=["Leah", "Mozart"])
+    parser.add_argument("--score-db", type=Path, default=Path("score_database.db"))
+    parser.add_argument(
+        "--encoders", nargs="+", choices=sorted(ENCODERS), default=["gru", "conv"]
+    )
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--hidden-size", type=int, default=64)
+    parser.add_argument("--gru-layers", type=int, default=2)
+    parser.add_argument("--conv-layers", type=int, default=6)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--latency-runs", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    samples = list_window_files(args.windows_dir, args.composers)
+    splits = split_by_score(
+        samples,
+        args.val_fraction,
+        args.test_fraction,
+        seed=args.seed,
+        groups=load_duplicate_groups(args.score_db),
+    )
+    print(
+        f"{len(splits[0])} train, {len(splits[1])} val, {len(splits[2])} test windows, "
+        f"{args.threads} threads"
+    )
+    if not splits[0]:
+        print("No training windows")
+        return
+
+    layers = {"gru": args.gru_layers, "conv": args.conv_layers}
+    results = [
+        compare_encoder(encoder, layers.get(encoder), splits, args)
+        for encoder in args.encoders
+    ]
+
+    print(
+        f"{'encoder':<8} {'params':>8} {'train win/s':>12} {'infer win/s':>12} "
+        f"{'latency ms':>11} {'max ms':>8} {'test acc':>9}"
+    )
+    for result in results:
+        test_acc = "n/a" if result["test_acc"] is None else f"{result['test_acc']:.3f}"
+        print(
+            f"{result['encoder']:<8} {result['parameters']:>8} "
+            f"{result['train_windows_per_s']:>12.1f} {result['infer_windows_per_s']:>12.1f} "
+            f"{result['latency_ms']:>11.2f} {result['latency_max_ms']:>8.2f} {test_acc:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
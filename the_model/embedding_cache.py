@@ -0,0 +1,241 @@
+# Cache of window embeddings and logits, so evaluating a checkpoint again is a lookup.
+#
+# Evaluating, aggregating per-score predictions or comparing windows by similarity
+# all used to run the GRU over every window again, even when neither the model nor
+# the windows had changed. EmbeddingCache stores the embedding (the model's encode(),
+# h_n[-1] for the GRU) and the logit of every window it has seen, keyed by a hash of
+# the window array, under a directory named after a hash of the model weights:
+#
+#   embedding_cache/<model hash>/index.json      {window hash: [segment, row]}
+#   embedding_cache/<model hash>/emb_00000.npy   embeddings, memory-mapped on read
+#   embedding_cache/<model hash>/logits_00000.npy
+#
+# New windows are appended as a new segment, so nothing is rewritten. A different
+# checkpoint (anything that changes the weights) gets a different directory, so old
+# embeddings are never served for it, and only the KEEP_MODELS most recently used
+# model directories are kept.
+#
+# Example:
+#   python embedding_cache.py --checkpoint checkpoints/gru.pt --cache-dir embedding_cache
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from model import (
+    NORMALIZED_WINDOWS_DIR,
+    build_classifier,
+    list_window_files,
+    pad_collate,
+)
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIM = 5
+KEEP_MODELS = 2  # model directories kept; older ones are deleted when a new one is opened
+INDEX_FILE = "index.json"
+
+
+def model_hash(model):
+    """Hash of the model's weights (names, shapes and values), so it changes with the checkpoint."""
+    digest = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict().items()):
+        array = tensor.detach().cpu().contiguous().numpy()
+        digest.update(f"{name}:{array.dtype}:{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:32]
+
+
+def window_hash(window):
+    """Hash of a normalized window's values (as float32) and shape."""
+    window = np.ascontiguousarray(window, dtype=np.float32)
+    digest = hashlib.blake2b(str(window.shape).encode("utf-8"), digest_size=16)
+    digest.update(window.tobytes())
+    return digest.hexdigest()
+
+
+def load_checkpoint_model(path, map_location="cpu"):
+    """The classifier with the weights from a train_distributed.py checkpoint."""
+    checkpoint = torch.load(path, map_location=map_location)
+    model = build_classifier(
+        # checkpoints from before the encoder option are all GRUs
+        checkpoint.get("encoder", "gru"),
+        input_size=FEATURE_DIM,
+        hidden_size=checkpoint["hidden_size"],
+        num_layers=checkpoint["num_layers"],
+    )
+    model.load_state_dict(checkpoint["model_state"])
+    return model
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model, keep_models=KEEP_MODELS):
+        self.model_hash = model_hash(model)
+        self.root = Path(cache_dir)
+        self.dir = self.root / self.model_hash
+        self.dir.mkdir(parents=True, exist_ok=True)
+        index_path = self.dir / INDEX_FILE
+        if index_path.exists():
+            with open(index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+        self._segments = {}
+        # the directory's mtime marks when the model was last used
+        os.utime(self.dir)
+        self._prune(keep_models)
+
+    def _prune(self, keep_models):
+        model_dirs = sorted(
+            (d for d in self.root.iterdir() if d.is_dir() and d != self.dir),
+            key=lambda d: d.stat().st_mtime,
+            reverse=True,
+        )
+        for old_dir in model_dirs[max(keep_models - 1, 0) :]:
+            logger.info(f"Removing embeddings of an older model: {old_dir}")
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def _segment(self, segment):
+        if segment not in self._segments:
+            self._segments[segment] = (
+                np.load(self.dir / f"emb_{segment:05d}.npy", mmap_mode="r"),
+                np.load(self.dir / f"logits_{segment:05d}.npy", mmap_mode="r"),
+            )
+        return self._segments[segment]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        """(embedding, logit) of a window hash, or None if it isn't cached."""
+        location = self.index.get(key)
+        if location is None:
+            return None
+        embeddings, logits = self._segment(location[0])
+        return np.array(embeddings[location[1]]), float(logits[location[1]])
+
+    def add(self, keys, embeddings, logits):
+        """Store a batch of window hashes with their embeddings and logits as a new segment."""
+        keys = list(keys)
+        if not keys:
+            return
+        segment = max((location[0] for location in self.index.values()), default=-1) + 1
+        for name, array in (
+            ("emb", np.asarray(embeddings, dtype=np.float32)),
+            ("logits", np.asarray(logits, dtype=np.float32)),
+        ):
+            path = self.dir / f"{name}_{segment:05d}.npy"
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        for row, key in enumerate(keys):
+            self.index[key] = [segment, row]
+        # the index goes last, so a crash can only leave an unused segment behind
+        tmp_path = self.dir / f".{INDEX_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.dir / INDEX_FILE)
+
+
+def cached_embeddings(model, windows, cache, batch_size=64, device="cpu"):
+    """
+    Embeddings and logits of a list of window arrays, running the model only on the
+    windows that aren't in the cache yet (and adding those).
+
+    Returns:
+        (embeddings [n, hidden_size], logits [n], number of cache hits)
+    """
+    keys = [window_hash(window) for window in windows]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    model.eval()
+    model.to(device)
+    new_keys, new_embeddings, new_logits = [], [], []
+    with torch.no_grad():
+        for start in range(0, len(missing), batch_size):
+            batch_indices = missing[start : start + batch_size]
+            batch = [
+                (torch.from_numpy(np.asarray(windows[i], dtype=np.float32)), torch.tensor(0.0))
+                for i in batch_indices
+            ]
+            batch_x, _, lengths = pad_collate(batch)
+            embeddings = model.encode(batch_x.to(device), lengths)
+            logits = model.classify(embeddings)
+            for j, i in enumerate(batch_indices):
+                results[i] = (embeddings[j].cpu().numpy(), float(logits[j]))
+            new_keys.extend(keys[i] for i in batch_indices)
+            new_embeddings.append(embeddings.cpu().numpy())
+            new_logits.append(logits.cpu().numpy())
+    if new_keys:
+        # one segment per call, not per batch
+        cache.add(new_keys, np.concatenate(new_embeddings), np.concatenate(new_logits))
+
+    embeddings = np.stack([embedding for embedding, _ in results]) if results else None
+    logits = np.array([logit for _, logit in results], dtype=np.float32)
+    return embeddings, logits, len(keys) - len(missing)
+
+
+def score_predictions(samples, logits):
+    """
+    Average the window probabilities of each score.
+
+    Returns:
+        {score_id: (mean probability of label 1, label)}
+    """
+    probabilities = 1 / (1 + np.exp(-np.asarray(logits, dtype=np.float64)))
+    by_score = {}
+    for (_, label, score_id), probability in zip(samples, probabilities):
+        by_score.setdefault(score_id, (label, []))[1].append(probability)
+    return {
+        score_id: (float(np.mean(values)), label)
+        for score_id, (label, values) in by_score.items()
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Evaluate a checkpoint through the embedding cache"
+    )
+    parser.add_argument("--checkpoint", type=Path, required=True)
+    parser.add_argument("--windows-dir", type=Path, default=NORMALIZED_WINDOWS_DIR)
+    parser.add_argument("--composers", nargs=2, default=["Leah", "Mozart"])
+    parser.add_argument("--cache-dir", type=Path, default=Path("embedding_cache"))
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    model = load_checkpoint_model(args.checkpoint)
+    cache = EmbeddingCache(args.cache_dir, model)
+    samples = list_window_files(args.windows_dir, args.composers)
+    started = time.perf_counter()
+    windows = [np.load(path) for path, _, _ in samples]
+    embeddings, logits, hits = cached_embeddings(model, windows, cache, args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    labels = np.array([label for _, label, _ in samples])
+    window_accuracy = float(np.mean((logits >= 0) == labels)) if len(labels) else 0.0
+    scores = score_predictions(samples, logits)
+    score_accuracy = (
+        float(np.mean([(p >= 0.5) == label for p, label in scores.values()]))
+        if scores
+        else 0.0
+    )
+    print(
+        f"{len(samples)} windows ({hits} cached) in {elapsed:.2f} s, model {cache.model_hash}"
+    )
+    print(
+        f"Window accuracy: {window_accuracy:.3f}, "
+        f"score accuracy: {score_accuracy:.3f} ({len(scores)} scores)"
+    )
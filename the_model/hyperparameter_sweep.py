@@ -0,0 +1,355 @@
+# Hyperparameter sweep for the sequence classifiers.
+#
+# Runs many classifier configurations (any encoder in model.ENCODERS, the GRU by
+# default) at the same time in a process pool. Every
+# worker process is pinned to its own slice of cores, all trials read the same
+# memory-mapped copy of the windows (built once by build_window_cache), and a trial
+# is pruned as soon as its validation loss falls behind the median of the other
+# trials at the same epoch. Every epoch and every finished trial is written to
+# sweep_results.db, next to score_database.db.
+#
+# Example:
+#   python hyperparameter_sweep.py --hidden-sizes 32 64 128 --num-layers 1 2 3 \
+#       --lrs 1e-3 3e-4 --epochs 20 --cores-per-trial 2
+#   python hyperparameter_sweep.py --encoders gru conv --num-layers 2 6 --hidden-sizes 64
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from augmentation import BatchAugmenter
+from model import (
+    ENCODERS,
+    NORMALIZED_WINDOWS_DIR,
+    MemmapWindowDataset,
+    build_classifier,
+    build_window_cache,
+    evaluate,
+    list_window_files,
+    load_duplicate_groups,
+    pad_collate,
+    split_by_score,
+    train_one_epoch,
+)
+from torch.utils.data import DataLoader
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIM = 5
+SQLITE_TIMEOUT = 60  # seconds; lots of trials write to the same file
+
+
+def connect_results_db(results_db):
+    conn = sqlite3.connect(results_db, timeout=SQLITE_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def setup_results_db(results_db):
+    conn = connect_results_db(results_db)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sweep_trials (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sweep_id TEXT NOT NULL,
+        trial_index INTEGER NOT NULL,
+        encoder TEXT NOT NULL DEFAULT 'gru',
+        hidden_size INTEGER NOT NULL,
+        num_layers INTEGER NOT NULL,
+        lr REAL NOT NULL,
+        batch_size INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        epochs_run INTEGER,
+        best_val_loss REAL,
+        best_val_acc REAL,
+        duration_seconds REAL,
+        cores TEXT,
+        date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # results databases from before the encoder column only have GRU trials
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sweep_trials)")}
+    if "encoder" not in columns:
+        conn.execute(
+            "ALTER TABLE sweep_trials ADD COLUMN encoder TEXT NOT NULL DEFAULT 'gru'"
+        )
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sweep_epochs (
+        sweep_id TEXT NOT NULL,
+        trial_index INTEGER NOT NULL,
+        epoch INTEGER NOT NULL,
+        train_loss REAL,
+        val_loss REAL,
+        val_acc REAL,
+        PRIMARY KEY (sweep_id, trial_index, epoch)
+    )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def should_prune(conn, sweep_id, trial_index, epoch, val_loss, warmup_epochs, min_trials):
+    """
+    Median stopping rule: stop a trial whose validation loss at this epoch is worse
+    than the median of what the other trials had at the same epoch.
+    """
+    if epoch < warmup_epochs:
+        return False
+    rows = conn.execute(
+        "SELECT val_loss FROM sweep_epochs WHERE sweep_id = ? AND epoch = ? AND trial_index != ?",
+        (sweep_id, epoch, trial_index),
+    ).fetchall()
+    if len(rows) < min_trials:
+        return False
+    return val_loss > statistics.median(row[0] for row in rows)
+
+
+_worker_cores = None
+
+
+def pin_worker(core_slices):
+    """Pool initializer: grab a free core slice and keep this process on it."""
+    global _worker_cores
+    _worker_cores = core_slices.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, _worker_cores)
+    torch.set_num_threads(len(_worker_cores))
+
+
+def run_trial(trial_index, config, sweep_config):
+    """Train one configuration and return its summary row."""
+    started = time.perf_counter()
+    torch.manual_seed(sweep_config["seed"] + trial_index)
+    np.random.seed(sweep_config["seed"] + trial_index)
+
+    cache_dir = sweep_config["cache_dir"]
+    train_loader = DataLoader(
+        MemmapWindowDataset(cache_dir, sweep_config["train_indices"]),
+        batch_size=config["batch_size"],
+        shuffle=True,
+        collate_fn=pad_collate,
+    )
+    val_loader = DataLoader(
+        MemmapWindowDataset(cache_dir, sweep_config["val_indices"]),
+        batch_size=config["batch_size"],
+        shuffle=False,
+        collate_fn=pad_collate,
+    )
+
+    model = build_classifier(
+        config["encoder"],
+        input_size=FEATURE_DIM,
+        hidden_size=config["hidden_size"],
+        num_layers=config["num_layers"],
+    )
+    optimizer = optim.Adam(model.parameters(), lr=config["lr"])
+    criterion = nn.BCEWithLogitsLoss()
+    device = torch.device("cpu")
+    augment = None
+    if sweep_config["augment"]:
+        augment = BatchAugmenter(
+            generator=torch.Generator().manual_seed(sweep_config["seed"] + trial_index)
+        )
+
+    conn = connect_results_db(sweep_config["results_db"])
+    sweep_id = sweep_config["sweep_id"]
+    best_val_loss = float("inf")
+    best_val_acc = 0.0
+    status = "completed"
+    epochs_run = 0
+
+    for epoch in range(1, sweep_config["epochs"] + 1):
+        train_loss, seen = train_one_epoch(
+            model, train_loader, criterion, optimizer, device, augment=augment
+        )
+        val_loss, correct, total = evaluate(model, val_loader, criterion, device)
+        train_loss /= max(seen, 1)
+        val_loss /= max(total, 1)
+        val_acc = correct / max(total, 1)
+        epochs_run = epoch
+
+        conn.execute(
+            "INSERT OR REPLACE INTO sweep_epochs (sweep_id, trial_index, epoch, train_loss, val_loss, val_acc) VALUES (?, ?, ?, ?, ?, ?)",
+            (sweep_id, trial_index, epoch, train_loss, val_loss, val_acc),
+        )
+        conn.commit()
+
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            best_val_acc = val_acc
+
+        if should_prune(
+            conn,
+            sweep_id,
+            trial_index,
+            epoch,
+            val_loss,
+            sweep_config["warmup_epochs"],
+            sweep_config["min_trials_for_pruning"],
+        ):
+            status = "pruned"
+            break
+
+    conn.close()
+    return {
+        "trial_index": trial_index,
+        **config,
+        "status": status,
+        "epochs_run": epochs_run,
+        "best_val_loss": best_val_loss,
+        "best_val_acc": best_val_acc,
+        "duration_seconds": time.perf_counter() - started,
+        "cores": ",".join(str(c) for c in sorted(_worker_cores or [])),
+    }
+
+
+def record_trial(results_db, sweep_id, result):
+    conn = connect_results_db(results_db)
+    conn.execute(
+        "INSERT INTO sweep_trials (sweep_id, trial_index, encoder, hidden_size, num_layers, lr, batch_size, status, epochs_run, best_val_loss, best_val_acc, duration_seconds, cores) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            sweep_id,
+            result["trial_index"],
+            result["encoder"],
+            result["hidden_size"],
+            result["num_layers"],
+            result["lr"],
+            result["batch_size"],
+            result["status"],
+            result["epochs_run"],
+            result["best_val_loss"],
+            result["best_val_acc"],
+            result["duration_seconds"],
+            result["cores"],
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def make_core_slices(cores_per_trial):
+    available = (
+        sorted(os.sched_getaffinity(0))
+        if hasattr(os, "sched_getaffinity")
+        else list(range(os.cpu_count() or 1))
+    )
+    cores_per_trial = max(1, min(cores_per_trial, len(available)))
+    return [
+        set(available[i : i + cores_per_trial])
+        for i in range(0, len(available) - cores_per_trial + 1, cores_per_trial)
+    ]
+
+
+def run_sweep(args):
+    results_db = Path(args.score_db).resolve().parent / "sweep_results.db"
+    setup_results_db(results_db)
+    sweep_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+    samples = list_window_files(args.windows_dir, args.composers)
+    train_samples, val_samples, _ = split_by_score(
+        samples,
+        args.val_fraction,
+        args.test_fraction,
+        seed=args.seed,
+        groups=load_duplicate_groups(args.score_db),
+    )
+    # one cache with train first and val after it, shared by every trial
+    build_window_cache(train_samples + val_samples, args.cache_dir)
+
+    configs = [
+        {"encoder": e, "hidden_size": h, "num_layers": n, "lr": lr, "batch_size": b}
+        for e, h, n, lr, b in itertools.product(
+            args.encoders, args.hidden_sizes, args.num_layers, args.lrs, args.batch_sizes
+        )
+    ]
+    sweep_config = {
+        "sweep_id": sweep_id,
+        "results_db": str(results_db),
+        "cache_dir": str(args.cache_dir),
+        "train_indices": list(range(len(train_samples))),
+        "val_indices": list(
+            range(len(train_samples), len(train_samples) + len(val_samples))
+        ),
+        "epochs": args.epochs,
+        "warmup_epochs": args.warmup_epochs,
+        "min_trials_for_pruning": args.min_trials_for_pruning,
+        "seed": args.seed,
+        "augment": args.augment,
+    }
+
+    core_slices = make_core_slices(args.cores_per_trial)
+    manager = multiprocessing.Manager()
+    slice_queue = manager.Queue()
+    for core_slice in core_slices:
+        slice_queue.put(core_slice)
+
+    print(
+        f"Sweep {sweep_id}: {len(configs)} trials, {len(core_slices)} at a time "
+        f"with {args.cores_per_trial} core(s) each"
+    )
+
+    with ProcessPoolExecutor(
+        max_workers=len(core_slices),
+        initializer=pin_worker,
+        initargs=(slice_queue,),
+    ) as executor:
+        futures = {
+            executor.submit(run_trial, i, config, sweep_config): i
+            for i, config in enumerate(configs)
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f"Trial {futures[future]} failed: {e}")
+                print(f"Trial {futures[future]} failed: {e}")
+                continue
+            record_trial(results_db, sweep_id, result)
+            print(
+                f"Trial {result['trial_index']} ({result['encoder']}) {result['status']} after "
+                f"{result['epochs_run']} epochs: best val loss {result['best_val_loss']:.4f}, "
+                f"val acc {result['best_val_acc']:.4f}"
+            )
+
+    print(f"Results written to {results_db} (sweep_id = {sweep_id})")
+    return sweep_id
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parallel classifier hyperparameter sweep")
+    parser.add_argument("--windows-dir", type=Path, default=NORMALIZED_WINDOWS_DIR)
+    parser.add_argument("--composers", nargs=2, default=["Leah", "Mozart"])
+    parser.add_argument("--score-db", type=Path, default=Path("score_database.db"))
+    parser.add_argument("--cache-dir", type=Path, default=Path("sweep_cache"))
+    parser.add_argument(
+        "--encoders", nargs="+", choices=sorted(ENCODERS), default=["gru"]
+    )
+    parser.add_argument("--hidden-sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--num-layers", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--lrs", type=float, nargs="+", default=[1e-3, 3e-4])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32])
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--warmup-epochs", type=int, default=2)
+    parser.add_argument("--min-trials-for-pruning", type=int, default=3)
+    parser.add_argument("--cores-per-trial", type=int, default=1)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--augment", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run_sweep(parse_args())
@@ -0,0 +1,396 @@
+# The GRU composer classifier from the_model.ipynb, pulled out into a module so the
+# training scripts can import it instead of copy-pasting notebook cells around.
+
+import abc
+import hashlib
+import logging
+import re
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence
+from torch.utils.data import Dataset
+
+logger = logging.getLogger(__name__)
+
+# Define the directory but change it to yours!
+NORMALIZED_WINDOWS_DIR = Path(
+    "/home/leahm/MusicXML/NeurAllegro/musicxml_files/normalized_windows"
+)
+
+# window files are named like "Mozart0_3.npy" -> composer "Mozart", score 0, window 3
+WINDOW_NAME_PATTERN = re.compile(r"^(?P<composer>.+?)(?P<index>\d+)_(?P<window>\d+)$")
+
+
+class SequenceClassifier(nn.Module, abc.ABC):
+    """
+    Encoder + linear head. Subclasses pass their embedding size to __init__ and
+    implement encode(), which turns a batch of windows [batch, events, features] into
+    one embedding per window; train_one_epoch, evaluate and the embedding cache only
+    use this interface. A subclass without encode() can't be instantiated.
+    """
+
+    def __init__(self, encoder_dim):
+        super(SequenceClassifier, self).__init__()
+        self.fc = nn.Linear(encoder_dim, 1)  # 1 logit for binary classification
+
+    @abc.abstractmethod
+    def encode(self, x, lengths=None):
+        """[batch, events, features] (+ real lengths) -> [batch, encoder_dim]."""
+
+    def classify(self, embeddings):
+        """Logits from embeddings returned by encode."""
+        return self.fc(embeddings).squeeze(dim=1)
+
+    def forward(self, x, lengths=None):
+        return self.classify(self.encode(x, lengths))
+
+
+class GRUClassifier(SequenceClassifier):
+    def __init__(self, input_size, hidden_size=64, num_layers=2):
+        super(GRUClassifier, self).__init__(hidden_size)
+
+        self.gru = nn.GRU(
+            input_size=input_size,
+            hidden_size=hidden_size,
+            num_layers=num_layers,
+            batch_first=True,
+        )
+
+    def encode(self, x, lengths=None):
+        """The window embedding: the last layer's final hidden state, [batch, hidden_size]."""
+        # lengths (from pad_collate) skips each window's padding rows, so windows
+        # cut by event budget only cost as many steps as they have events
+        if lengths is not None:
+            x = pack_padded_sequence(
+                x, lengths.cpu(), batch_first=True, enforce_sorted=False
+            )
+        out, h_n = self.gru(x)
+        return h_n[-1]
+
+
+class DilatedConvClassifier(SequenceClassifier):
+    """
+    Parallel-in-time alternative to the GRU: a stack of residual 1D convolutions whose
+    dilation doubles every layer, so num_layers layers see 2**(num_layers + 1) - 1
+    events around each position, then a mean over the window's real events. Every
+    step of the window is computed at once instead of one after another.
+    """
+
+    def __init__(self, input_size, hidden_size=64, num_layers=6, kernel_size=3):
+        super(DilatedConvClassifier, self).__init__(hidden_size)
+        self.input_proj = nn.Conv1d(input_size, hidden_size, kernel_size=1)
+        self.convs = nn.ModuleList(
+            nn.Conv1d(
+                hidden_size,
+                hidden_size,
+                kernel_size=kernel_size,
+                dilation=2**i,
+                padding=(kernel_size - 1) // 2 * 2**i,
+            )
+            for i in range(num_layers)
+        )
+
+    def encode(self, x, lengths=None):
+        """Mean of the last layer's features over each window's events, [batch, hidden_size]."""
+        if lengths is not None:
+            steps = torch.arange(x.size(1), device=x.device)
+            mask = steps[None, :] < lengths.to(x.device)[:, None]
+        else:
+            # padded windows end in all-zero rows
+            mask = (x != 0).any(dim=-1)
+        mask = mask.unsqueeze(1).float()  # [batch, 1, events]
+
+        # tanh because the raw features (measure numbers, pitch indices) aren't scaled
+        h = torch.tanh(self.input_proj(x.transpose(1, 2))) * mask
+        for conv in self.convs:
+            # masked again so the padding doesn't leak into the real events' neighbours
+            h = (h + torch.relu(conv(h))) * mask
+        return h.sum(dim=2) / mask.sum(dim=2).clamp(min=1)
+
+
+# encoder name -> classifier class, for --encoder and checkpoints
+ENCODERS = {"gru": GRUClassifier, "conv": DilatedConvClassifier}
+
+
+def build_classifier(encoder, input_size, hidden_size=64, num_layers=None):
+    """A classifier with the named encoder (num_layers=None uses that encoder's default)."""
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown encoder {encoder!r}, expected one of {sorted(ENCODERS)}")
+    kwargs = {"hidden_size": hidden_size}
+    if num_layers is not None:
+        kwargs["num_layers"] = num_layers
+    return ENCODERS[encoder](input_size, **kwargs)
+
+
+def list_window_files(windows_dir=NORMALIZED_WINDOWS_DIR, composers=("Leah", "Mozart")):
+    """
+    Collect the normalized window files for the given composers.
+
+    The label of each window is the position of its composer in `composers`, so
+    ("Leah", "Mozart") gives Leah = 0 and Mozart = 1 like the notebook did.
+
+    Returns:
+        A sorted list of (path, label, score_id) tuples, where score_id is e.g. "Mozart0"
+    """
+    composer_labels = {name: label for label, name in enumerate(composers)}
+    samples = []
+    for npy_file in sorted(Path(windows_dir).glob("*.npy")):
+        match = WINDOW_NAME_PATTERN.match(npy_file.stem)
+        if match is None:
+            logger.warning(f"Skipping window with unexpected name: {npy_file.name}")
+            continue
+        composer = match.group("composer")
+        if composer not in composer_labels:
+            continue
+        score_id = f"{composer}{match.group('index')}"
+        samples.append((npy_file, composer_labels[composer], score_id))
+    return samples
+
+
+def load_duplicate_groups(db_path="score_database.db"):
+    """
+    Map the score ids of flagged near-duplicates (see data_processing/deduplicator.py)
+    to the score id of the first copy, so split_by_score keeps them together.
+
+    Returns:
+        {score_id: group score_id}, e.g. {"Mozart12": "Mozart3"}
+    """
+    if not Path(db_path).exists():
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+        SELECT dup.new_title, orig.new_title
+        FROM score_duplicates d
+        JOIN master_score_list dup ON dup.id = d.score_id
+        JOIN master_score_list orig ON orig.id = d.duplicate_of
+        WHERE dup.new_title IS NOT NULL AND orig.new_title IS NOT NULL
+        """).fetchall()
+    except sqlite3.OperationalError:
+        # no dedup tables yet
+        rows = []
+    finally:
+        conn.close()
+
+    parent = {Path(dup).stem: Path(orig).stem for dup, orig in rows}
+    groups = {}
+    for score_id in parent:
+        root = score_id
+        seen = set()
+        while root in parent and root not in seen:
+            seen.add(root)
+            root = parent[root]
+        groups[score_id] = root
+    return groups
+
+
+def split_by_score(samples, val_fraction=0.1, test_fraction=0.1, seed=0, groups=None):
+    """
+    Split window samples into train/val/test by score, not by window.
+
+    The windows overlap by 5 measures, so splitting windows at random would put
+    almost the same data in train and test. Hashing the score id keeps every
+    window of a score in the same split, and the split doesn't change between runs.
+    Pass groups (from load_duplicate_groups) to also keep duplicate scores together.
+    """
+    groups = groups or {}
+    train, val, test = [], [], []
+    for sample in samples:
+        score_id = groups.get(sample[2], sample[2])
+        digest = hashlib.sha1(f"{seed}:{score_id}".encode("utf-8")).hexdigest()
+        bucket = int(digest[:8], 16) / 0xFFFFFFFF
+        if bucket < test_fraction:
+            test.append(sample)
+        elif bucket < test_fraction + val_fraction:
+            val.append(sample)
+        else:
+            train.append(sample)
+    return train, val, test
+
+
+class WindowDataset(Dataset):
+    """Loads one normalized window per item, so a process only reads the files it's handed."""
+
+    def __init__(self, samples):
+        self.samples = list(samples)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        path, label, _ = self.samples[idx]
+        window = np.load(path)
+        return (
+            torch.from_numpy(window.astype(np.float32, copy=False)),
+            torch.tensor(float(label), dtype=torch.float32),
+        )
+
+
+def pad_collate(batch):
+    """
+    DataLoader collate_fn for windows that aren't all the same length (normalized
+    with pad=False). Pads the batch with zero rows up to its longest window.
+
+    Returns:
+        (windows, labels, lengths), where lengths is None if every window was already
+        the same length, so padded datasets run exactly like before
+    """
+    windows = [window for window, _ in batch]
+    labels = torch.stack([label for _, label in batch])
+    lengths = torch.tensor([len(window) for window in windows], dtype=torch.int64)
+    if bool((lengths == lengths[0]).all()):
+        return torch.stack(windows), labels, None
+    padded = torch.zeros((len(windows), int(lengths.max())) + windows[0].shape[1:])
+    for i, window in enumerate(windows):
+        padded[i, : len(window)] = window
+    return padded, labels, lengths
+
+
+def _unpack_batch(batch):
+    # (x, y) from the default collate, (x, y, lengths) from pad_collate
+    if len(batch) == 3:
+        return batch
+    batch_x, batch_y = batch
+    return batch_x, batch_y, None
+
+
+def build_window_cache(samples, cache_dir):
+    """
+    Stack a list of window samples into one .npy file that can be memory-mapped.
+
+    Loading thousands of small .npy files in every process is slow and keeps a copy
+    per process, so for sweeps we write them once into cache_dir/windows.npy (plus
+    labels.npy) and every process maps the same pages from the OS page cache.
+    Unpadded windows of different lengths are concatenated instead, with
+    cache_dir/offsets.npy marking where each one starts.
+
+    Returns:
+        The cache directory
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    windows_path = cache_dir / "windows.npy"
+    labels_path = cache_dir / "labels.npy"
+    offsets_path = cache_dir / "offsets.npy"
+    if not samples:
+        raise ValueError("No window samples to cache")
+
+    # mmap_mode only reads the headers
+    shapes = [np.load(path, mmap_mode="r").shape for path, _, _ in samples]
+    ragged = len(set(shapes)) > 1
+    if ragged:
+        offsets = np.zeros(len(samples) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([shape[0] for shape in shapes])
+        shape = (int(offsets[-1]),) + shapes[0][1:]
+    else:
+        shape = (len(samples),) + shapes[0]
+    windows = np.lib.format.open_memmap(
+        windows_path, mode="w+", dtype=np.float32, shape=shape
+    )
+    for i, (path, _, _) in enumerate(samples):
+        if ragged:
+            windows[offsets[i] : offsets[i + 1]] = np.load(path)
+        else:
+            windows[i] = np.load(path)
+    windows.flush()
+    del windows
+    if ragged:
+        np.save(offsets_path, offsets)
+    elif offsets_path.exists():
+        offsets_path.unlink()
+
+    np.save(labels_path, np.array([label for _, label, _ in samples], dtype=np.float32))
+    logger.info(f"Cached {len(samples)} windows to {windows_path}")
+    return cache_dir
+
+
+class MemmapWindowDataset(Dataset):
+    """Windows read from a cache written by build_window_cache, shared read-only between processes."""
+
+    def __init__(self, cache_dir, indices=None):
+        cache_dir = Path(cache_dir)
+        self.windows = np.load(cache_dir / "windows.npy", mmap_mode="r")
+        self.labels = np.load(cache_dir / "labels.npy")
+        offsets_path = cache_dir / "offsets.npy"
+        self.offsets = np.load(offsets_path) if offsets_path.exists() else None
+        self.indices = (
+            np.arange(len(self.labels)) if indices is None else np.asarray(indices)
+        )
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        row = self.indices[idx]
+        if self.offsets is not None:
+            window = self.windows[self.offsets[row] : self.offsets[row + 1]]
+        else:
+            window = self.windows[row]
+        return (
+            torch.from_numpy(np.array(window, dtype=np.float32)),
+            torch.tensor(self.labels[row], dtype=torch.float32),
+        )
+
+
+def train_one_epoch(model, loader, criterion, optimizer, device, augment=None):
+    """
+    Run one training epoch (same loop as the notebook).
+
+    augment is an optional callable applied to each batch before it's moved to the
+    device, like augmentation.BatchAugmenter.
+
+    Returns:
+        (summed loss over samples, number of samples) so callers can average
+        across processes before dividing
+    """
+    model.train()
+    running_loss = 0.0
+    seen = 0
+    for batch in loader:
+        batch_x, batch_y, lengths = _unpack_batch(batch)
+        if augment is not None:
+            batch_x = augment(batch_x)
+        batch_x = batch_x.to(device)
+        batch_y = batch_y.to(device)
+
+        optimizer.zero_grad()
+        logits = model(batch_x, lengths)
+        loss = criterion(logits, batch_y)
+        loss.backward()
+        optimizer.step()
+
+        running_loss += loss.item() * batch_x.size(0)
+        seen += batch_x.size(0)
+    return running_loss, seen
+
+
+def evaluate(model, loader, criterion, device):
+    """
+    Evaluate the model on a loader.
+
+    Returns:
+        (summed loss, number correct, number of samples)
+    """
+    model.eval()
+    total_loss = 0.0
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for batch in loader:
+            batch_x, batch_y, lengths = _unpack_batch(batch)
+            batch_x = batch_x.to(device)
+            batch_y = batch_y.to(device)
+
+            logits = model(batch_x, lengths)
+            loss = criterion(logits, batch_y)
+            total_loss += loss.item() * batch_x.size(0)
+
+            # predicted prob -> binary predictions
+            preds = (torch.sigmoid(logits) >= 0.5).float()
+            correct += (preds == batch_y).sum().item()
+            total += batch_y.size(0)
+    return total_loss, correct, total
@@ -0,0 +1,252 @@
+# Data-parallel CPU training for the composer classifier (GRU or dilated conv encoder).
+#
+# Spawns one process per rank on this machine and wraps the model in
+# DistributedDataParallel over the gloo backend, so gradients are all-reduced after
+# every backward pass. Each rank only loads its own shard of the normalized windows,
+# gets its own deterministic seed, and rank 0 writes a checkpoint after every epoch
+# that the run can resume from.
+#
+# Example:
+#   python train_distributed.py --world-size 16 --epochs 20 --checkpoint checkpoints/gru.pt
+#   python train_distributed.py --encoder conv --num-layers 8 --checkpoint checkpoints/conv.pt
+
+import argparse
+import logging
+import os
+import random
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from augmentation import BatchAugmenter
+from model import (
+    ENCODERS,
+    NORMALIZED_WINDOWS_DIR,
+    WindowDataset,
+    build_classifier,
+    evaluate,
+    list_window_files,
+    load_duplicate_groups,
+    pad_collate,
+    split_by_score,
+    train_one_epoch,
+)
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIM = 5  # (measure, offset, part, pitch_idx, duration) from normalize_window
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed % (2**32))
+    torch.manual_seed(seed)
+
+
+def rank_seed(base_seed, rank, epoch, world_size):
+    # Different for every rank and every epoch, but the same every time we rerun
+    # (or resume) with the same seed and world size
+    return base_seed + epoch * world_size + rank
+
+
+def save_checkpoint(path, model, optimizer, epoch, args, history):
+    """Write the checkpoint to a temp file first so a crash mid-save can't corrupt the last good one."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    torch.save(
+        {
+            "epoch": epoch,
+            "model_state": model.state_dict(),
+            "optimizer_state": optimizer.state_dict(),
+            "encoder": args.encoder,
+            "hidden_size": args.hidden_size,
+            "num_layers": args.num_layers,
+            "composers": list(args.composers),
+            "seed": args.seed,
+            "history": history,
+        },
+        tmp_path,
+    )
+    os.replace(tmp_path, path)
+
+
+def all_reduce_sums(values):
+    """Sum a list of numbers across all ranks."""
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def run(rank, args):
+    os.environ["MASTER_ADDR"] = args.master_addr
+    os.environ["MASTER_PORT"] = str(args.master_port)
+    dist.init_process_group("gloo", rank=rank, world_size=args.world_size)
+
+    # One process per core is faster than letting every process fight over all the cores
+    torch.set_num_threads(args.threads_per_rank)
+    seed_everything(rank_seed(args.seed, rank, 0, args.world_size))
+
+    samples = list_window_files(args.windows_dir, args.composers)
+    train_samples, val_samples, _ = split_by_score(
+        samples,
+        args.val_fraction,
+        args.test_fraction,
+        seed=args.seed,
+        groups=load_duplicate_groups(args.score_db),
+    )
+    if rank == 0:
+        print(
+            f"{len(train_samples)} train windows, {len(val_samples)} val windows, "
+            f"{args.world_size} ranks"
+        )
+
+    train_dataset = WindowDataset(train_samples)
+    # DistributedSampler hands every rank a disjoint slice of a shuffled order that all
+    # ranks agree on (it's seeded by seed + epoch), so each rank only reads its shard
+    train_sampler = DistributedSampler(
+        train_dataset,
+        num_replicas=args.world_size,
+        rank=rank,
+        shuffle=True,
+        seed=args.seed,
+    )
+    train_loader = DataLoader(
+        train_dataset,
+        batch_size=args.batch_size,
+        sampler=train_sampler,
+        collate_fn=pad_collate,
+    )
+    # validation is sharded without padding so the reduced metrics are exact
+    val_dataset = Subset(
+        WindowDataset(val_samples), range(rank, len(val_samples), args.world_size)
+    )
+    val_loader = DataLoader(
+        val_dataset, batch_size=args.batch_size, shuffle=False, collate_fn=pad_collate
+    )
+
+    model = build_classifier(
+        args.encoder,
+        input_size=FEATURE_DIM,
+        hidden_size=args.hidden_size,
+        num_layers=args.num_layers,
+    )
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.BCEWithLogitsLoss()
+
+    start_epoch = 0
+    history = []
+    if args.checkpoint and Path(args.checkpoint).exists():
+        checkpoint = torch.load(args.checkpoint, map_location="cpu")
+        model.load_state_dict(checkpoint["model_state"])
+        optimizer.load_state_dict(checkpoint["optimizer_state"])
+        start_epoch = checkpoint["epoch"] + 1
+        history = checkpoint.get("history", [])
+        if rank == 0:
+            print(f"Resuming from {args.checkpoint} at epoch {start_epoch + 1}")
+
+    # DDP broadcasts rank 0's parameters on construction, so every rank starts identical
+    ddp_model = DistributedDataParallel(model)
+    device = torch.device("cpu")
+
+    augment = None
+    if args.augment:
+        augment = BatchAugmenter(p=args.augment_p, generator=torch.Generator())
+
+    for epoch in range(start_epoch, args.epochs):
+        seed_everything(rank_seed(args.seed, rank, epoch, args.world_size))
+        if augment is not None:
+            # re-seeded every epoch too, so a resumed run augments epoch N exactly
+            # like an uninterrupted one
+            augment.generator.manual_seed(
+                rank_seed(args.seed, rank, epoch, args.world_size)
+            )
+        train_sampler.set_epoch(epoch)
+
+        train_loss, train_seen = train_one_epoch(
+            ddp_model, train_loader, criterion, optimizer, device, augment=augment
+        )
+        val_loss, val_correct, val_total = evaluate(
+            ddp_model, val_loader, criterion, device
+        )
+        train_loss, train_seen, val_loss, val_correct, val_total = all_reduce_sums(
+            [train_loss, train_seen, val_loss, val_correct, val_total]
+        )
+
+        if rank == 0:
+            epoch_loss = train_loss / max(train_seen, 1)
+            val_loss = val_loss / max(val_total, 1)
+            val_acc = val_correct / max(val_total, 1)
+            history.append(
+                {
+                    "epoch": epoch + 1,
+                    "train_loss": epoch_loss,
+                    "val_loss": val_loss,
+                    "val_acc": val_acc,
+                }
+            )
+            print(
+                f"Epoch [{epoch + 1}/{args.epochs}], "
+                f"Train Loss: {epoch_loss:.4f}, "
+                f"Val Loss: {val_loss:.4f}, "
+                f"Val Acc: {val_acc:.4f}"
+            )
+            if args.checkpoint:
+                save_checkpoint(
+                    args.checkpoint, model, optimizer, epoch, args, history
+                )
+
+        # nobody starts the next epoch until the checkpoint is on disk
+        dist.barrier()
+
+    dist.destroy_process_group()
+
+
+def parse_args():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(
+        description="Train the GRU classifier with DistributedDataParallel on CPU"
+    )
+    parser.add_argument("--windows-dir", type=Path, default=NORMALIZED_WINDOWS_DIR)
+    parser.add_argument("--composers", nargs=2, default=["Leah", "Mozart"])
+    parser.add_argument("--score-db", type=Path, default=Path("score_database.db"))
+    parser.add_argument("--world-size", type=int, default=cpu_count)
+    parser.add_argument("--threads-per-rank", type=int, default=1)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument(
+        "--encoder",
+        choices=sorted(ENCODERS),
+        default="gru",
+        help="gru, or conv for the parallel-in-time dilated convolution encoder",
+    )
+    parser.add_argument("--hidden-size", type=int, default=64)
+    parser.add_argument(
+        "--num-layers", type=int, help="Default: 2 for the GRU, 6 for conv"
+    )
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--augment",
+        action="store_true",
+        help="Transpose, rescale durations and shuffle parts on the fly",
+    )
+    parser.add_argument("--augment-p", type=float, default=0.5)
+    parser.add_argument("--checkpoint", type=Path, default=None)
+    parser.add_argument("--master-addr", default="127.0.0.1")
+    parser.add_argument("--master-port", type=int, default=29500)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    mp.spawn(run, args=(args,), nprocs=args.world_size, join=True)